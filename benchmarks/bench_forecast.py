@@ -0,0 +1,68 @@
+"""Benchmarks the forecast breakdown engine against the per-grade loop it replaced.
+
+Run from the project root:
+
+    python benchmarks/bench_forecast.py
+
+"""
+import pathlib
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from steel_plans_api.enums import QualityGroup
+from steel_plans_api.pipeline import analysis
+
+# the per-grade loop is kept with the tests, as the reference they check the engine against
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from tests.reference import forecast_breakdown_reference  # noqa: E402
+
+SIZES = [  # (grades, months)
+    (10, 12),
+    (100, 12),
+    (1000, 12),
+    (100, 120),
+    (1000, 120),
+    (5000, 60),
+]
+
+
+def make_history(n_grades: int, n_months: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    groups = np.array(list(QualityGroup), dtype=object)
+    months = pd.period_range('2000-01', periods=n_months, freq='M')
+
+    pm_df = pd.DataFrame({
+        'month': np.tile(months, n_grades),
+        'grade': np.repeat([f'G{i:05d}' for i in range(n_grades)], n_months),
+        'group': np.repeat(groups[np.arange(n_grades) % len(groups)], n_months),
+        'heats_produced': rng.integers(0, 200, n_grades * n_months),
+    })
+    omf_df = pd.DataFrame({
+        'month': months[-1],
+        'group': groups,
+        'heats_orders_forecasted': rng.integers(100, 500, len(groups)),
+    })
+    return omf_df, pm_df
+
+
+def bench(func, omf_df, pm_df, repeat=3):
+    period = pd.Period('2100-01', 'M')
+    timer = timeit.Timer(lambda: func(omf_df, pm_df.copy(), period))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    print(f'{"grades":>8} {"months":>8} {"reference (s)":>14} {"vectorized (s)":>15} {"speedup":>8}')
+    for n_grades, n_months in SIZES:
+        omf_df, pm_df = make_history(n_grades, n_months)
+        reference = bench(forecast_breakdown_reference, omf_df, pm_df, repeat=1)
+        vectorized = bench(analysis._do_forecast_breakdown, omf_df, pm_df)
+        print(f'{n_grades:>8} {n_months:>8} {reference:>14.4f} {vectorized:>15.4f} {reference / vectorized:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
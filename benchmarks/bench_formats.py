@@ -0,0 +1,133 @@
+"""Benchmarks uploads of the same synthetic files (see `workbooks.py`) as workbooks, CSV and Parquet files, in the
+wide layout of the workbooks and the long one with a row per entry.
+
+Reports, per file and format, the size of the file, the time to parse it to the records that get inserted and the
+time of its upload pipeline into an empty SQLite database. Parquet files are left out if pyarrow isn't installed.
+
+Run from the project root:
+
+    python benchmarks/bench_formats.py
+    python benchmarks/bench_formats.py --grades 5000 --months 120 --days 730
+
+"""
+import argparse
+import csv
+import io
+import tempfile
+import time
+
+import openpyxl
+import pandas as pd
+
+from steel_plans_api.enums import UploadFileType
+from steel_plans_api.pipeline import create_db_pipeline, db, pipelines
+from workbooks import workbooks
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _rows(content: bytes) -> list[tuple]:
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
+    try:
+        return list(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _long(file_type: UploadFileType, content: bytes) -> pd.DataFrame:
+    entries = pipelines.pipelines[file_type][0](io.BytesIO(content))
+    if not isinstance(entries, pd.DataFrame):
+        entries = pd.concat(list(entries), ignore_index=True)
+    if 'group' in entries:
+        entries['group'] = [group.value for group in entries['group']]
+    return entries
+
+
+def formats(file_type: UploadFileType, content: bytes) -> dict[str, bytes]:
+    """The workbook `content` in each format and layout"""
+
+    # rows as wide as the sheet, as spreadsheets save them to CSV
+    rows = _rows(content)
+    width = max(map(len, rows))
+    rows = [[*row, *[None] * (width - len(row))] for row in rows]
+    wide_csv = io.StringIO()
+    csv.writer(wide_csv).writerows(rows)
+    long = _long(file_type, content)
+
+    files = {
+        'xlsx': content,
+        'csv wide': wide_csv.getvalue().encode(),
+        'csv long': long.fillna('-').to_csv(index=False).encode(),
+    }
+    if pyarrow is not None:
+        # the header row as column names, and every cell of charge schedules (titles and times) as text
+        header = [f'Unnamed: {i}' if name is None else str(name) for i, name in enumerate(rows[1])]
+        wide = pd.DataFrame(rows[2:], columns=header)
+        if file_type is UploadFileType.DAILY_CHARGE_SCHEDULE:
+            wide = wide.map(lambda value: None if value is None else str(value))
+        for name, df in (('parquet wide', wide), ('parquet long', long)):
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+            files[name] = buffer.getvalue()
+    return files
+
+
+def parse(file_type: UploadFileType, content: bytes) -> int:
+    entries = pipelines.pipelines[file_type][0](io.BytesIO(content))
+    if isinstance(entries, pd.DataFrame):
+        return len(pipelines._records(entries))
+    return sum(len(pipelines._records(batch)) for batch in entries)
+
+
+def load(file_type: UploadFileType, content: bytes, directory: str):
+    engine = db._create_engine(f'sqlite:///{directory}/bench.db', pool_size=1)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            create_db_pipeline(file_type)(conn, io.BytesIO(content))
+    finally:
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grades', type=int, default=1000)
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--charges', type=int, default=24, help='charges per day')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pd.set_option('future.no_silent_downcasting', True)
+    if pyarrow is None:
+        print('pyarrow is not installed, Parquet files are left out\n')
+
+    files = workbooks(args.grades, args.months, args.days, args.charges)
+    print(f'{"file":<24} {"format":<14} {"MB":>7} {"rows":>9} {"parse (s)":>10} {"load (s)":>9} {"vs xlsx":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_type, workbook in files.items():
+            xlsx_seconds = None
+            for name, content in formats(file_type, workbook).items():
+                rows = parse(file_type, content)
+                parse_seconds = best_of(lambda: parse(file_type, content), args.repeat)
+                load_seconds = best_of(lambda: load(file_type, content, tmp), args.repeat)
+                xlsx_seconds = xlsx_seconds or load_seconds
+                print(f'{file_type.stem:<24} {name:<14} {len(content) / 1e6:>7.1f} {rows:>9} {parse_seconds:>10.3f} '
+                      f'{load_seconds:>9.3f} {xlsx_seconds / load_seconds:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
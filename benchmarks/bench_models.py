@@ -0,0 +1,72 @@
+"""Benchmarks the latency of forecasting a month from a snapshot with each model of the registry. EWM forecasts read
+the smoothing state maintained on upload (the default path of `/forecast/production/`), the other models the
+production history.
+
+Run from the project root:
+
+    python benchmarks/bench_models.py
+
+"""
+import timeit
+
+import pandas as pd
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline import db, models, smoothing, snapshot
+from bench_forecast import make_history
+
+SIZES = [  # (grades, months)
+    (100, 12),
+    (1000, 60),
+    (5000, 60),
+    (1000, 240),
+]
+
+
+def bench(func, repeat=3):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def make_snapshot(omf_df: pd.DataFrame, pm_df: pd.DataFrame) -> snapshot.Snapshot:
+    """Snapshot of a database holding the production history and order forecasts"""
+
+    engine = sqla.create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            conn.execute(sqla.insert(db.month_steel_production), [
+                {'month': row.month.start_time.date(), 'group': row.group, 'grade': row.grade,
+                 'short_tons': int(row.heats_produced) * db.TONS_PER_HEAT}
+                for row in pm_df.itertuples()
+            ])
+            conn.execute(sqla.insert(db.month_group_order_forecast), [
+                {'month': row.month.start_time.date(), 'group': row.group,
+                 'heats_orders_forecasted': int(row.heats_orders_forecasted)}
+                for row in omf_df.itertuples()
+            ])
+            smoothing.refresh_smoothing_state(conn)
+            return snapshot.build(conn, db.get_dataset_versions(conn, *snapshot.TABLES))
+    finally:
+        engine.dispose()
+
+
+def main():
+    methods = list(ForecastMethod)
+    print(f'{"grades":>8} {"months":>8} ' + ' '.join(f'{method.value + " (ms)":>20}' for method in methods))
+    for n_grades, n_months in SIZES:
+        omf_df, pm_df = make_history(n_grades, n_months)
+        # order forecasts of the month after the history
+        omf_df['month'] = pm_df['month'].max() + 1
+        month = omf_df['month'].iat[0].start_time.date()
+        snap = make_snapshot(omf_df, pm_df)
+
+        timings = [bench(lambda: models.forecast_snapshot(snap, month, dict.fromkeys(QualityGroup, method)))
+                   for method in methods]
+        print(f'{n_grades:>8} {n_months:>8} ' + ' '.join(f'{timing * 1e3:>20.2f}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmarks the columnar parsers against the model based ones, through to the records that get inserted,
+and peak memory of the streaming charge schedule parser against the columnar one.
+
+Run from the project root:
+
+    python benchmarks/bench_parsing.py
+
+"""
+import io
+import time
+import tracemalloc
+
+import pandas as pd
+
+from steel_plans_api.pipeline import parsing, pipelines
+from workbooks import charge_schedule_workbook, production_workbook
+
+CASES = [  # (name, workbook, model parser, columnar parser)
+    ('production 100 grades x 24 months', lambda: production_workbook(100, 24),
+     parsing.parse_monthly_steel_grade_file, parsing.parse_monthly_steel_grade_file_columnar),
+    ('production 1000 grades x 60 months', lambda: production_workbook(1000, 60),
+     parsing.parse_monthly_steel_grade_file, parsing.parse_monthly_steel_grade_file_columnar),
+    ('charges 30 days x 20 charges', lambda: charge_schedule_workbook(30, 20),
+     parsing.parse_daily_charge_schedule_file, parsing.parse_daily_charge_schedule_file_columnar),
+    ('charges 365 days x 20 charges', lambda: charge_schedule_workbook(365, 20),
+     parsing.parse_daily_charge_schedule_file, parsing.parse_daily_charge_schedule_file_columnar),
+]
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def consume(batches):
+    for batch in batches:
+        pipelines._records(batch)
+
+
+def main():
+    pd.set_option('future.no_silent_downcasting', True)
+
+    print(f'{"workbook":<36} {"read_excel (s)":>15} {"models (s)":>11} {"columnar (s)":>13} {"rows":>8}')
+    for name, workbook, parser, columnar_parser in CASES:
+        content = workbook()
+        read, _ = best_of(lambda: pd.read_excel(io.BytesIO(content), skiprows=1))
+        models, _ = best_of(lambda: [model.model_dump() for model in parser(io.BytesIO(content))])
+        columnar, records = best_of(lambda: pipelines._records(columnar_parser(io.BytesIO(content))))
+        print(f'{name:<36} {read:>15.3f} {models:>11.3f} {columnar:>13.3f} {len(records):>8}')
+
+    print()
+    print(f'{"charges x 20 per day":<36} {"columnar (MB)":>15} {"streaming (MB)":>15}')
+    for n_days in (30, 365, 1000):
+        content = charge_schedule_workbook(n_days, 20)
+        columnar = peak_memory(
+            lambda: pipelines._records(parsing.parse_daily_charge_schedule_file_columnar(io.BytesIO(content))))
+        streaming = peak_memory(lambda: consume(parsing.iter_daily_charge_schedule_file(io.BytesIO(content))))
+        print(f'{f"{n_days} days":<36} {columnar / 1e6:>15.1f} {streaming / 1e6:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Benchmarks parsing, loading and forecasting at production sizes, on synthetic workbooks (see `workbooks.py`).
+
+Measures the time, throughput and peak memory (traced by tracemalloc, in a run of its own) of:
+- parse.<file>: the parser of each upload file type, to the entries that get inserted
+- load.<file>: its upload pipeline into an empty SQLite database (`write_seconds` is the time spent inserting)
+- forecast.history: `_do_forecast_breakdown` of the month after the production history, from all of it
+- snapshot.build: the columnar snapshot of the database (`snapshot.build` and writing it)
+- forecast.snapshot: the same forecast from the memory-mapped snapshot, as `/forecast/production/` does
+
+Results are saved as JSON, by default to `benchmarks/results/<commit>.json`, and can be compared to the results of
+another commit, which reports the benchmarks that got slower or bigger than `--threshold`.
+
+Run from the project root:
+
+    python benchmarks/bench_scale.py
+    python benchmarks/bench_scale.py --sizes large --missing-rate 0.01
+    python benchmarks/bench_scale.py --compare benchmarks/results/<other commit>.json
+
+"""
+import argparse
+import datetime
+import io
+import json
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from steel_plans_api import metrics, settings
+from steel_plans_api.enums import ForecastMethod, QualityGroup, UploadFileType
+from steel_plans_api.pipeline import analysis, create_db_pipeline, db, models, pipelines, snapshot
+from workbooks import workbooks
+
+RESULTS_DIR = pathlib.Path(__file__).parent / 'results'
+
+SIZES = {  # grades, months, days of charge schedules, charges per day
+    'small': (100, 24, 90, 20),
+    'medium': (1000, 60, 365, 24),
+    'large': (5000, 120, 730, 24),
+}
+
+# order forecasts are loaded before production, as uploads usually are, so that its upload refreshes forecasts too
+LOAD_ORDER = [UploadFileType.MONTHLY_ORDER_FORECAST, UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION,
+              UploadFileType.DAILY_CHARGE_SCHEDULE]
+
+
+def _name(file_type: UploadFileType) -> str:
+    return file_type.value.removesuffix('.xlsx')
+
+
+def traced(func):
+    """Result of `func`, and its peak memory in bytes"""
+
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def parse(file_type: UploadFileType, content: bytes) -> int:
+    entries = pipelines.pipelines[file_type][0](io.BytesIO(content))
+    if isinstance(entries, pd.DataFrame):
+        return len(pipelines._records(entries))
+    return sum(len(pipelines._records(batch)) for batch in entries)
+
+
+def load(files: dict[UploadFileType, bytes], directory: str, *, trace: bool = False) -> dict[str, dict]:
+    """Loads the files into an empty database, returning the stats of each upload (and its peak memory if `trace`)"""
+
+    engine = db._create_engine(f'sqlite:///{directory}/bench.db', pool_size=1)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    try:
+        results = {}
+        for file_type in LOAD_ORDER:
+            save_file_to_db = create_db_pipeline(file_type)
+            written = metrics.STAGE_SECONDS.sum(stage='upload.write')
+            with engine.begin() as conn:
+                if trace:
+                    stats, peak = traced(lambda: save_file_to_db(conn, io.BytesIO(files[file_type])))
+                else:
+                    stats, peak = save_file_to_db(conn, io.BytesIO(files[file_type])), None
+            results[_name(file_type)] = {
+                'seconds': stats.seconds, 'rows': stats.rows, 'rows_per_second': stats.rows_per_second,
+                'write_seconds': metrics.STAGE_SECONDS.sum(stage='upload.write') - written,
+            } | ({'peak_mb': peak / 1e6} if trace else {})
+        return results
+    finally:
+        engine.dispose()
+
+
+def forecast_inputs(directory: str):
+    """Month after the production history in the database, its order forecast, the history and the number of grades
+    with a smoothing state before it"""
+
+    engine = db._create_engine(f'sqlite:///{directory}/bench.db', pool_size=1)
+    try:
+        with engine.connect() as conn:
+            history = conn.execute(db.select_production_history()).mappings().all()
+            month = analysis.add_months(max(row['month'] for row in history), 1)
+            omf = conn.execute(db.select_order_forecasts(month, analysis.add_months(month, 1))).mappings().all()
+            grades = len(conn.execute(db.select_smoothing_state(month)).all())
+    finally:
+        engine.dispose()
+
+    omf_df = pd.DataFrame(omf, columns=['month', 'group', 'heats_orders_forecasted'])
+    history_df = pd.DataFrame(history, columns=['month', 'group', 'grade', 'heats_produced'])
+    history_df['month'] = pd.to_datetime(history_df['month']).dt.to_period('M')
+    return month, omf_df, history_df, grades
+
+
+def write_snapshot(directory: str) -> snapshot.Snapshot:
+    """Builds and writes the snapshot of the database, opening it from its files"""
+
+    engine = db._create_engine(f'sqlite:///{directory}/bench.db', pool_size=1)
+    settings.SNAPSHOT_DIR = f'{directory}/snapshots'
+    shutil.rmtree(settings.SNAPSHOT_DIR, ignore_errors=True)
+    snapshot.clear()
+    try:
+        with engine.connect() as conn:
+            return snapshot.get_snapshot(conn)
+    finally:
+        engine.dispose()
+
+
+def run_size(n_grades: int, n_months: int, n_days: int, n_charges: int, repeat: int, missing_rate: float) -> dict:
+    files = workbooks(n_grades, n_months, n_days, n_charges, missing_rate=missing_rate)
+    results = {}
+
+    for file_type in LOAD_ORDER:
+        content = files[file_type]
+        rows, peak = traced(lambda: parse(file_type, content))
+        seconds = best_of(lambda: parse(file_type, content), repeat)
+        results[f'parse.{_name(file_type)}'] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds,
+                                                'peak_mb': peak / 1e6, 'file_mb': len(content) / 1e6}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        peaks = load(files, tmp, trace=True)
+        runs = [load(files, tmp) for _ in range(repeat)]
+        for file_type in LOAD_ORDER:
+            name = _name(file_type)
+            best = min((run[name] for run in runs), key=lambda stats: stats['seconds'])
+            results[f'load.{name}'] = best | {'peak_mb': peaks[name]['peak_mb']}
+
+        month, omf_df, history_df, grades = forecast_inputs(tmp)
+        snap, peak = traced(lambda: write_snapshot(tmp))
+        seconds = best_of(lambda: write_snapshot(tmp), repeat)
+        rows = len(snap.production_month) + len(snap.orders_month) + len(snap.state_month)
+        results['snapshot.build'] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds,
+                                     'peak_mb': peak / 1e6}
+
+        period = pd.Period(month, freq='M')
+        ewm = dict.fromkeys(QualityGroup, ForecastMethod.EWM)
+        for name, func in (
+            ('forecast.history', lambda: analysis._do_forecast_breakdown(omf_df, history_df.copy(), period)),
+            ('forecast.snapshot', lambda: models.forecast_snapshot(snap, month, ewm)),
+        ):
+            _, peak = traced(func)
+            seconds = best_of(func, repeat)
+            results[name] = {'seconds': seconds, 'grades': grades, 'grades_per_second': grades / seconds,
+                             'peak_mb': peak / 1e6}
+
+    return results
+
+
+def commit() -> str:
+    """Short hash of the checked out commit, marked dirty if the tree has changes"""
+
+    def git(*args):
+        return subprocess.run(['git', *args], capture_output=True, text=True)
+
+    head = git('rev-parse', '--short', 'HEAD')
+    if head.returncode:
+        return 'unknown'
+    return head.stdout.strip() + ('-dirty' if git('diff', '--quiet', 'HEAD').returncode else '')
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints how each benchmark changed since the baseline, returning the ones that regressed"""
+
+    regressions = []
+    print(f'\ncompared to {baseline["commit"]}:')
+    print(f'{"size":<8} {"benchmark":<36} {"seconds":>10} {"change":>8} {"peak MB":>9} {"change":>8}')
+    for size, benchmarks in results['sizes'].items():
+        for name, stats in benchmarks.items():
+            before = baseline['sizes'].get(size, {}).get(name)
+            if before is None:
+                continue
+            changes = []
+            for key in ('seconds', 'peak_mb'):
+                change = stats[key] / before[key] - 1 if before.get(key) else 0.
+                changes.append(change)
+                if change > threshold:
+                    regressions.append(f'{size} {name} {key}')
+            flag = ' <' if max(changes) > threshold else ''
+            print(f'{size:<8} {name:<36} {stats["seconds"]:>10.4f} {changes[0]:>+8.1%} {stats["peak_mb"]:>9.1f} '
+                  f'{changes[1]:>+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--missing-rate', type=float, default=0.)
+    parser.add_argument('--output', type=pathlib.Path, help='where to save results (results/<commit>.json)')
+    parser.add_argument('--compare', type=pathlib.Path, help='results of another commit to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative increase of time or memory reported as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    pd.set_option('future.no_silent_downcasting', True)
+    results = {
+        'commit': commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'missing_rate': args.missing_rate,
+        'sizes': {},
+    }
+
+    print(f'{"size":<8} {"benchmark":<36} {"seconds":>10} {"throughput":>14} {"peak MB":>9}')
+    for size in args.sizes:
+        n_grades, n_months, n_days, n_charges = SIZES[size]
+        benchmarks = results['sizes'][size] = run_size(n_grades, n_months, n_days, n_charges, args.repeat,
+                                                       args.missing_rate)
+        for name, stats in benchmarks.items():
+            unit = 'rows' if 'rows' in stats else 'grades'
+            throughput = f'{stats[f"{unit}_per_second"]:,.0f} {unit}/s'
+            print(f'{size:<8} {name:<36} {stats["seconds"]:>10.4f} {throughput:>14} {stats["peak_mb"]:>9.1f}')
+
+    output = args.output or RESULTS_DIR / f'{results["commit"]}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f'\nsaved to {output}')
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions above {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
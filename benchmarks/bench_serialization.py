@@ -0,0 +1,53 @@
+"""Benchmarks writing forecast responses from arrays against validating and dumping a model per grade.
+
+Run from the project root:
+
+    python benchmarks/bench_serialization.py
+
+"""
+import datetime
+import timeit
+
+from steel_plans_api.pipeline import analysis
+from steel_plans_api.responses import Meta, ResponseForecast, dump_forecast
+from bench_forecast import make_history
+
+SIZES = [10, 100, 1000, 10000]  # grades
+
+
+def models(meta, groups):
+    # what forecasts went through before: a validated model per grade, then the response model dumped
+    response = ResponseForecast(meta=meta, month='2100-01', groups=[
+        analysis.ForecastProductionGroup(
+            group=group.group,
+            heats=group.heats,
+            grades=[analysis.ForecastProductionGrade(grade=grade, heats=heats, proportion=proportion)
+                    for grade, heats, proportion in zip(group.grades.tolist(), group.grade_heats.tolist(),
+                                                        group.proportions.tolist())],
+        )
+        for group in groups
+    ])
+    return response.model_dump_json().encode()
+
+
+def bench(func, repeat=3):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    meta = Meta(timestamp=datetime.datetime.now(), version='bench')
+    print(f'{"grades":>8} {"models (ms)":>12} {"arrays (ms)":>12} {"speedup":>8}')
+    for n_grades in SIZES:
+        omf_df, pm_df = make_history(n_grades, 12)
+        pm_df['proportion'] = analysis._proportions(pm_df)
+        groups = analysis._breakdown_smoothed_arrays(omf_df, analysis._smooth_grade_proportions(pm_df))
+
+        slow = bench(lambda: models(meta, groups))
+        fast = bench(lambda: dump_forecast(meta, '2100-01', groups))
+        print(f'{n_grades:>8} {slow * 1e3:>12.3f} {fast * 1e3:>12.3f} {slow / fast:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmarks startup: the time to import the package (with the pipeline modules imported on first use, and all of
+them), and the time `steel-plans-api serve` takes to answer its first health check, docs and upload, with one worker
+importing the pipeline modules on first use and with forked workers sharing the ones their parent imported.
+
+Run from the project root:
+
+    python benchmarks/bench_startup.py
+
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+DATA_DIR = pathlib.Path(__file__).parents[1] / 'tests' / 'data'
+
+IMPORTS = {
+    'lazy': 'import steel_plans_api',
+    'preloaded': 'import steel_plans_api.pipeline; steel_plans_api.pipeline.preload()',
+}
+
+
+def import_seconds(statement: str) -> float:
+    code = f'import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)'
+    return float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout)
+
+
+def first_responses(port: int, workers: int) -> dict[str, float]:
+    """Seconds from starting the server to its first answers"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = os.environ | {
+            'STEEL_PLANS_DATABASE_URL': f'sqlite:///{tmp}/app.db',
+            'STEEL_PLANS_JOBS_DIR': f'{tmp}/jobs',
+            'STEEL_PLANS_SNAPSHOT_DIR': f'{tmp}/snapshots',
+        }
+        command = [sys.executable, '-m', 'steel_plans_api', 'serve', '--port', str(port), '--workers', str(workers)]
+        start = time.perf_counter()
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            timings = {}
+            with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=60) as client:
+                while True:
+                    try:
+                        client.get('/health').raise_for_status()
+                        break
+                    except httpx.TransportError:
+                        time.sleep(0.005)
+                timings['health'] = time.perf_counter() - start
+
+                client.get('/openapi.json').raise_for_status()
+                timings['docs'] = time.perf_counter() - start
+
+                upload_start = time.perf_counter()
+                with open(DATA_DIR / 'product_groups_monthly.xlsx', 'rb') as f:
+                    client.post('/files/product_groups_monthly.xlsx', files={'file': f}).raise_for_status()
+                timings['first upload'] = time.perf_counter() - upload_start
+            return timings
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, statement in IMPORTS.items():
+        timings = [import_seconds(statement) for _ in range(args.repeat)]
+        print(f'import {name:>9}: min {min(timings) * 1e3:7.1f} ms, median {statistics.median(timings) * 1e3:7.1f} ms')
+
+    for workers in (1, 2, 4):
+        runs = [first_responses(args.port, workers) for _ in range(args.repeat)]
+        stats = ', '.join(f'{key} {min(run[key] for run in runs) * 1e3:.0f} ms' for key in runs[0])
+        print(f'serve --workers {workers}: {stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Load test: forecast latency while large files are being uploaded.
+
+Starts the API on a temporary database, then measures `/forecast/production/` latencies with no uploads running,
+and again while several clients keep uploading a large production history workbook.
+
+Run from the project root:
+
+    python benchmarks/load_forecast_during_uploads.py
+
+"""
+import argparse
+import concurrent.futures
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from workbooks import production_workbook
+
+DATA_DIR = pathlib.Path(__file__).parents[1] / 'tests' / 'data'
+
+
+def serve(port: int):
+    import uvicorn
+
+    uvicorn.run('steel_plans_api.endpoints:app', port=port, log_level='warning')
+
+
+def percentiles(latencies):
+    return {f'p{q}': np.percentile(latencies, q) * 1000 for q in (50, 90, 99)} | {'max': max(latencies) * 1000}
+
+
+def measure_forecasts(base_url: str, n_requests: int, n_clients: int):
+    def client_latencies(_):
+        latencies = []
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            for _ in range(n_requests // n_clients):
+                start = time.perf_counter()
+                client.get('/forecast/production/', params={'month': '2024-09'}).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with concurrent.futures.ThreadPoolExecutor(n_clients) as executor:
+        return [latency for latencies in executor.map(client_latencies, range(n_clients)) for latency in latencies]
+
+
+def seed(base_url: str):
+    """Waits for the server to start, and uploads the test data it forecasts from"""
+
+    with httpx.Client(base_url=base_url, timeout=120) as client:
+        for _ in range(100):
+            try:
+                client.get('/docs')
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        for file_type in ('steel_grade_production.xlsx', 'product_groups_monthly.xlsx'):
+            with open(DATA_DIR / file_type, 'rb') as f:
+                client.post(f'/files/{file_type}', files={'file': (file_type, f)}).raise_for_status()
+
+
+def measure_forecasts_uploading(base_url: str, workbook: bytes, n_uploaders: int, n_requests: int, n_clients: int):
+    """Forecast latencies while `n_uploaders` clients keep uploading `workbook`, and the status of each upload"""
+
+    stop = threading.Event()
+    uploads = []
+
+    def upload():
+        with httpx.Client(base_url=base_url, timeout=600) as client:
+            while not stop.is_set():
+                # the history overlaps with what is stored from the second upload on, which is parsed
+                # in full before the conflict is found
+                response = client.post('/files/steel_grade_production.xlsx',
+                                       files={'file': ('steel_grade_production.xlsx', workbook)})
+                uploads.append(response.status_code)
+
+    uploaders = [threading.Thread(target=upload) for _ in range(n_uploaders)]
+    for uploader in uploaders:
+        uploader.start()
+    time.sleep(1)
+    try:
+        return measure_forecasts(base_url, n_requests, n_clients), uploads
+    finally:
+        stop.set()
+        for uploader in uploaders:
+            uploader.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--grades', type=int, default=300)
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--uploaders', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port)
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    workbook = production_workbook(args.grades, args.months)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # forecasts are cached, turn it off so every request does the work
+        env = os.environ | {
+            'STEEL_PLANS_FORECAST_CACHE_SIZE': '0',
+            'STEEL_PLANS_DATABASE_URL': f'sqlite:///{tmp}/app.db',
+            'STEEL_PLANS_JOBS_DIR': f'{tmp}/jobs',
+            'STEEL_PLANS_SNAPSHOT_DIR': f'{tmp}/snapshots',
+        }
+        server = subprocess.Popen([sys.executable, __file__, '--port', str(args.port), '--serve'], env=env)
+        try:
+            seed(base_url)
+            idle = measure_forecasts(base_url, args.requests, args.clients)
+            busy, uploads = measure_forecasts_uploading(base_url, workbook, args.uploaders, args.requests, args.clients)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f'workbook: {args.grades} grades x {args.months} months ({len(workbook) / 1e6:.1f} MB), '
+          f'{len(uploads)} uploads ({", ".join(sorted(set(map(str, uploads))))})')
+    for name, latencies in (('idle', idle), ('uploading', busy)):
+        stats = ', '.join(f'{key} {value:.1f} ms' for key, value in percentiles(latencies).items())
+        print(f'forecast latency {name:>9}: {stats}')
+
+
+if __name__ == '__main__':
+    main()
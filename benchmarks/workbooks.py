@@ -0,0 +1,163 @@
+"""Synthetic workbooks in the layouts the parsers expect, at any size.
+
+Write a full set of upload files (production history, order forecasts and charge schedule, with the same grades and
+months) to a directory:
+
+    python benchmarks/workbooks.py data/large --grades 5000 --months 120 --days 365 --charges 24
+
+Cells are left empty at `missing_rate` (grades and mould sizes of charges are `-`, as in the schedules of the plant).
+Month columns of production histories and order forecasts keep at most the empty cells the parsers impute, more would
+get them dropped.
+
+"""
+import argparse
+import datetime
+import io
+import pathlib
+
+import numpy as np
+import openpyxl
+
+from steel_plans_api.enums import UploadFileType
+from steel_plans_api.pipeline import parsing
+
+GROUPS = ['Rebar', 'MBQ', 'SBQ', 'CHQ']
+MOULD_SIZES = ['5"', '6" RD', '6 1/4"', '7"', '8" SQ']
+# months are dated on the 24th, as in the plant's files
+FIRST_MONTH = datetime.datetime(2000, 1, 24)
+
+
+def _months(n_months: int, first: datetime.datetime = FIRST_MONTH) -> list[datetime.datetime]:
+    return [first.replace(year=first.year + (first.month - 1 + m) // 12, month=(first.month - 1 + m) % 12 + 1)
+            for m in range(n_months)]
+
+
+def _grades(n_grades: int) -> list[str]:
+    return [f'G{i:05d}' for i in range(n_grades)]
+
+
+def _save(workbook: openpyxl.Workbook) -> bytes:
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _with_missing(values: np.ndarray, rng: np.random.Generator, missing_rate: float) -> list:
+    """Rows of `values` as lists, with cells replaced by None at `missing_rate`, up to the empty cells the parsers
+    impute per column"""
+
+    missing = rng.random(values.shape) < missing_rate
+    missing &= np.cumsum(missing, axis=0) <= parsing._DEFAULT_MAX_ALLOWED_MISSING_VALUES_PER_COLUMN
+    # parsers impute a column's median and reject fractional counts, columns with empty cells keep an odd number of
+    # values so that their median is one of them
+    even = missing.any(axis=0) & ((~missing).sum(axis=0) % 2 == 0)
+    missing[missing.argmax(axis=0)[even], np.nonzero(even)[0]] = False
+
+    rows = values.tolist()
+    for row, column in zip(*np.nonzero(missing)):
+        rows[row][column] = None
+    return rows
+
+
+def production_workbook(n_grades: int, n_months: int, seed: int = 0, *, missing_rate: float = 0.) -> bytes:
+    """Production history in the layout of steel_grade_production.xlsx, grades sorted by quality group which is
+    only named on its first row"""
+
+    rng = np.random.default_rng(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Production history (short tons)'])
+    sheet.append(['Quality group', 'Grade', *_months(n_months)])
+
+    groups = [GROUPS[i % len(GROUPS)] for i in range(n_grades)]
+    order = sorted(range(n_grades), key=lambda i: GROUPS.index(groups[i]))
+    grades = _grades(n_grades)
+    short_tons = _with_missing(rng.integers(0, 10_000, (n_grades, n_months)), rng, missing_rate)
+    previous = None
+    for i in order:
+        sheet.append([groups[i] if groups[i] != previous else None, grades[i], *short_tons[i]])
+        previous = groups[i]
+
+    return _save(workbook)
+
+
+def order_forecast_workbook(n_months: int, seed: int = 0, *, missing_rate: float = 0.) -> bytes:
+    """Heats ordered per quality group and month in the layout of product_groups_monthly.xlsx"""
+
+    rng = np.random.default_rng(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Order forecast (heats per quality group)'])
+    sheet.append(['Quality:', *_months(n_months)])
+
+    heats = _with_missing(rng.integers(10, 500, (len(GROUPS), n_months)), rng, missing_rate)
+    for group, row in zip(GROUPS, heats):
+        sheet.append([group, *row])
+
+    return _save(workbook)
+
+
+def charge_schedule_workbook(n_days: int, n_charges: int, seed: int = 0, *, n_grades: int = 50,
+                             missing_rate: float = 0.) -> bytes:
+    """Charges per day in the layout of daily_charge_schedule.xlsx"""
+
+    rng = np.random.default_rng(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Daily charge schedule'])
+    first_day = FIRST_MONTH.replace(day=1)
+    sheet.append([cell for day in range(n_days) for cell in (first_day + datetime.timedelta(days=day), None, None)])
+    sheet.append(['Start time', 'Grade', 'Mould size'] * n_days)
+
+    minutes = np.sort(rng.integers(0, 24 * 60, (n_charges, n_days)), axis=0)
+    grades = np.array(_grades(n_grades), dtype=object)[rng.integers(0, n_grades, (n_charges, n_days))]
+    mould_sizes = np.array(MOULD_SIZES, dtype=object)[rng.integers(0, len(MOULD_SIZES), (n_charges, n_days))]
+    for values in (grades, mould_sizes):
+        values[rng.random(values.shape) < missing_rate] = '-'
+
+    for charge in range(n_charges):
+        row = []
+        for day in range(n_days):
+            start_time = datetime.datetime(1900, 1, 1) + datetime.timedelta(minutes=int(minutes[charge, day]))
+            row += [start_time, grades[charge, day], mould_sizes[charge, day]]
+        sheet.append(row)
+
+    return _save(workbook)
+
+
+def workbooks(n_grades: int, n_months: int, n_days: int, n_charges: int, seed: int = 0, *,
+              missing_rate: float = 0., forecast_months: int = 12) -> dict[UploadFileType, bytes]:
+    """A set of upload files about the same grades and months, with order forecasts for the months of the
+    production history and `forecast_months` after it"""
+
+    return {
+        UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION: production_workbook(n_grades, n_months, seed,
+                                                                           missing_rate=missing_rate),
+        UploadFileType.MONTHLY_ORDER_FORECAST: order_forecast_workbook(n_months + forecast_months, seed,
+                                                                       missing_rate=missing_rate),
+        UploadFileType.DAILY_CHARGE_SCHEDULE: charge_schedule_workbook(n_days, n_charges, seed, n_grades=n_grades,
+                                                                       missing_rate=missing_rate),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', type=pathlib.Path)
+    parser.add_argument('--grades', type=int, default=1000)
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--charges', type=int, default=24, help='charges per day')
+    parser.add_argument('--missing-rate', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    args.directory.mkdir(parents=True, exist_ok=True)
+    files = workbooks(args.grades, args.months, args.days, args.charges, args.seed, missing_rate=args.missing_rate)
+    for file_type, content in files.items():
+        path = args.directory / file_type.value
+        path.write_bytes(content)
+        print(f'{path} ({len(content) / 1e6:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,160 @@
+import argparse
+import contextlib
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
 import uvicorn
 
+from . import settings
+
+APP = 'steel_plans_api.endpoints:app'
+
+# workers exiting sooner than this after they were forked are replaced only once it passed, so that workers failing
+# on startup aren't forked again in a loop
+RESPAWN_SECONDS = 1.
+
+
+def _run_worker(config: uvicorn.Config, sock, slot: int):
+    # uvicorn handles the signals of its server, not the parent's handlers
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # background jobs are loaded by a single process (see `JobQueue.start`)
+    settings.RUN_JOBS = settings.RUN_JOBS and slot == 0
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork_worker(config: uvicorn.Config, sock, slot: int) -> int:
+    """Forks a worker serving requests from `sock` in `slot`, returning its pid"""
+
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            _run_worker(config, sock, slot)
+            code = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    return pid
+
+
+def _reap_workers(config: uvicorn.Config, sock, children: dict[int, tuple[int, float]], stopping: threading.Event):
+    """Waits for the workers in `children` to exit, replacing each one in its slot until `stopping` is set"""
+
+    while children:
+        pid, _ = os.wait()
+        slot, forked_at = children.pop(pid)
+        if not stopping.is_set():
+            time.sleep(max(0., RESPAWN_SECONDS - (time.monotonic() - forked_at)))
+        if not stopping.is_set():
+            children[_fork_worker(config, sock, slot)] = (slot, time.monotonic())
+
+
+def serve_forked(config: uvicorn.Config, workers: int):
+    """Serves requests from `workers` processes, forked once this one imported the app and the pipeline modules.
+
+    Workers share the modules instead of importing them each, listen on the socket bound here, and are replaced
+    when they exit (e.g. after `config.limit_max_requests` requests) until this process gets SIGINT or SIGTERM.
+
+    """
+
+    from .pipeline import preload
+
+    config.load()
+    preload()
+    sock = config.bind_socket()
+
+    children: dict[int, tuple[int, float]] = {}  # slot and fork time of each worker
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+        for pid in children:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for slot in range(workers):
+        children[_fork_worker(config, sock, slot)] = (slot, time.monotonic())
+
+    _reap_workers(config, sock, children, stopping)
+    sock.close()
+
+
+def serve(args: argparse.Namespace):
+    """Runs the API, from a single process importing the pipeline modules on first use, or forked workers"""
+
+    config = uvicorn.Config(APP, host=args.host, port=args.port, limit_concurrency=args.limit_concurrency,
+                            limit_max_requests=args.limit_max_requests, timeout_keep_alive=args.timeout_keep_alive)
+    if args.workers > 1:
+        serve_forked(config, args.workers)
+    else:
+        uvicorn.Server(config).run()
+
+
+def backtest(alphas: list[float] | None, apply: bool):
+    """Prints the backtesting errors of each quality group, and stores the alphas chosen if `apply`"""
+
+    from .pipeline import backtesting, db, smoothing
+
+    with db.get_engine().begin() as conn:
+        history = conn.execute(db.select_production_history()).mappings().all()
+        result = backtesting.backtest(history, alphas or backtesting.ALPHA_GRID)
+        report = result.report(dict(conn.execute(db.select_smoothing_alphas()).all()))
+
+        for group in report:
+            print(f"{group['group'].value}: alpha {group['alpha']:.2f} (currently {group['current_alpha']:.2f})")
+            for errors in group['errors']:
+                mape = '-' if errors['mape'] is None else f"{errors['mape']:.1f}%"
+                print(f"  alpha {errors['alpha']:.2f}  MAE {errors['mae']:.2f}  MAPE {mape}")
+
+        if apply:
+            smoothing.set_smoothing_alphas(conn, {group['group']: group['alpha'] for group in report},
+                                           {group['group']: group['mae'] for group in report})
+            print('Forecasts now use the alphas chosen')
+
 
 def main():
-    uvicorn.run("steel_plans_api.endpoints:app")
+    parser = argparse.ArgumentParser(prog='steel-plans-api')
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help='Run the API (the default)')
+    serve_parser.add_argument('--host', default=settings.HOST, help='address to listen on (default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=settings.PORT, help='port to listen on (default: %(default)s)')
+    serve_parser.add_argument('--workers', type=int, default=settings.WORKERS,
+                              help='worker processes serving requests (default: %(default)s)')
+    serve_parser.add_argument('--limit-concurrency', type=int,
+                              help='connections and tasks per worker before new requests get a 503 (no limit by default)')
+    serve_parser.add_argument('--limit-max-requests', type=int,
+                              help='requests a worker serves before it is replaced (never by default)')
+    serve_parser.add_argument('--timeout-keep-alive', type=int, default=5,
+                              help='seconds idle connections are kept open (default: %(default)s)')
+    backtest_parser = commands.add_parser('backtest', help='Backtest forecasts over the production history')
+    backtest_parser.add_argument('--alpha', type=float, action='append', dest='alphas',
+                                 help='smoothing factor to try, repeated (0.05 to 0.95 by default)')
+    backtest_parser.add_argument('--apply', action='store_true',
+                                 help="make forecasts use each quality group's best alpha")
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(['serve'])
+
+    if args.command == 'backtest':
+        if args.alphas and not all(0 < alpha <= 1 for alpha in args.alphas):
+            parser.error('alphas must be in (0, 1]')
+        backtest(args.alphas, args.apply)
+    else:
+        if args.workers < 1:
+            parser.error('workers must be at least 1')
+        if args.workers > 1 and not hasattr(os, 'fork'):
+            parser.error('several workers are forked, which this platform does not support')
+        serve(args)
 
 
 if __name__ == '__main__':
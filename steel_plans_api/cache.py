@@ -0,0 +1,67 @@
+import collections
+import hashlib
+import threading
+from typing import Hashable
+
+from . import settings
+
+__all__ = (
+    'LRUCache',
+    'forecast_cache',
+    'etag',
+    'etag_matches',
+)
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts its least recently used entries past `maxsize`"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+
+def etag(key: Hashable) -> str:
+    """Weak entity tag for responses that are equivalent for the same `key`, though their bytes may differ (e.g. the
+    time they were made at)"""
+
+    return 'W/"' + hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, tag: str) -> bool:
+    """Whether an If-None-Match header matches `tag` (weak comparison, as RFC 9110 requires for it)"""
+
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')}
+    return '*' in candidates or tag.removeprefix('W/') in candidates
+
+
+# serialized forecasts, keyed by database id, month, smoothing factor, data versions and methods
+forecast_cache = LRUCache(settings.FORECAST_CACHE_SIZE)
@@ -0,0 +1,30 @@
+import contextlib
+import threading
+
+__all__ = (
+    'Busy',
+    'ConcurrencyLimiter',
+)
+
+
+class Busy(Exception):
+    """Raised when a limiter's queue is full"""
+
+
+class ConcurrencyLimiter:
+    """Lets `limit` threads in at a time, with up to `queue_limit` more waiting for their turn"""
+
+    def __init__(self, limit: int, queue_limit: int):
+        self._running = threading.Semaphore(limit)
+        self._admitted = threading.Semaphore(limit + queue_limit)
+
+    @contextlib.contextmanager
+    def __call__(self):
+        if not self._admitted.acquire(blocking=False):
+            raise Busy()
+
+        try:
+            with self._running:
+                yield
+        finally:
+            self._admitted.release()
@@ -1,22 +1,69 @@
+import contextlib
 import datetime
-from typing import Annotated
+import io
+import pathlib
+import zipfile
+from typing import Annotated, BinaryIO
 
-import sqlalchemy as sqla
-from fastapi import FastAPI, UploadFile, HTTPException, status, Query
-from fastapi.responses import RedirectResponse
+import anyio.to_thread
+from fastapi import FastAPI, UploadFile, HTTPException, status, Query, Header, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from sqlalchemy.exc import IntegrityError
 
-from . import __version__
-from .enums import UploadFileType
-from .pipeline import analysis, db, create_db_pipeline
-from .responses import ResponseForecast, ResponseUploadFile
+from . import __version__, metrics, settings
+from .cache import etag, etag_matches, forecast_cache
+from .concurrency import Busy, ConcurrencyLimiter
+from .enums import (ExportDataset, ExportFormat, FileFormat, ForecastMethod, QualityGroup, ReportPeriod, UploadFileType,
+                    UploadMode)
+from .jobs import JobQueue, JobQueueDep, get_job_queue
+from .lazy import lazy_import
+from .pipeline import db
+from .responses import (Meta, ResponseBacktest, ResponseChargedHeats, ResponseForecast, ResponseHeatsComparison,
+                        ResponseJob, ResponseUploadBatch, ResponseUploadFile, dump_forecast)
 
 __all__ = ('app',)
 
+# NOTE: the pipeline modules import pandas, numpy and openpyxl, which take most of the startup time; they are imported
+# by the first request that uses them, or before workers are forked (see `__main__`)
+analysis = lazy_import('.pipeline.analysis', __package__)
+backtesting = lazy_import('.pipeline.backtesting', __package__)
+charges = lazy_import('.pipeline.charges', __package__)
+export = lazy_import('.pipeline.export', __package__)
+models = lazy_import('.pipeline.models', __package__)
+pipelines = lazy_import('.pipeline.pipelines', __package__)
+smoothing = lazy_import('.pipeline.smoothing', __package__)
+snapshot = lazy_import('.pipeline.snapshot', __package__)
+
+# ranges longer than this are streamed as NDJSON
+FORECAST_RANGE_STREAM_MONTHS = 12
+
+FORECAST_METHOD = "Forecasting model of every quality group, each group's configured one by default"
+
+
+# NOTE: endpoints doing blocking work (parsing, database, analysis) are plain functions, which run on a
+# pool of worker threads instead of blocking the event loop
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.WORKER_THREADS
+
+    # jobs queued before a restart are picked up again
+    job_queue = app.dependency_overrides.get(get_job_queue, get_job_queue)()
+    if settings.RUN_JOBS:
+        await anyio.to_thread.run_sync(job_queue.start)
+    yield
+    if settings.RUN_JOBS:
+        await anyio.to_thread.run_sync(job_queue.stop)
+
+
 app = FastAPI(
     title='Steel Plans API',
-    version=__version__
+    version=__version__,
+    lifespan=lifespan,
 )
+app.router.route_class = metrics.ProfiledRoute
+app.add_middleware(metrics.InstrumentationMiddleware)
+
+upload_limiter = ConcurrencyLimiter(settings.UPLOAD_CONCURRENCY, settings.UPLOAD_QUEUE_LIMIT)
 
 
 @app.get("/", include_in_schema=False)
@@ -25,40 +72,196 @@ async def docs_redirect():
     return RedirectResponse(url='/redoc')
 
 
+@app.get('/health', include_in_schema=False)
+async def health():
+    # answered on the event loop, without a worker thread, the database or the pipeline modules
+    return {'status': 'ok'}
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    # metrics of this worker process, in the Prometheus text format
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
 # NOTE: Assumptions
 # - the types of files uploaded have a general structure to them
 # - expecting potentially typos/errors in files, pydantic validation will reject badly structured files
-@app.post('/files/{type_of_file}', status_code=status.HTTP_201_CREATED, response_model=ResponseUploadFile, )
-async def upload_file(type_of_file: UploadFileType, file: UploadFile, conn: db.ConnectionDep):
-    """Uploads a file to the Steel Production and Order Database"""
+@app.post('/files/{type_of_file}', status_code=status.HTTP_201_CREATED, response_model=ResponseUploadFile,
+          responses={status.HTTP_202_ACCEPTED: {'model': ResponseJob}})
+def upload_file(type_of_file: UploadFileType, file: UploadFile, conn: db.ConnectionDep, job_queue: JobQueueDep,
+                mode: Annotated[UploadMode, Query(description='How rows already stored are handled')] = UploadMode.APPEND,
+                prefer: Annotated[str | None, Header()] = None):
+    """Uploads a file to the Steel Production and Order Database.
+
+    Rows are identified by their month and grade (production), day, start time and grade (charge schedule), or
+    month and quality group (order forecast). In `append` mode a file with rows already stored is a conflict,
+    `upsert` updates the stored rows that changed, and `replace-range` replaces everything stored for the months
+    (days for charge schedules) in the file.
+
+    Files identical to one already uploaded, with no upload to their table since, are answered right away from the
+    uploads ledger, by their hash, without parsing them or writing any row.
+
+    Files can be workbooks, CSV or Parquet files (recognized from their content), in the layout of the workbooks or
+    with a column per field and a row per entry, e.g. `month,group,grade,short_tons`.
+
+    Requests with `Prefer: respond-async` are answered right away with a 202 and the job loading the file, which
+    `/jobs/{job_id}` reports the progress of.
+
+    """
+
+    if prefer and 'respond-async' in prefer:
+        return _submit_job(job_queue, type_of_file, mode, file)
 
     try:
-        save_file_to_db = create_db_pipeline(type_of_file)
-        rows = save_file_to_db(conn, file.file)
+        with upload_limiter():
+            save_file_to_db = pipelines.create_db_pipeline(type_of_file, mode)
+            stats = save_file_to_db(conn, file.file)
+
+    except Busy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many uploads in progress',
+                            headers={'Retry-After': '5'})
 
-    except IntegrityError:
+    except (IntegrityError, pipelines.DuplicateUpload):
         # since post method, will return 409 (conflict) if integrity error
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='File already exists')
 
     except Exception:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid file format or structure')
 
-    response = {
+    return _upload_response(type_of_file, mode, stats)
+
+
+def _upload_response(type_of_file: UploadFileType, mode: UploadMode, stats) -> dict:
+    return {
         'file_type': type_of_file,
-        'rows': len(rows)
+        'mode': mode,
+        'rows': stats.rows,
+        'inserted': stats.inserted,
+        'updated': stats.updated,
+        'unchanged': stats.unchanged,
+        'deleted': stats.deleted,
+        'duplicate': stats.duplicate,
+        'rows_per_second': stats.rows_per_second,
+    }
+
+
+def _file_type(name: str) -> UploadFileType:
+    # files are recognized by the end of their name, e.g. plant_2_daily_charge_schedule.xlsx (or .csv, .parquet)
+    for file_type in UploadFileType:
+        if any(pathlib.PurePath(name).name.endswith(f'{file_type.stem}.{file_format.value}')
+               for file_format in FileFormat):
+            return file_type
+    raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Unknown type of file: {name}')
+
+
+def _batch_files(files: list[UploadFile]) -> list[tuple[str, UploadFileType, BinaryIO]]:
+    """Name, type and content of the files of a batch, with zip archives replaced by the files in them"""
+
+    batch = []
+    for file in files:
+        if not (file.filename or '').endswith('.zip'):
+            batch.append((file.filename, _file_type(file.filename or ''), file.file))
+            continue
+
+        try:
+            with zipfile.ZipFile(file.file) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                        continue
+                    batch.append((member.filename, _file_type(member.filename), io.BytesIO(archive.read(member))))
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f'Invalid zip archive: {file.filename}')
+
+    return batch
+
+
+@app.post('/files', status_code=status.HTTP_201_CREATED, response_model=ResponseUploadBatch)
+def upload_files(files: list[UploadFile], conn: db.ConnectionDep,
+                 mode: Annotated[UploadMode, Query(description='How rows already stored are handled')] = UploadMode.APPEND):
+    """Uploads several files of any type at once, or zip archives of them.
+
+    The type of each file is recognized by the end of its name (e.g. `plant_2_daily_charge_schedule.xlsx`). Files
+    are parsed in parallel, then loaded in the order they were sent, in `mode`, in a single transaction: if any of
+    them is rejected, none of them is loaded.
+
+    """
+
+    batch = _batch_files(files)
+
+    try:
+        with upload_limiter():
+            save_files_to_db = pipelines.create_batch_pipeline(mode)
+            stats = save_files_to_db(conn, [(file_type, file) for _, file_type, file in batch])
+
+    except Busy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many uploads in progress',
+                            headers={'Retry-After': '5'})
+
+    except (IntegrityError, pipelines.DuplicateUpload):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='File already exists')
+
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid file format or structure')
+
+    response = {
+        'mode': mode,
+        'rows': stats.rows,
+        'rows_per_second': stats.rows_per_second,
+        'files': [
+            {'name': name, **_upload_response(file_type, mode, file_stats)}
+            for (name, file_type, _), file_stats in zip(batch, stats.files)
+        ],
     }
     return response
 
 
+def _submit_job(job_queue: JobQueue, type_of_file: UploadFileType, mode: UploadMode, file: UploadFile):
+    try:
+        job_id = job_queue.submit(type_of_file, mode, file.file)
+    except Busy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many uploads queued',
+                            headers={'Retry-After': '5'})
+
+    content = ResponseJob.model_validate(job_queue.get(job_id)).model_dump(mode='json')
+    headers = {'Location': app.url_path_for('get_job', job_id=job_id), 'Preference-Applied': 'respond-async'}
+    return JSONResponse(content, status_code=status.HTTP_202_ACCEPTED, headers=headers)
+
+
+@app.get('/jobs/{job_id}', response_model=ResponseJob)
+def get_job(job_id: int, job_queue: JobQueueDep):
+    """Reports the status of an upload loaded in the background.
+
+    Running jobs report the rows they processed so far, finished ones their results or error.
+
+    """
+
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f'No job {job_id}')
+    return job
+
+
+def _forecast_methods(method: ForecastMethod | None) -> dict[QualityGroup, ForecastMethod]:
+    return dict.fromkeys(QualityGroup, method) if method else dict(settings.FORECAST_METHODS)
+
+
 # NOTE: Assumptions
-# - from order forecast, can predict how much to make per quality group, but can't tell what proportions of steel grades per group
+# - from order forecast, can predict how much to make per quality group, but can't tell what proportions of
+#   steel grades per group
 @app.get('/forecast/production/', response_model=ResponseForecast)
-async def forecast_grade_production(month: Annotated[str, Query(description='Format: YYYY-MM')],
-                                    conn: db.ConnectionDep):
+def forecast_grade_production(month: Annotated[str, Query(description='Format: YYYY-MM')],
+                              conn: db.ReadConnectionDep,
+                              method: Annotated[ForecastMethod | None, Query(description=FORECAST_METHOD)] = None,
+                              if_none_match: Annotated[str | None, Header()] = None):
     """Forecasts grade production for specified month.
 
-    Requires existing quality groups order forecast for the requested month. If there is no production data,
-    forecast will be empty.
+    Requires existing quality groups order forecast for the requested month. If there is no production data
+    before the requested month, forecast will be empty.
+
+    Forecasts only change when production or order forecasts are uploaded, so they are cached and carry an ETag;
+    requests with a matching If-None-Match get a 304.
 
     Note there is room for extension. There is plenty of more information that
     could be returned with the production forecast.
@@ -66,30 +269,281 @@ async def forecast_grade_production(month: Annotated[str, Query(description='For
     """
 
     year_month = datetime.datetime.strptime(month, "%Y-%m")
-    stmt = sqla.select(db.month_group_order_forecast).where(
-        sqla.extract('year', db.month_group_order_forecast.c.month) == year_month.year,
-        sqla.extract('month', db.month_group_order_forecast.c.month) == year_month.month,
-    )
-    group_order_forecast_for_month = conn.execute(stmt).mappings().all()
-    if not group_order_forecast_for_month:
+    methods = _forecast_methods(method)
+
+    data_versions = db.get_dataset_versions(conn, db.month_steel_production, db.month_group_order_forecast,
+                                            db.smoothing_alphas)
+    cache_key = (db.get_database_id(conn), month, analysis.ALPHA_ES, data_versions,
+                 tuple(methods[group] for group in QualityGroup))
+    headers = {'ETag': etag(cache_key), 'Cache-Control': 'no-cache'}
+
+    if etag_matches(if_none_match, headers['ETag']):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if (content := forecast_cache.get(cache_key)) is not None:
+        return Response(content, media_type='application/json', headers=headers)
+
+    # order forecasts, smoothing state and production history are read from the snapshot of their versions
+    snap = snapshot.get_snapshot(conn, data_versions)
+    target = snapshot.month_ordinal(year_month)
+    if not len(snap.order_forecasts(target, target + 1)[0]):
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f'No order forecast data for {month}')
 
-    stmt = sqla.select(db.month_steel_production)
-    all_production_data = conn.execute(stmt).mappings().all()
+    try:
+        with metrics.span('forecast.breakdown'):
+            group_breakdowns = models.forecast_snapshot(snap, year_month.date(), methods)
+    except Exception:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST)
+
+    content = _forecast_content(year_month.strftime('%Y-%m'), group_breakdowns)
+    forecast_cache.set(cache_key, content)
+
+    return Response(content, media_type='application/json', headers=headers)
 
+
+@metrics.timed('forecast.serialize')
+def _forecast_content(month: str, group_breakdowns: 'list[analysis.GroupBreakdown]') -> bytes:
+    return dump_forecast(Meta(timestamp=datetime.datetime.now(), version=__version__), month, group_breakdowns)
+
+
+@app.get('/forecast/production/range', response_model=list[ResponseForecast])
+def forecast_grade_production_range(from_month: Annotated[str, Query(alias='from', description='Format: YYYY-MM')],
+                                    to_month: Annotated[str, Query(alias='to', description='Format: YYYY-MM')],
+                                    conn: db.ReadConnectionDep,
+                                    method: Annotated[ForecastMethod | None, Query(description=FORECAST_METHOD)] = None,
+                                    accept: Annotated[str | None, Header()] = None):
+    """Forecasts grade production for every month from `from` to `to` (inclusive).
+
+    Months without quality groups order forecast are left out. Ranges longer than a year, or requests accepting
+    `application/x-ndjson`, are streamed as one forecast per line.
+
+    """
+
+    first_month = datetime.datetime.strptime(from_month, "%Y-%m").date()
+    last_month = datetime.datetime.strptime(to_month, "%Y-%m").date()
+    if last_month < first_month:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='`to` is before `from`')
+
+    data_versions = db.get_dataset_versions(conn, db.month_steel_production, db.month_group_order_forecast,
+                                            db.smoothing_alphas)
+    snap = snapshot.get_snapshot(conn, data_versions)
+    order_months = snap.order_forecasts(snapshot.month_ordinal(first_month), snapshot.month_ordinal(last_month) + 1)[0]
+    months = [snapshot.month_date(ordinal) for ordinal in sorted(set(order_months.tolist()))]
+    if not months:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f'No order forecast data from {from_month} to {to_month}')
+
+    methods = _forecast_methods(method)
+    method_key = tuple(methods[group] for group in QualityGroup)
+    database_id = db.get_database_id(conn)
+    cache_keys = {month: (database_id, month.strftime('%Y-%m'), analysis.ALPHA_ES, data_versions, method_key)
+                  for month in months}
+
+    # every month is forecast before the response starts, so that months that can't be are answered with an error
+    # status rather than a truncated body
+    contents = []
     try:
-        group_breakdowns = analysis.forecast_grade_breakdown(group_order_forecast_for_month, all_production_data,
-                                                             year_month)
+        for month in months:
+            if (content := forecast_cache.get(cache_keys[month])) is None:
+                with metrics.span('forecast.breakdown'):
+                    group_breakdowns = models.forecast_snapshot(snap, month, methods)
+                content = _forecast_content(month.strftime('%Y-%m'), group_breakdowns)
+                forecast_cache.set(cache_keys[month], content)
+            contents.append(content)
     except Exception:
         raise HTTPException(status.HTTP_400_BAD_REQUEST)
 
+    if len(months) > FORECAST_RANGE_STREAM_MONTHS or (accept and 'application/x-ndjson' in accept):
+        return StreamingResponse((content + b'\n' for content in contents), media_type='application/x-ndjson')
+    return Response(b'[' + b','.join(contents) + b']', media_type='application/json')
+
+
+@app.get('/production/charges', response_model=ResponseChargedHeats)
+def charged_heats(from_day: Annotated[datetime.date, Query(alias='from', description='Format: YYYY-MM-DD')],
+                  to_day: Annotated[datetime.date, Query(alias='to', description='Format: YYYY-MM-DD')],
+                  conn: db.ReadConnectionDep,
+                  period: Annotated[ReportPeriod, Query(description='Period heats are counted per')] = ReportPeriod.MONTH,
+                  by_mould_size: Annotated[bool, Query(description='Count heats per mould size too')] = True):
+    """Heats charged per period and grade (and mould size), from the daily charge schedules.
+
+    Heats are counted per day, week (starting on Mondays) or month, from `from` to `to` (inclusive). Weekly and
+    monthly counts cover whole weeks and months, from the one `from` is in to the one `to` is in.
+
+    """
+
+    if to_day < from_day:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='`to` is before `from`')
+
+    # monthly counts are maintained on upload
+    if period is ReportPeriod.MONTH:
+        stmt = db.select_charge_heats_monthly(from_day.replace(day=1), analysis.add_months(to_day.replace(day=1), 1),
+                                              by_mould_size)
+        heats = [{'start': row['month'], **row} for row in conn.execute(stmt).mappings()]
+    else:
+        since = from_day - datetime.timedelta(days=from_day.weekday() if period is ReportPeriod.WEEK else 0)
+        until = to_day + datetime.timedelta(days=7 - to_day.weekday() if period is ReportPeriod.WEEK else 1)
+        stmt = db.select_charges(since, until)
+        heats = charges.count_heats(conn.execute(stmt).mappings().all(), period, by_mould_size).to_dict(orient='records')
+
+    return {'period': period, 'heats': heats}
+
+
+@app.get('/production/comparison', response_model=ResponseHeatsComparison)
+def compare_heats(month: Annotated[str, Query(description='Format: YYYY-MM')], conn: db.ReadConnectionDep):
+    """Compares the heats charged per grade in a month with the heats produced and forecasted.
+
+    Heats produced come from the monthly steel grade production, and forecasted ones from the quality groups order
+    forecast of the month. They are null for grades missing from them, and charged heats are 0 for grades that
+    weren't charged.
+
+    """
+
+    since = datetime.datetime.strptime(month, "%Y-%m").date()
+    until = analysis.add_months(since, 1)
+
+    charged = {row.grade: row.heats for row in conn.execute(db.select_charge_heats_monthly(since, until, False))}
+    groups, produced, forecasted = {}, {}, {}
+    for row in conn.execute(db.select_production_heats(since, until)):
+        groups[row.grade] = row.group
+        produced[row.grade] = row.heats
+
+    snap = snapshot.get_snapshot(conn)
+    target = snapshot.month_ordinal(since)
+    if len(snap.order_forecasts(target, target + 1)[0]):
+        for group in models.forecast_snapshot(snap, since, _forecast_methods(None)):
+            for grade, heats in zip(group.grades.tolist(), group.grade_heats.tolist()):
+                groups.setdefault(grade, group.group)
+                forecasted[grade] = heats
+
+    grades = sorted(charged.keys() | groups.keys(), key=lambda grade: (groups.get(grade) or '', grade))
     response = {
-        'meta': {
-            'timestamp': datetime.datetime.now(),
-            'version': __version__
-        },
         'month': month,
-        'groups': group_breakdowns,
+        'grades': [
+            {
+                'group': groups.get(grade),
+                'grade': grade,
+                'charged': charged.get(grade, 0),
+                'produced': produced.get(grade),
+                'forecasted': forecasted.get(grade),
+            }
+            for grade in grades
+        ],
     }
-
     return response
+
+
+def _backtest(conn, alphas: list[float] | None, apply: bool) -> dict:
+    if alphas is not None and not all(0 < alpha <= 1 for alpha in alphas):
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Alphas must be in (0, 1]')
+
+    history = conn.execute(db.select_production_history()).mappings().all()
+    result = backtesting.backtest(history, alphas or backtesting.ALPHA_GRID)
+    groups = result.report(dict(conn.execute(db.select_smoothing_alphas()).all()))
+
+    if apply:
+        smoothing.set_smoothing_alphas(conn, {group['group']: group['alpha'] for group in groups},
+                                       {group['group']: group['mae'] for group in groups})
+    return {'applied': apply, 'groups': groups}
+
+
+@app.get('/forecast/backtest', response_model=ResponseBacktest)
+def backtest_forecasts(conn: db.ReadConnectionDep,
+                       alphas: Annotated[list[float] | None, Query(alias='alpha')] = None):
+    """Backtests production forecasts with each smoothing factor (`alpha`, repeated, 0.05 to 0.95 by default).
+
+    Every month of production history is forecast from the months before it, and the heats forecast per grade are
+    compared with the ones produced. Reports MAE and MAPE per quality group for each alpha, the alpha with the
+    lowest MAE, and the errors per grade with it.
+
+    """
+
+    return _backtest(conn, alphas, apply=False)
+
+
+@app.post('/forecast/backtest', response_model=ResponseBacktest)
+def apply_backtest(conn: db.ConnectionDep,
+                   alphas: Annotated[list[float] | None, Query(alias='alpha')] = None):
+    """Backtests production forecasts like GET does, and makes forecasts use the alpha chosen for each group"""
+
+    return _backtest(conn, alphas, apply=True)
+
+
+MONTH_PATTERN = r'^\d{4}-(0[1-9]|1[0-2])$'
+
+# query parameters of exports
+FromMonth = Annotated[str | None, Query(alias='from', pattern=MONTH_PATTERN, description='Format: YYYY-MM')]
+ToMonth = Annotated[str | None, Query(alias='to', pattern=MONTH_PATTERN, description='Format: YYYY-MM')]
+Groups = Annotated[list[QualityGroup] | None, Query(alias='group')]
+Grades = Annotated[list[str] | None, Query(alias='grade')]
+FileFormatQuery = Annotated[ExportFormat, Query(alias='format',
+                                                description='csv, ndjson (a JSON object per line) or parquet')]
+
+
+def _export_months(from_month: str | None, to_month: str | None) -> tuple[datetime.date | None, datetime.date | None]:
+    # from the first day of `from` to before the month after `to`
+    since = datetime.datetime.strptime(from_month, '%Y-%m').date() if from_month else None
+    until = analysis.add_months(datetime.datetime.strptime(to_month, '%Y-%m').date(), 1) if to_month else None
+    if since and until and until <= since:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='`to` is before `from`')
+    return since, until
+
+
+def _export_response(content, name: str, file_format: ExportFormat) -> StreamingResponse:
+    return StreamingResponse(content, media_type=export.MEDIA_TYPES[file_format],
+                             headers={'Content-Disposition': f'attachment; filename="{name}.{file_format.value}"'})
+
+
+def _check_export_format(file_format: ExportFormat):
+    try:
+        export.check_format(file_format)
+    except ImportError as exc:
+        raise HTTPException(status.HTTP_501_NOT_IMPLEMENTED, detail=str(exc))
+
+
+@app.get('/export/forecasts', response_class=StreamingResponse)
+def export_forecasts(conn: db.ReadConnectionDep,
+                     from_month: FromMonth = None, to_month: ToMonth = None, groups: Groups = None, grades: Grades = None,
+                     method: Annotated[ForecastMethod | None, Query(description=FORECAST_METHOD)] = None,
+                     file_format: FileFormatQuery = ExportFormat.CSV):
+    """Exports the forecasts of every month with quality groups order forecast from `from` to `to` (inclusive),
+    with a row per month and grade, of `group` and `grade` (both can be repeated).
+
+    Every month is forecast before the file is streamed, so that months that can't be are answered with 400 rather
+    than a truncated file.
+
+    """
+
+    since, until = _export_months(from_month, to_month)
+    _check_export_format(file_format)
+
+    snap = snapshot.get_snapshot(conn)
+    # months are int32 ordinals
+    order_months = snap.order_forecasts(snapshot.month_ordinal(since) if since else -2 ** 31,
+                                        snapshot.month_ordinal(until) if until else 2 ** 31 - 1)[0]
+    months = [snapshot.month_date(ordinal) for ordinal in sorted(set(order_months.tolist()))]
+
+    try:
+        content = export.export_forecasts(snap, months, _forecast_methods(method), file_format, groups, grades)
+    except Exception:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST)
+    return _export_response(content, 'forecasts', file_format)
+
+
+@app.get('/export/{dataset}', response_class=StreamingResponse)
+def export_rows(dataset: ExportDataset, conn: db.ReadConnectionDep,
+                from_month: FromMonth = None, to_month: ToMonth = None, groups: Groups = None, grades: Grades = None,
+                file_format: FileFormatQuery = ExportFormat.CSV):
+    """Exports the rows stored from uploads of a type of file, in the layout with a column per field that uploads
+    accept, of the months from `from` to `to` (inclusive), `group` and `grade` (both can be repeated).
+
+    Charge schedules are of the quality groups their grades were produced in. Rows are read and streamed a chunk at a
+    time, so exports of any size take the same memory.
+
+    """
+
+    since, until = _export_months(from_month, to_month)
+    if grades is not None and dataset is ExportDataset.MONTHLY_ORDER_FORECAST:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Order forecasts have no grades')
+    _check_export_format(file_format)
+
+    content = export.export_rows(conn, dataset, file_format, since, until, groups, grades)
+    return _export_response(content, dataset.value, file_format)
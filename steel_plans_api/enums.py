@@ -1,7 +1,14 @@
 import enum
 
 __all__ = (
+    'ExportDataset',
+    'ExportFormat',
+    'FileFormat',
+    'ForecastMethod',
+    'JobStatus',
+    'ReportPeriod',
     'UploadFileType',
+    'UploadMode',
 )
 
 
@@ -16,3 +23,61 @@ class UploadFileType(str, enum.Enum):
     MONTHLY_STEEL_GRADE_PRODUCTION = 'steel_grade_production.xlsx'
     DAILY_CHARGE_SCHEDULE = 'daily_charge_schedule.xlsx'
     MONTHLY_ORDER_FORECAST = 'product_groups_monthly.xlsx'
+
+    @property
+    def stem(self) -> str:
+        return self.value.removesuffix('.xlsx')
+
+    @classmethod
+    def _missing_(cls, value):
+        # the same datasets as CSV or Parquet files, e.g. steel_grade_production.csv
+        for file_type in cls:
+            if any(value == f'{file_type.stem}.{file_format.value}' for file_format in FileFormat):
+                return file_type
+        return None
+
+
+class FileFormat(str, enum.Enum):
+    XLSX = 'xlsx'
+    CSV = 'csv'
+    PARQUET = 'parquet'
+
+
+class ExportDataset(str, enum.Enum):
+    # rows stored from each type of upload, named after what they hold rather than the upload's file
+    MONTHLY_STEEL_GRADE_PRODUCTION = 'production'
+    DAILY_CHARGE_SCHEDULE = 'charges'
+    MONTHLY_ORDER_FORECAST = 'order_forecasts'
+
+
+class ExportFormat(str, enum.Enum):
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+    PARQUET = 'parquet'
+
+
+class UploadMode(str, enum.Enum):
+    APPEND = 'append'  # rows already stored are a conflict
+    UPSERT = 'upsert'  # rows already stored are updated, if they changed
+    REPLACE_RANGE = 'replace-range'  # rows stored for the months (days) in the file are replaced
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+class ReportPeriod(str, enum.Enum):
+    DAY = 'day'
+    WEEK = 'week'  # starting on Mondays
+    MONTH = 'month'
+
+
+class ForecastMethod(str, enum.Enum):
+    EWM = 'ewm'  # exponential smoothing, from the smoothing state maintained on upload
+    MOVING_AVERAGE = 'moving-average'
+    HOLT = 'holt'  # linear trend
+    SEASONAL_NAIVE = 'seasonal-naive'
+    CROSTON = 'croston'  # for grades produced intermittently
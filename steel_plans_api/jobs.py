@@ -0,0 +1,268 @@
+import functools
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from typing import Annotated, BinaryIO
+
+import sqlalchemy as sqla
+from fastapi import Depends
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError, SQLAlchemyError
+
+from . import settings
+from .concurrency import Busy
+from .enums import JobStatus, UploadFileType, UploadMode
+from .lazy import lazy_import
+from .pipeline import db
+
+__all__ = (
+    'JobQueue',
+    'JobQueueDep',
+    'get_job_queue',
+)
+
+pipelines = lazy_import('.pipeline.pipelines', __package__)
+
+
+# errors of jobs that failed because of their file, which is removed as loading it again would fail the same way
+_FILE_ERRORS = ('File already exists', 'Invalid file format or structure')
+
+
+def _job_error(exc: Exception) -> str | None:
+    """Error of a job that raised `exc`, None if it is queued again"""
+
+    # same errors an upload answered right away reports
+    if isinstance(exc, (IntegrityError, pipelines.DuplicateUpload)):
+        return 'File already exists'
+    if isinstance(exc, OperationalError):
+        return None  # the database stayed locked by other writers, or couldn't be reached
+    if isinstance(exc, (SQLAlchemyError, OSError)) and not isinstance(exc, DataError):
+        return 'Failed to load the file'
+    return 'Invalid file format or structure'
+
+
+class _Progress:
+    """Rows processed by a running job, kept in a file every worker process can read, as its load holds the
+    database's write lock until it finishes"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.rows = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+
+    def __call__(self, rows: int):
+        self.rows = rows
+        os.pwrite(self._fd, rows.to_bytes(8, 'little'), 0)
+
+    def close(self):
+        os.close(self._fd)
+        self.path.unlink(missing_ok=True)
+
+    @staticmethod
+    def read(path: pathlib.Path) -> int | None:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        return int.from_bytes(data, 'little') if len(data) == 8 else None
+
+
+class JobQueue:
+    """Loads uploads in the background, from a queue kept in the database so that queued jobs survive restarts.
+
+    Each file type has its own `concurrency[file_type]` workers, and takes up to `queue_limit` queued jobs before
+    new ones are turned away. Uploaded files are kept in `directory` until they are loaded, or fail to because of
+    their contents: jobs the database was locked for are queued again. Jobs are looked up through `read_engine`, if
+    given, so that polling them doesn't wait on the loads running.
+
+    """
+
+    def __init__(self, engine: sqla.Engine, directory: str | pathlib.Path, concurrency: dict[UploadFileType, int],
+                 queue_limit: int, poll_seconds: float, read_engine: sqla.Engine | None = None):
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self.directory = pathlib.Path(directory)
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.poll_seconds = poll_seconds
+
+        self._wakeups = {file_type: threading.Condition() for file_type in concurrency}
+        self._stopping = threading.Event()
+        self._workers: list[threading.Thread] = []
+
+    def _path(self, job_id: int) -> pathlib.Path:
+        return self.directory / f'{job_id}.upload'
+
+    def _progress_path(self, job_id: int) -> pathlib.Path:
+        return self.directory / f'{job_id}.progress'
+
+    def start(self):
+        """Starts the workers, queueing again the jobs a previous run was interrupted in"""
+
+        if self._workers:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        table = db.ingestion_jobs
+        # NOTE: assumes one process runs the workers of the database
+        with self.engine.begin() as conn:
+            conn.execute(sqla.update(table).where(table.c.status == JobStatus.RUNNING).values(
+                status=JobStatus.QUEUED, rows=0, started_at=None,
+            ))
+
+        self._stopping.clear()
+        for file_type, workers in self.concurrency.items():
+            for number in range(workers):
+                worker = threading.Thread(target=self._work, args=(file_type,), daemon=True,
+                                          name=f'job-worker-{file_type.name.lower()}-{number}')
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self):
+        """Stops the workers once the jobs they are running finish"""
+
+        self._stopping.set()
+        for wakeup in self._wakeups.values():
+            with wakeup:
+                wakeup.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers.clear()
+
+    def submit(self, file_type: UploadFileType, mode: UploadMode, file: BinaryIO) -> int:
+        """Queues `file` to be loaded in `mode`, returning the id of its job.
+
+        Raises:
+            Busy: `queue_limit` jobs of `file_type` are already queued
+
+        """
+
+        # the file is written before the database is locked, queueing the job then only renames it
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        stored = pathlib.Path(tmp)
+        try:
+            with open(fd, 'wb') as out:
+                shutil.copyfileobj(file, out)
+
+            table = db.ingestion_jobs
+            with self.engine.begin() as conn:
+                stmt = sqla.select(sqla.func.count()).select_from(table).where(
+                    table.c.status == JobStatus.QUEUED,
+                    table.c.file_type == file_type,
+                )
+                if conn.execute(stmt).scalar_one() >= self.queue_limit:
+                    raise Busy()
+
+                stmt = sqla.insert(table).values(file_type=file_type, mode=mode, status=JobStatus.QUEUED)
+                job_id, = conn.execute(stmt).inserted_primary_key
+
+                # the job only becomes visible to workers once its file is in place
+                stored = stored.replace(self._path(job_id))
+        except BaseException:
+            stored.unlink(missing_ok=True)
+            raise
+
+        with self._wakeups[file_type]:
+            self._wakeups[file_type].notify()
+        return job_id
+
+    def get(self, job_id: int) -> dict | None:
+        """Job `job_id`, with the rows processed so far if it is running (in whichever process)"""
+
+        table = db.ingestion_jobs
+        with self.read_engine.connect() as conn:
+            job = conn.execute(sqla.select(table).where(table.c.id == job_id)).mappings().first()
+        if job is None:
+            return None
+
+        job = dict(job)
+        if job['status'] is JobStatus.RUNNING:
+            rows = _Progress.read(self._progress_path(job_id))
+            job['rows'] = job['rows'] if rows is None else rows
+        return job
+
+    def _claim(self, file_type: UploadFileType):
+        table = db.ingestion_jobs
+        with self.engine.begin() as conn:
+            stmt = sqla.select(table).where(
+                table.c.status == JobStatus.QUEUED,
+                table.c.file_type == file_type,
+            ).order_by(table.c.id).limit(1)
+            job = conn.execute(stmt).first()
+            if job is None:
+                return None
+
+            # another worker may have claimed it in between
+            stmt = sqla.update(table).where(table.c.id == job.id, table.c.status == JobStatus.QUEUED).values(
+                status=JobStatus.RUNNING, started_at=sqla.func.current_timestamp(),
+            )
+            return job if conn.execute(stmt).rowcount else None
+
+    def _work(self, file_type: UploadFileType):
+        wakeup = self._wakeups[file_type]
+        while not self._stopping.is_set():
+            try:
+                job = self._claim(file_type)
+            except OperationalError:
+                job = None  # the database stayed locked by other writers, tried again later
+            if job is None:
+                with wakeup:
+                    wakeup.wait(self.poll_seconds)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        table = db.ingestion_jobs
+        path = self._path(job.id)
+        progress = _Progress(self._progress_path(job.id))
+
+        try:
+            # the job succeeds in the same transaction its rows are loaded in
+            with db.transaction(self.engine) as conn, open(path, 'rb') as file:
+                # its file is removed as it commits, before the snapshot of its data is published
+                db.after_commit(conn, lambda engine: path.unlink(missing_ok=True))
+                save_file_to_db = pipelines.create_db_pipeline(job.file_type, job.mode)
+                stats = save_file_to_db(conn, file, progress)
+                conn.execute(sqla.update(table).where(table.c.id == job.id).values(
+                    status=JobStatus.SUCCEEDED,
+                    rows=stats.rows,
+                    inserted=stats.inserted,
+                    updated=stats.updated,
+                    unchanged=stats.unchanged,
+                    deleted=stats.deleted,
+                    duplicate=stats.duplicate,
+                    rows_per_second=stats.rows_per_second,
+                    finished_at=sqla.func.current_timestamp(),
+                ))
+
+        except Exception as exc:
+            error = _job_error(exc)
+            if error is None:
+                values = dict(status=JobStatus.QUEUED, rows=0, started_at=None)
+            else:
+                values = dict(status=JobStatus.FAILED, rows=progress.rows, error=error,
+                              finished_at=sqla.func.current_timestamp())
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(sqla.update(table).where(table.c.id == job.id).values(**values))
+            except SQLAlchemyError:
+                error = None  # the job stays running, with its file, until the next start queues it again
+
+            if error in _FILE_ERRORS:
+                path.unlink(missing_ok=True)
+            elif error is None:
+                self._stopping.wait(self.poll_seconds)
+
+        finally:
+            progress.close()
+
+
+@functools.lru_cache
+def get_job_queue() -> JobQueue:
+    return JobQueue(db.get_engine(), settings.JOBS_DIR, settings.JOB_CONCURRENCY, settings.JOB_QUEUE_LIMIT,
+                    settings.JOB_POLL_SECONDS, read_engine=db.get_read_engine())
+
+
+JobQueueDep = Annotated[JobQueue, Depends(get_job_queue)]
@@ -0,0 +1,30 @@
+"""Modules imported on first use, so that the API starts without importing pandas, numpy and openpyxl"""
+import importlib.util
+import types
+
+__all__ = (
+    'LazyModule',
+    'lazy_import',
+)
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module, which imports it on first access to one of its attributes.
+
+    The import goes through the import system, so concurrent first uses from worker threads wait for a single import
+    instead of seeing a module half executed.
+
+    """
+
+    def __getattr__(self, attr):
+        # only called for attributes the stand-in doesn't have, i.e. the module's own
+        module = self.__dict__.get('_module')
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str, package: str | None = None) -> LazyModule:
+    """Module `name` (relative to `package`, as `importlib.import_module` takes it), imported on first use"""
+
+    return LazyModule(importlib.util.resolve_name(name, package))
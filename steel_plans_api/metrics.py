@@ -0,0 +1,250 @@
+"""Request and stage metrics in the Prometheus text format, and an opt-in per-request profiler"""
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import math
+import pstats
+import threading
+import time
+
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from . import settings
+
+__all__ = (
+    'Counter',
+    'Histogram',
+    'InstrumentationMiddleware',
+    'ProfiledRoute',
+    'render',
+    'span',
+    'timed',
+)
+
+# seconds, from a fast SQL query to a large upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+_metrics: list = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Thread-safe counter per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1., **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0.)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {value:g}')
+        return lines
+
+
+class Histogram:
+    """Thread-safe histogram of observations per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per label values: count of observations in each bucket (and above the last one), and their sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (values := self._values.get(key)) is None:
+                values = self._values[key] = ([0] * (len(self.buckets) + 1), [0.])
+            values[0][index] += 1
+            values[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        values = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(values[0]) if values else 0
+
+    def sum(self, **labels: str) -> float:
+        values = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return values[1][0] if values else 0.
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, math.inf), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == math.inf else f'le="{bound:g}"'
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {total[0]:g}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+def render() -> str:
+    """Every metric of this process, in the Prometheus text format"""
+
+    return '\n'.join(line for metric in _metrics for line in metric.render()) + '\n'
+
+
+REQUEST_SECONDS = Histogram('steel_plans_request_seconds', 'Time to answer requests, until their response starts',
+                            ('method', 'route', 'status'))
+STAGE_SECONDS = Histogram('steel_plans_stage_seconds', 'Time spent in each stage of uploads and forecasts',
+                          ('stage',))
+SQL_SECONDS = Histogram('steel_plans_sql_seconds', 'Time to execute SQL statements, by kind', ('statement',))
+ROWS_PROCESSED = Counter('steel_plans_rows_processed_total',
+                         'Rows of uploaded files parsed and written, and rows exported, by action',
+                         ('file_type', 'action'))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Times the block as `stage`"""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed(stage: str):
+    """Times every call of the decorated function as `stage`"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# profiler of the request being handled, if it asked for one
+_profiler: contextvars.ContextVar[cProfile.Profile | None] = contextvars.ContextVar('profiler', default=None)
+# held by the request being profiled, profilers can't run side by side
+_profiling = threading.Lock()
+
+
+def _profiled(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        # NOTE: runs in the worker thread of the endpoint, the only one cProfile sees before Python 3.12
+        if (profiler := _profiler.get()) is None:
+            return endpoint(*args, **kwargs)
+        profiler.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose endpoint is profiled in requests that asked for it (plain function endpoints only)"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _profile_allowed(request: Request) -> bool:
+    if settings.ADMIN_TOKEN is None:
+        return False
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode())
+
+
+class InstrumentationMiddleware:
+    """Records the latency of every request, and answers requests with `profile=1` with a cProfile report of their
+    endpoint instead of its response (admins only, with `Authorization: Bearer <STEEL_PLANS_ADMIN_TOKEN>`).
+
+    From Python 3.12 cProfile profiles every thread of the process, so the report also covers whatever other
+    requests ran meanwhile. One request is profiled at a time, others asking for a report get 409.
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request = Request(scope)
+        profiler = None
+        if request.query_params.get('profile') == '1':
+            if not _profile_allowed(request):
+                response = JSONResponse({'detail': 'Profiling requires an admin token'}, status_code=403)
+                return await response(scope, receive, send)
+            if not _profiling.acquire(blocking=False):
+                response = JSONResponse({'detail': 'Another request is being profiled'}, status_code=409)
+                return await response(scope, receive, send)
+            profiler = cProfile.Profile()
+
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope['method'],
+                                        route=getattr(scope.get('route'), 'path', 'unmatched'),
+                                        status=str(status_code))
+            if profiler is None:
+                await send(message)
+
+        token = _profiler.set(profiler)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _profiler.reset(token)
+            if profiler is not None:
+                _profiling.release()
+
+        if profiler is not None:
+            report = io.StringIO()
+            report.write(f'{scope["method"]} {scope["path"]} -> {status_code}\n\n')
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(50)
+            await PlainTextResponse(report.getvalue())(scope, receive, send)
@@ -1 +1,27 @@
-from .pipelines import *
+import importlib
+
+__all__ = (
+    'BatchLoadStats',
+    'DuplicateUpload',
+    'LoadStats',
+    'create_batch_pipeline',
+    'create_db_pipeline',
+    'preload',
+)
+
+# modules importing pandas, numpy or openpyxl, which the API imports on first use
+HEAVY_MODULES = ('analysis', 'backtesting', 'charges', 'export', 'models', 'parsing', 'pipelines', 'smoothing', 'snapshot')
+
+
+def preload():
+    """Imports every pipeline module, e.g. for the worker processes forked after it to share them"""
+
+    for name in HEAVY_MODULES:
+        importlib.import_module(f'.{name}', __name__)
+
+
+def __getattr__(name: str):
+    # the pipelines are only imported once they are used, not with `db`
+    if name in __all__:
+        return getattr(importlib.import_module('.pipelines', __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,11 +1,12 @@
 import datetime
-from typing import Annotated
+from typing import Mapping, NamedTuple
 
 import numpy as np
 import pandas as pd
-from pydantic import BaseModel, Field
 
+from .. import metrics
 from ..enums import QualityGroup
+from ..responses import ForecastProductionGrade, ForecastProductionGroup
 
 ALPHA_ES = 0.3
 USE_EXP_SMOOHTHING = True
@@ -14,133 +15,296 @@ USE_EXP_SMOOHTHING = True
 # NOTE: use exponential smoothing because I put more value in recent
 # grade proportions
 
-class ForecastProductionGrade(BaseModel):
-    grade: Annotated[str, Field(description="Steel grade code, e.g. A36")]
-    heats: Annotated[int, Field(description="Total heats forcasted")]
-    proportion: Annotated[float, Field(ge=0.0, le=1.0)]
+class GroupBreakdown(NamedTuple):
+    """Forecast of a quality group broken down by grades, as arrays that are valid ForecastProductionGroup fields"""
 
-
-class ForecastProductionGroup(BaseModel):
     group: QualityGroup
     heats: int
-    grades: Annotated[list[ForecastProductionGrade], Field(description="Grade-level proportions")]
+    grades: np.ndarray
+    grade_heats: np.ndarray
+    proportions: np.ndarray
+
+    def to_model(self) -> ForecastProductionGroup:
+        # already valid, skip validating every grade again
+        return ForecastProductionGroup.model_construct(
+            group=self.group,
+            heats=self.heats,
+            grades=[ForecastProductionGrade.model_construct(grade=grade, heats=heats, proportion=proportion)
+                    for grade, heats, proportion in zip(self.grades.tolist(), self.grade_heats.tolist(),
+                                                        self.proportions.tolist())],
+        )
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    """First day of the month `months` months after the month of `month`"""
+
+    months += month.year * 12 + (month.month - 1)
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def _ewm_steps(values: np.ndarray, present: np.ndarray, alpha: float | np.ndarray = ALPHA_ES,
+               weighted: np.ndarray | None = None, old_wt: np.ndarray | None = None):
+    """Runs ``ewm(alpha=alpha, adjust=False).mean()`` over every column of a matrix at once.
+
+    Mirrors the recurrence pandas uses (including its NaN handling with ``ignore_na=False``), so results
+    are bit-for-bit equal to smoothing each column on its own.
+
+    Args:
+        values: (observations x series) matrix, each column holding one series in time order
+        present: mask of the cells that hold an observation (columns can be shorter than others)
+        alpha: smoothing factor, or the smoothing factor of each column
+        weighted: smoothed values to continue from (NaN where a series has no observation yet)
+        old_wt: weights of the smoothed values to continue from
+
+    Yields:
+        Smoothed value and its weight for each column, after each row of the matrix
+
+    """
+
+    # pandas converts alpha to a center of mass and back, do the same so the weights match exactly
+    alpha = 1. / (1. + (1. / alpha - 1.))
+    old_wt_factor = 1. - alpha
+
+    weighted = np.full(values.shape[1], np.nan) if weighted is None else weighted
+    old_wt = np.ones(values.shape[1]) if old_wt is None else old_wt
+
+    with np.errstate(invalid='ignore'):
+        for cur, is_present in zip(values, present):
+            is_observation = is_present & (cur == cur)
+            has_weight = is_present & (weighted == weighted)
+
+            # missing observations still decay the old weight
+            old_wt = np.where(has_weight, old_wt * old_wt_factor, old_wt)
+
+            update = has_weight & is_observation & (weighted != cur)
+            smoothed = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+            weighted = np.where(update, smoothed, weighted)
+            old_wt = np.where(has_weight & is_observation, 1., old_wt)
+
+            # series start at their first observation
+            weighted = np.where(is_observation & (weighted != weighted), cur, weighted)
+
+            yield weighted, old_wt
+
+
+def _ewm_last(values: np.ndarray, present: np.ndarray, alpha: float | np.ndarray = ALPHA_ES) -> np.ndarray:
+    """Smoothed value after the last observation of each column (NaN if a column has no observation)"""
+
+    weighted = np.full(values.shape[1], np.nan)
+    for weighted, _ in _ewm_steps(values, present, alpha):
+        pass
+    return weighted
+
+
+def _proportions(pm_df: pd.DataFrame) -> pd.Series:
+    """Share of each row's heats in its month and quality group"""
+
+    return pm_df['heats_produced'] / pm_df.groupby(["month", "group"])['heats_produced'].transform("sum")
+
+
+def _layout_series(pm_df: pd.DataFrame):
+    """Lays out every (group, grade) series of proportions in its own column, in month order.
+
+    Returns:
+        The (group, grade) of each column, the positions of the rows of `pm_df` in the matrix (NaN keys are
+        left out), and the matrix of values with its mask of present cells
+
+    """
+
+    grouped = pm_df.groupby(['group', 'grade'], sort=True)
+    col_codes = grouped.ngroup().to_numpy()
+    columns = grouped.size().index
+
+    valid = ~np.isnan(col_codes) if col_codes.dtype.kind == 'f' else np.ones(len(col_codes), dtype=bool)
+    row_index = np.flatnonzero(valid)
+    col_codes = col_codes[valid].astype(np.int64)
+
+    # months that could not be parsed are sorted last, as sort_values does
+    months = pm_df['month'].array.asi8[valid]
+    months = np.where(pm_df['month'].isna().to_numpy()[valid], np.iinfo(np.int64).max, months)
+
+    order = np.lexsort((months, col_codes))
+    row_index = row_index[order]
+    col_codes = col_codes[order]
+    counts = np.bincount(col_codes, minlength=len(columns))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rows = np.arange(len(col_codes)) - starts[col_codes]
+
+    values = np.full((counts.max(initial=0), len(columns)), np.nan)
+    present = np.zeros(values.shape, dtype=bool)
+    values[rows, col_codes] = pm_df['proportion'].to_numpy(dtype=float)[row_index]
+    present[rows, col_codes] = True
+
+    return columns, (row_index, rows, col_codes), values, present
+
+
+def _smooth_grade_proportions(pm_df: pd.DataFrame, alpha: float = ALPHA_ES) -> pd.Series:
+    """Smoothed proportion per (group, grade), computed in one pass over a month x grade matrix.
+
+    Args:
+        pm_df: Historical monthly steel production data, with grade proportions per month and group
+
+    Returns:
+        Smoothed proportions indexed by (group, grade), sorted by group then grade
+
+    """
+
+    columns, _, values, present = _layout_series(pm_df)
+    return pd.Series(_ewm_last(values, present, alpha), index=columns, name='proportion')
+
 
-def _normalize(base):
-    """Make proportions add up to 1 (or 0 if no data)"""
+def smoothing_states(pm_df: pd.DataFrame, seeds: pd.DataFrame | None = None,
+                     alpha: float | Mapping[QualityGroup, float] = ALPHA_ES) -> pd.DataFrame:
+    """Smoothing state of every (group, grade) after each month of production.
 
-    base = base.copy()
-    s = base['proportion'].sum()
-    if s > 0:
-        # proportions sum up to 1
-        base['proportion'] = base['proportion'] / s
+    Args:
+        pm_df: Monthly steel production (month as date, group, grade, heats_produced), complete for every
+            month and quality group it covers
+        seeds: States to continue from, indexed by (group, grade), with `proportion` and `weight` columns
+        alpha: smoothing factor, or smoothing factor per quality group (ALPHA_ES for the ones left out)
+
+    Returns:
+        One row per row of `pm_df` with its month, group, grade, smoothed `proportion` and its `weight`
+
+    """
+
+    pm_df = pm_df.loc[:, ['month', 'group', 'grade', 'heats_produced']]
+    dates = pm_df['month']
+    pm_df['month'] = pd.to_datetime(dates).dt.to_period('M')
+    pm_df['proportion'] = _proportions(pm_df)
+
+    columns, (row_index, rows, col_codes), values, present = _layout_series(pm_df)
+    if isinstance(alpha, Mapping):
+        alpha = np.array([alpha.get(group, ALPHA_ES) for group in columns.get_level_values('group')], dtype=float)
+
+    weighted = old_wt = None
+    if seeds is not None and len(seeds):
+        seeds = seeds.reindex(columns)
+        weighted = seeds['proportion'].to_numpy(dtype=float)
+        old_wt = seeds['weight'].fillna(1.).to_numpy(dtype=float)
+
+    smoothed = np.empty(values.shape)
+    weights = np.empty(values.shape)
+    for i, (weighted, old_wt) in enumerate(_ewm_steps(values, present, alpha, weighted, old_wt)):
+        smoothed[i] = weighted
+        weights[i] = old_wt
+
+    states = pd.DataFrame({
+        'month': dates.to_numpy()[row_index],
+        'group': columns.get_level_values('group').to_numpy()[col_codes],
+        'grade': columns.get_level_values('grade').to_numpy()[col_codes],
+        'proportion': smoothed[rows, col_codes],
+        'weight': weights[rows, col_codes],
+    })
+    return states
+
+
+def _allocate_group_heats(grades: np.ndarray, proportions: np.ndarray, heats_forecasted: int):
+    """Hamilton (largest remainder) rounding of a group's forecasted heats over its grades.
+
+    Args:
+        grades: Grades of the group, sorted
+        proportions: Smoothed proportion per grade
+        heats_forecasted: Total heats forecasted for the group
+
+    Returns:
+        Grades, heats and proportions, in the order the grades were allocated
+
+    """
+
+    # make proportions add up to 1 (or uniform if no data)
+    total = np.where(np.isnan(proportions), 0., proportions).sum()
+    if total > 0:
+        proportions = proportions / total
     else:
-        # if no predicted proportions, proportions are uniform
-        n = len(base)
-        base['proportion'] = (1.0 / n) if n else 0.0
-    return base
+        proportions = np.full(len(proportions), 1.0 / len(proportions))
 
+    raw_heats = proportions * heats_forecasted
+    if not np.isfinite(raw_heats).all():
+        raise ValueError('Cannot allocate heats to grades without a forecasted proportion')
 
-def _do_forecast_breakdown(omf_df: pd.DataFrame, pm_df: pd.DataFrame, m_period: pd.Period) -> list[
-    ForecastProductionGroup]:
+    heats = np.floor(raw_heats).astype(int)
+    remainders = raw_heats - heats
+
+    # hamilton rounding: largest remainders go first, tie-breaker is the grade
+    remainder = heats_forecasted - heats.sum()
+    if remainder > 0:
+        order = np.lexsort((np.arange(len(grades)), -remainders))
+        heats = heats[order]
+        grades = grades[order]
+        heats[:int(remainder)] += 1
+
+    # make sure total heats produced match order forecast
+    assert heats.sum() == heats_forecasted
+
+    # normalize proportions to match forecasted heats
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportions = heats / heats.sum()
+
+    return grades, heats, proportions
+
+
+@metrics.timed('forecast.allocate')
+def _breakdown_smoothed_arrays(omf_df: pd.DataFrame, smoothed: pd.Series) -> list[GroupBreakdown]:
     """
     
     Args:
         omf_df: The order forecast for the target month
-        pm_df: Historical mothly steel production data
+        smoothed: Smoothed grade proportions, indexed by (group, grade) and sorted
     
     Returns:
         Forecasts per group, broken down by grades for the target month
         
+    Raises:
+        ValueError: a group's grades can't be given valid proportions (e.g. no heats were forecasted for it)
+
     """
 
-    pm_df['proportion'] = (
-            pm_df['heats_produced'] /
-            pm_df.groupby(["month", "group"])['heats_produced'].transform("sum")
-    )
-
-    group_forecasts: list[ForecastProductionGroup] = []
-    for quality_group, grade_production in pm_df.groupby("group"):
-        parts = []
-        for grade, m_df in grade_production.groupby('grade'):
-            # sort by month to prepare for exponentional smoothening
-            sorted_df = m_df.sort_values('month')  # type: ignore
-
-            # use exponential smoothing
-            # no adjust to do simple forcast
-            smoothed = sorted_df["proportion"].ewm(alpha=ALPHA_ES, adjust=False).mean().iloc[
-                -1]  # last one is predicted value
-            parts.append((grade, smoothed))
-
-        group_prod_forecast = pd.DataFrame(parts, columns=['grade', 'proportion'])
-        group_prod_forecast = _normalize(group_prod_forecast)
-        group_prod_forecast['group'] = quality_group
-        group_prod_forecast['target_month'] = m_period
-
-        # attach group total heats for the target month (0 if not present)
-        try:
-            group_orders_forecasted = int(
-                omf_df.loc[omf_df['group'] == quality_group, "heats_orders_forecasted"].iat[0])
-        except IndexError:
-            group_orders_forecasted = 0
-
-        # calculate forecasted grade production by multiplifying forecasted grade proportions by forecasted group orders
-        group_prod_forecast['raw_heats'] = group_prod_forecast['proportion'] * group_orders_forecasted
-        group_prod_forecast['heats'] = np.floor(group_prod_forecast['raw_heats']).astype(
-            int)  # heats floored to integers
-        group_prod_forecast['__remainder'] = group_prod_forecast['raw_heats'] - group_prod_forecast['heats']
-
-        # hamilton rounding
-        remainder = group_orders_forecasted - group_prod_forecast['heats'].sum()
-        if remainder > 0:
-
-            group_prod_forecast = group_prod_forecast.sort_values(  # largest remainders go first
-                by=["__remainder", "grade"],  # tie-breaker: remainder first, then grade
-                ascending=[False, True]
-            )  # type: ignore
-
-            col_idx = group_prod_forecast.columns.get_loc('heats')
-            for i in range(int(remainder)):
-                group_prod_forecast.iat[i, col_idx] += 1
-
-        group_prod_forecast = group_prod_forecast.drop(columns=['__remainder'])
-
-        # make sure total heats produced match order forecast
-        assert group_prod_forecast['heats'].sum() == group_orders_forecasted
-
-        # normalize proportions to match forecasted heats
-        group_prod_forecast['proportion'] = group_prod_forecast['heats'] / group_prod_forecast['heats'].sum()
-
-        # save to pyantic model for decoupling pandas from endpoints
-        # and make it easier to know what output structure to expect)
-        grades = [ForecastProductionGrade(**grade) for _, grade in group_prod_forecast.iterrows()]
-
-        fpg = ForecastProductionGroup(
-            group=QualityGroup(quality_group),
-            heats=group_orders_forecasted,
-            grades=grades
-        )
-        group_forecasts.append(fpg)
+    # group total heats for the target month (0 if not present)
+    orders = omf_df.drop_duplicates('group').set_index('group')['heats_orders_forecasted'] if len(omf_df) else {}
 
-    return group_forecasts
+    return [
+        _breakdown_group(quality_group, group_smoothed.index.get_level_values('grade').to_numpy(),
+                         group_smoothed.to_numpy(), int(orders.get(quality_group, 0)))
+        for quality_group, group_smoothed in smoothed.groupby(level='group', sort=False)
+    ]
 
 
-def forecast_grade_breakdown(m_groups_forecast, production_data, year_month: datetime.date) -> list[
-    ForecastProductionGroup]:
-    omf_df = pd.DataFrame(m_groups_forecast)
-    omf_df["month"] = (
-        pd.to_datetime(omf_df["month"], format="%Y-%m", errors="coerce")
-        .dt.to_period("M")
-    )
+def _breakdown_group(quality_group: QualityGroup, grades: np.ndarray, smoothed: np.ndarray,
+                     heats_forecasted: int) -> GroupBreakdown:
+    """Forecast of a quality group from the smoothed proportions of its grades (sorted)"""
+
+    grades, heats, proportions = _allocate_group_heats(grades, smoothed, heats_forecasted)
+    # the bounds ForecastProductionGrade validates (NaN when no heats were forecasted)
+    if not ((proportions >= 0.) & (proportions <= 1.)).all():
+        raise ValueError(f'Invalid proportions forecasted for {quality_group}')
+
+    return GroupBreakdown(QualityGroup(quality_group), heats_forecasted, grades, heats, proportions)
 
-    pm_df = pd.DataFrame(production_data).drop('short_tons', axis=1)
-    pm_df["month"] = (
-        pd.to_datetime(pm_df["month"], format="%Y-%m", errors="coerce")
-        .dt.to_period("M")
-    )
 
-    m_period = pd.Period(year_month, freq="M")
-    # only query for target date
+def _breakdown_smoothed_proportions(omf_df: pd.DataFrame, smoothed: pd.Series) -> list[ForecastProductionGroup]:
+    """Forecasts per group as models (see `_breakdown_smoothed_arrays`)"""
 
-    result: list[ForecastProductionGroup] = _do_forecast_breakdown(omf_df, pm_df, m_period)
+    # save to pyantic model for decoupling pandas from endpoints
+    # and make it easier to know what output structure to expect)
+    return [breakdown.to_model() for breakdown in _breakdown_smoothed_arrays(omf_df, smoothed)]
+
+
+@metrics.timed('forecast.breakdown_history')
+def _do_forecast_breakdown(omf_df: pd.DataFrame, pm_df: pd.DataFrame, m_period: pd.Period) -> list[
+    ForecastProductionGroup]:
+    """
+    
+    Args:
+        omf_df: The order forecast for the target month
+        pm_df: Historical mothly steel production data
+        m_period: The target month
+
+    Returns:
+        Forecasts per group, broken down by grades for the target month
+        
+    """
 
-    return result
+    pm_df['proportion'] = _proportions(pm_df)
+    smoothed = _smooth_grade_proportions(pm_df)
+    return _breakdown_smoothed_proportions(omf_df, smoothed)
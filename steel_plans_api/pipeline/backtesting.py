@@ -0,0 +1,167 @@
+import dataclasses
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from . import analysis
+from ..enums import QualityGroup
+
+__all__ = (
+    'ALPHA_GRID',
+    'Backtest',
+    'backtest',
+)
+
+# smoothing factors tried by default
+ALPHA_GRID = tuple(round(alpha, 2) for alpha in np.arange(0.05, 1., 0.05).tolist())
+
+
+@dataclasses.dataclass(frozen=True)
+class Backtest:
+    """Errors of the grade heats forecast for every month of a production history, per smoothing factor.
+
+    Attributes:
+        groups: `mae`, `mape` (in percent, None without produced heats) and number of grade-months forecast
+            (`forecasts`) per alpha and quality group, sorted by group then alpha
+        grades: the same per alpha, quality group and grade, where `forecasts` counts months
+
+    """
+
+    groups: pd.DataFrame
+    grades: pd.DataFrame
+
+    def best_alphas(self) -> dict[QualityGroup, float]:
+        """Smoothing factor with the lowest MAE for each quality group (the smallest one on ties)"""
+
+        if self.groups.empty:
+            return {}
+        best = self.groups.loc[self.groups.groupby('group', sort=False)['mae'].idxmin()]
+        return dict(zip(best['group'], best['alpha']))
+
+    def report(self, current_alphas: Mapping[QualityGroup, float]) -> list[dict]:
+        """Errors of each quality group per alpha, its best alpha with its errors per grade, and its current alpha"""
+
+        best = self.best_alphas()
+        report = []
+        for group, errors in self.groups.groupby('group', sort=False):
+            grades = self.grades[(self.grades['group'] == group) & (self.grades['alpha'] == best[group])]
+            report.append({
+                'group': group,
+                'alpha': best[group],
+                'current_alpha': current_alphas.get(group, analysis.ALPHA_ES),
+                **errors.loc[errors['alpha'] == best[group], ['mae', 'mape']].iloc[0].to_dict(),
+                'errors': errors.drop(columns='group').to_dict(orient='records'),
+                'grades': grades.drop(columns=['alpha', 'group']).to_dict(orient='records'),
+            })
+        return report
+
+
+def _aggregate(errors: np.ndarray, pct_errors: np.ndarray, evaluated: np.ndarray, has_pct: np.ndarray,
+               one_hot: np.ndarray | None = None):
+    """Mean absolute (percentage) errors over months, per alpha and series, or per group with `one_hot`"""
+
+    error_sums = np.where(evaluated[:, None, :], errors, 0.).sum(axis=0)
+    pct_sums = np.where(has_pct[:, None, :], pct_errors, 0.).sum(axis=0)
+    counts = evaluated.sum(axis=0)
+    pct_counts = has_pct.sum(axis=0)
+    if one_hot is not None:
+        error_sums, pct_sums = error_sums @ one_hot, pct_sums @ one_hot
+        counts, pct_counts = counts @ one_hot, pct_counts @ one_hot
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return error_sums / counts, 100. * pct_sums / pct_counts, counts.astype(int)
+
+
+def backtest(production: Iterable, alphas: Sequence[float] = ALPHA_GRID) -> Backtest:
+    """Forecasts every month of a production history from the months before it, with each smoothing factor.
+
+    A month's grade proportions are forecast from the smoothing state after the month before, as live forecasts
+    are, and spread over the heats each quality group actually produced in that month (without rounding), so that
+    errors measure the grade breakdown alone. Every smoothing factor and month is smoothed in one pass over a
+    month x (alpha, grade) matrix.
+
+    Args:
+        production: Monthly steel production (month as date, group, grade, heats_produced)
+        alphas: smoothing factors to try
+
+    Returns:
+        Errors per alpha and quality group, and per alpha and grade
+
+    """
+
+    alphas = np.asarray(alphas, dtype=float)
+    pm_df = pd.DataFrame(production, columns=['month', 'group', 'grade', 'heats_produced'])
+    pm_df['month'] = pd.to_datetime(pm_df['month']).dt.to_period('M')
+    if pm_df.empty:
+        empty = pd.DataFrame(columns=['alpha', 'group', 'grade', 'mae', 'mape', 'forecasts'])
+        return Backtest(groups=empty.drop(columns='grade'), grades=empty)
+
+    # one row per month with production, one column per (group, grade)
+    heats = (pm_df.groupby(['month', 'group', 'grade'])['heats_produced'].sum(min_count=1)
+             .unstack(['group', 'grade']))
+    columns = heats.columns
+    heats = heats.to_numpy(dtype=float)
+    present = ~np.isnan(heats)
+    heats = np.nan_to_num(heats)
+    n_months, n_series = heats.shape
+
+    group_codes, groups = pd.factorize(columns.get_level_values('group')) if n_series else ([], [])
+    one_hot = np.zeros((n_series, len(groups)))
+    one_hot[np.arange(n_series), group_codes] = 1.
+    totals = heats @ one_hot
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportions = np.where(present, heats / totals[:, group_codes], np.nan)
+
+    # every alpha smooths its own copy of the series, side by side
+    smoothed = np.empty((n_months, len(alphas), n_series))
+    steps = analysis._ewm_steps(np.tile(proportions, len(alphas)), np.tile(present, len(alphas)),
+                                np.repeat(alphas, n_series))
+    for i, (weighted, _) in enumerate(steps):
+        smoothed[i] = weighted.reshape(len(alphas), n_series)
+
+    # month i is forecast from the state after month i - 1, over the grades seen by then
+    known = np.logical_or.accumulate(present, axis=0)[:-1]
+    state = np.where(known[:, None, :], np.nan_to_num(smoothed[:-1]), 0.)
+    state_sums = (state @ one_hot)[..., group_codes]
+    known_counts = (known @ one_hot)[:, group_codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # groups without any known proportion are spread uniformly
+        uniform = np.where(known, 1. / known_counts, 0.)
+        shares = np.where(state_sums > 0, state / state_sums, uniform[:, None, :])
+
+    actual = heats[1:]
+    forecasts = shares * totals[1:, None, group_codes]
+    evaluated = (known | present[1:]) & (totals[1:, group_codes] > 0) & (known_counts > 0)
+    has_pct = evaluated & (actual > 0)
+
+    errors = np.abs(forecasts - actual[:, None, :])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pct_errors = errors / actual[:, None, :]
+
+    mae, mape, counts = _aggregate(errors, pct_errors, evaluated, has_pct)
+    grades = pd.DataFrame({
+        'alpha': np.repeat(alphas, n_series),
+        'group': np.tile(columns.get_level_values('group').to_numpy(), len(alphas)),
+        'grade': np.tile(columns.get_level_values('grade').to_numpy(), len(alphas)),
+        'mae': mae.ravel(),
+        'mape': mape.ravel(),
+        'forecasts': np.tile(counts, len(alphas)),
+    })
+
+    mae, mape, counts = _aggregate(errors, pct_errors, evaluated, has_pct, one_hot)
+    group_errors = pd.DataFrame({
+        'alpha': np.repeat(alphas, len(groups)),
+        'group': np.tile(np.asarray(groups, dtype=object), len(alphas)),
+        'mae': mae.ravel(),
+        'mape': mape.ravel(),
+        'forecasts': np.tile(counts, len(alphas)),
+    })
+
+    def clean(df: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+        df = df[df['forecasts'] > 0].sort_values(by + ['alpha'], kind='stable').reset_index(drop=True)
+        df['mape'] = df['mape'].astype(object).where(df['mape'].notna(), None)
+        return df
+
+    return Backtest(groups=clean(group_errors, ['group']), grades=clean(grades, ['group', 'grade']))
@@ -0,0 +1,63 @@
+import datetime
+from typing import Iterable
+
+import pandas as pd
+import sqlalchemy as sqla
+
+from . import analysis, db
+from ..enums import ReportPeriod
+
+__all__ = (
+    'count_heats',
+    'refresh_charge_heats',
+)
+
+
+def _period_start(day: datetime.date, period: ReportPeriod) -> datetime.date:
+    if period is ReportPeriod.WEEK:
+        return day - datetime.timedelta(days=day.weekday())
+    if period is ReportPeriod.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def count_heats(charges, period: ReportPeriod, by_mould_size: bool = True) -> pd.DataFrame:
+    """Heats charged per period (as its first day), grade and mould size, sorted by them.
+
+    Args:
+        charges: charges with their day, grade and mould size
+        period: period to count heats per
+        by_mould_size: whether heats are counted per mould size, or per grade only
+
+    """
+
+    columns = ['start', 'grade'] + (['mould_size'] if by_mould_size else [])
+    charges = pd.DataFrame(charges, columns=['day', 'grade', 'mould_size'])
+    if charges.empty:
+        return pd.DataFrame(columns=columns + ['heats'])
+
+    charges['start'] = [_period_start(day, period) for day in charges['day']]
+    heats = charges.groupby(columns, dropna=False).size().rename('heats').reset_index()
+    # charges without a mould size are counted together, as NULL
+    heats[columns] = heats[columns].astype(object).where(heats[columns].notna(), None)
+    return heats
+
+
+def refresh_charge_heats(conn: sqla.Connection, months: Iterable[datetime.date] | None = None):
+    """Recounts the heats charged in the months of `months` from the daily charge schedule (in every month if None)"""
+
+    table = db.charge_heats_monthly
+    delete_stmt = sqla.delete(table)
+    charges_stmt = db.select_charges()
+
+    if months is not None:
+        months = sorted({month.replace(day=1) for month in months})
+        if not months:
+            return
+        delete_stmt = delete_stmt.where(table.c.month.in_(months))
+        charges_stmt = sqla.union_all(*(db.select_charges(month, analysis.add_months(month, 1)) for month in months))
+
+    conn.execute(delete_stmt)
+    heats = count_heats(conn.execute(charges_stmt).mappings().all(), ReportPeriod.MONTH)
+    if not heats.empty:
+        conn.execute(sqla.insert(table), heats.rename(columns={'start': 'month'}).to_dict(orient='records'))
@@ -1,13 +1,21 @@
+import contextlib
+import datetime
 import functools
-from typing import Annotated
+import secrets
+import threading
+import time
+import weakref
+from typing import Annotated, Callable, Iterable
 
 import sqlalchemy as sqla
 from fastapi import Depends
-from sqlalchemy import Date, Engine, Enum, Integer, String, create_engine, Time, inspect, Computed, Column, Connection
+from sqlalchemy import (Boolean, Date, DateTime, Engine, Enum, Float, Integer, String, create_engine, Time, inspect, Computed,
+                        Column, Connection)
+from sqlalchemy.dialects import postgresql, sqlite
 
-from ..enums import QualityGroup
+from .. import metrics, settings
+from ..enums import JobStatus, QualityGroup, UploadFileType, UploadMode
 
-DATABASE_URL = "sqlite:///./app.db"
 TONS_PER_HEAT = 100
 
 metadata = sqla.MetaData()
@@ -15,10 +23,15 @@ metadata = sqla.MetaData()
 day_steel_production = sqla.Table(
     "daily_charge_schedule",
     metadata,
-    Column('day', Date, primary_key=True, nullable=False),
-    Column('start_time', Time, primary_key=True, nullable=False),
-    Column('grade', String, primary_key=True, nullable=True),
+    Column('day', Date, nullable=False),
+    Column('start_time', Time, nullable=False),
+    Column('grade', String, nullable=True),
     Column('mould_size', String, nullable=True),
+    # NOTE: SQLite allows NULLs in primary keys, PostgreSQL doesn't, a unique index treating NULLs as equal is
+    # used there instead
+    sqla.PrimaryKeyConstraint('day', 'start_time', 'grade').ddl_if(dialect='sqlite'),
+    sqla.Index('ux_daily_charge_schedule_day_start_time_grade', 'day', 'start_time', 'grade', unique=True,
+               postgresql_nulls_not_distinct=True).ddl_if(dialect='postgresql'),
 )
 
 month_steel_production = sqla.Table(
@@ -28,7 +41,10 @@ month_steel_production = sqla.Table(
     Column('grade', String, nullable=False, primary_key=True),
     Column('group', Enum(QualityGroup), nullable=False),
     Column('short_tons', Integer, nullable=False),
+    # integer division truncates on both SQLite and PostgreSQL, which only has persisted computed columns
     Column('heats_produced', Integer, Computed(f'short_tons / {TONS_PER_HEAT}', persisted=True)),
+    # forecasts read a window of months, grouped by quality group and grade
+    sqla.Index('ix_product_groups_monthly_month_group_grade', 'month', 'group', 'grade'),
 )
 
 month_group_order_forecast = sqla.Table(
@@ -37,23 +53,480 @@ month_group_order_forecast = sqla.Table(
     Column('month', Date, primary_key=True, nullable=False),
     Column('group', Enum(QualityGroup), primary_key=True, nullable=False),
     Column('heats_orders_forecasted', Integer, primary_key=True, nullable=False),
+    # there is one forecast per quality group and month
+    sqla.Index('ux_steel_grade_production_month_group', 'month', 'group', unique=True),
 )
 
+# columns identifying an uploaded row, which re-uploads update rather than add (dates first)
+natural_keys = {
+    day_steel_production: ('day', 'start_time', 'grade'),
+    month_steel_production: ('month', 'grade'),
+    month_group_order_forecast: ('month', 'group'),
+}
+
+# exponential smoothing state of each grade's proportion of its quality group, after each month of production,
+# maintained on upload so forecasts don't have to go through the whole production history
+grade_proportion_smoothing = sqla.Table(
+    'grade_proportion_smoothing',
+    metadata,
+    Column('group', Enum(QualityGroup), primary_key=True, nullable=False),
+    Column('grade', String, primary_key=True, nullable=False),
+    Column('month', Date, primary_key=True, nullable=False),
+    Column('proportion', Float, nullable=True),  # NULL until the grade has a known proportion
+    Column('weight', Float, nullable=False),
+)
+
+# smoothing factor of each quality group's grade proportions, chosen by backtesting (ALPHA_ES for groups without)
+smoothing_alphas = sqla.Table(
+    'smoothing_alphas',
+    metadata,
+    Column('group', Enum(QualityGroup), primary_key=True, nullable=False),
+    Column('alpha', Float, nullable=False),
+    Column('mae', Float, nullable=True),  # backtesting error it was chosen with
+    Column('updated_at', DateTime, nullable=False, server_default=sqla.func.current_timestamp()),
+)
+
+# heats charged per month, grade and mould size, from the daily charge schedules, maintained on upload so reports
+# don't have to go through every charge
+charge_heats_monthly = sqla.Table(
+    'charge_heats_monthly',
+    metadata,
+    Column('month', Date, nullable=False),  # first day of the month
+    Column('grade', String, nullable=False),
+    Column('mould_size', String, nullable=True),
+    Column('heats', Integer, nullable=False),
+    sqla.Index('ix_charge_heats_monthly_month_grade', 'month', 'grade'),
+)
+
+# incremented whenever rows are uploaded to a table, so results derived from it can be cached
+dataset_versions = sqla.Table(
+    'dataset_versions',
+    metadata,
+    Column('table_name', String, primary_key=True, nullable=False),
+    Column('version', Integer, nullable=False),
+)
+
+# a single row naming the database, so that files derived from it (see `snapshot`) aren't mistaken for another's
+database_info = sqla.Table(
+    'database_info',
+    metadata,
+    Column('database_id', String(32), primary_key=True, nullable=False),
+)
+
+
+@sqla.event.listens_for(database_info, 'after_create')
+def _name_database(table, conn, **_):
+    conn.execute(sqla.insert(table).values(database_id=secrets.token_hex(16)))
+
+
+# files loaded so far, so that identical uploads can be answered without parsing them again
+uploads = sqla.Table(
+    'uploads',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('sha256', String(64), nullable=False),
+    Column('file_type', Enum(UploadFileType), nullable=False),
+    Column('rows', Integer, nullable=False),
+    Column('table_version', Integer, nullable=False),  # dataset version of the table right after the upload
+    Column('created_at', DateTime, nullable=False, server_default=sqla.func.current_timestamp()),
+    sqla.Index('ix_uploads_file_type_sha256', 'file_type', 'sha256'),
+)
+
+# uploads loaded in the background, oldest first; results are only set once a job succeeded
+ingestion_jobs = sqla.Table(
+    'ingestion_jobs',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('file_type', Enum(UploadFileType), nullable=False),
+    Column('mode', Enum(UploadMode), nullable=False),
+    Column('status', Enum(JobStatus), nullable=False),
+    Column('rows', Integer, nullable=False, default=0),  # rows processed so far
+    Column('inserted', Integer, nullable=True),
+    Column('updated', Integer, nullable=True),
+    Column('unchanged', Integer, nullable=True),
+    Column('deleted', Integer, nullable=True),
+    Column('duplicate', Boolean, nullable=True),
+    Column('rows_per_second', Float, nullable=True),
+    Column('error', String, nullable=True),
+    Column('created_at', DateTime, nullable=False, server_default=sqla.func.current_timestamp()),
+    Column('started_at', DateTime, nullable=True),
+    Column('finished_at', DateTime, nullable=True),
+    # workers claim the oldest queued job of their file type
+    sqla.Index('ix_ingestion_jobs_status_file_type_id', 'status', 'file_type', 'id'),
+)
+
+
+def bump_dataset_version(conn: Connection, table: sqla.Table):
+    stmt = (
+        sqla.update(dataset_versions)
+        .where(dataset_versions.c.table_name == table.name)
+        .values(version=dataset_versions.c.version + 1)
+    )
+    if not conn.execute(stmt).rowcount:
+        conn.execute(sqla.insert(dataset_versions).values(table_name=table.name, version=1))
+
+
+def upsert(table: sqla.Table, dialect: sqla.Dialect) -> sqla.Insert:
+    """Insert into `table` updating the rows with the same natural key instead, only where their values differ"""
+
+    keys = natural_keys[table]
+    stmt = (postgresql if dialect.name == 'postgresql' else sqlite).insert(table)
+    values = {column.name: stmt.excluded[column.name] for column in table.columns
+              if column.name not in keys and column.computed is None}
+    changed = sqla.or_(*(table.c[name].is_distinct_from(value) for name, value in values.items()))
+    return stmt.on_conflict_do_update(index_elements=keys, set_=values, where=changed)
+
+
+def bulk_insert(conn: Connection, table: sqla.Table, records: list[dict]):
+    """Inserts `records` into `table`, with COPY on PostgreSQL (through psycopg) and executemany elsewhere"""
+
+    if not records:
+        return
+    if (conn.dialect.name, conn.dialect.driver) != ('postgresql', 'psycopg'):
+        conn.execute(sqla.insert(table), records)
+        return
+
+    columns = [table.c[name] for name in records[0]]
+    # values are sent as they would be bound to a statement, e.g. enums as their names
+    processors = [column.type.bind_processor(conn.dialect) for column in columns]
+    preparer = conn.dialect.identifier_preparer
+    stmt = (f'COPY {preparer.format_table(table)} ({", ".join(preparer.quote(column.name) for column in columns)}) '
+            f'FROM STDIN')
+
+    with conn.connection.driver_connection.cursor() as cursor, cursor.copy(stmt) as copy:
+        for record in records:
+            copy.write_row([
+                record[column.name] if processor is None else processor(record[column.name])
+                for column, processor in zip(columns, processors)
+            ])
+
+
+def get_dataset_versions(conn: Connection, *tables: sqla.Table) -> tuple[int, ...]:
+    """Versions of `tables`, in order (0 for tables nothing was uploaded to yet)"""
+
+    stmt = sqla.select(dataset_versions).where(dataset_versions.c.table_name.in_([table.name for table in tables]))
+    versions = dict(conn.execute(stmt).all())
+    return tuple(versions.get(table.name, 0) for table in tables)
+
+
+def get_database_id(conn: Connection) -> str:
+    """Random id the database was given when it was created"""
+
+    return conn.execute(sqla.select(database_info.c.database_id)).scalar_one()
+
+
+def select_upload(file_type: UploadFileType, sha256: str, table_version: int) -> sqla.Select:
+    """Latest upload of a file of `file_type` with hash `sha256`, if its table is still at `table_version`"""
+
+    return sqla.select(uploads).where(
+        uploads.c.file_type == file_type,
+        uploads.c.sha256 == sha256,
+        uploads.c.table_version == table_version,
+    ).order_by(uploads.c.id.desc()).limit(1)
+
+
+def select_production_history(until: datetime.date | None = None, since: datetime.date | None = None,
+                              groups: Iterable[QualityGroup] | None = None) -> sqla.Select:
+    """Monthly steel production (before `until`, from `since`, of `groups`), with the columns forecasts use"""
+
+    table = month_steel_production
+    stmt = sqla.select(table.c.month, table.c.group, table.c.grade, table.c.heats_produced)
+    if until is not None:
+        stmt = stmt.where(table.c.month < until)
+    if since is not None:
+        stmt = stmt.where(table.c.month >= since)
+    if groups is not None:
+        stmt = stmt.where(table.c.group.in_(sorted(set(groups))))
+    return stmt
+
+
+def select_smoothing_alphas() -> sqla.Select:
+    """Smoothing factor of each quality group that has one"""
+
+    return sqla.select(smoothing_alphas.c.group, smoothing_alphas.c.alpha)
+
+
+def select_smoothing_state(until: datetime.date, groups: list[QualityGroup] | None = None) -> sqla.Select:
+    """Latest smoothing state of every (group, grade) before `until` (in `groups`)"""
+
+    table = grade_proportion_smoothing
+    latest = sqla.select(table.c.group, table.c.grade, sqla.func.max(table.c.month).label('month')).where(
+        table.c.month < until
+    )
+    if groups is not None:
+        latest = latest.where(table.c.group.in_(groups))
+    latest = latest.group_by(table.c.group, table.c.grade).subquery()
+
+    return sqla.select(table.c.group, table.c.grade, table.c.month, table.c.proportion, table.c.weight).join(
+        latest, sqla.and_(
+            table.c.group == latest.c.group,
+            table.c.grade == latest.c.grade,
+            table.c.month == latest.c.month,
+        )
+    )
+
+
+def select_smoothing_states(since: datetime.date, until: datetime.date) -> sqla.Select:
+    """Smoothing states from `since` to before `until`, plus the latest state of every (group, grade) before"""
+
+    table = grade_proportion_smoothing
+    in_range = sqla.select(table.c.group, table.c.grade, table.c.month, table.c.proportion, table.c.weight).where(
+        table.c.month >= since,
+        table.c.month < until,
+    )
+    return sqla.union_all(select_smoothing_state(since), in_range)
+
+
+def select_order_forecasts(since: datetime.date, until: datetime.date) -> sqla.Select:
+    """Quality groups order forecasts from `since` to before `until`"""
+
+    table = month_group_order_forecast
+    return sqla.select(table).where(table.c.month >= since, table.c.month < until)
+
+
+def select_charges(since: datetime.date | None = None, until: datetime.date | None = None) -> sqla.Select:
+    """Charges of the daily charge schedules (from `since`, before `until`), slots without a grade aren't charges"""
+
+    table = day_steel_production
+    stmt = sqla.select(table.c.day, table.c.grade, table.c.mould_size).where(table.c.grade.is_not(None))
+    if since is not None:
+        stmt = stmt.where(table.c.day >= since)
+    if until is not None:
+        stmt = stmt.where(table.c.day < until)
+    return stmt
+
+
+def select_charge_heats_monthly(since: datetime.date, until: datetime.date, by_mould_size: bool = True) -> sqla.Select:
+    """Heats charged per month, grade (and mould size), for the months from `since` to before `until`"""
+
+    table = charge_heats_monthly
+    columns = [table.c.month, table.c.grade] + ([table.c.mould_size] if by_mould_size else [])
+    return sqla.select(*columns, sqla.func.sum(table.c.heats).label('heats')).where(
+        table.c.month >= since,
+        table.c.month < until,
+    ).group_by(*columns).order_by(*columns)
+
+
+def select_production_heats(since: datetime.date, until: datetime.date) -> sqla.Select:
+    """Heats produced per quality group and grade from `since` to before `until`"""
+
+    table = month_steel_production
+    return sqla.select(table.c.group, table.c.grade, sqla.func.sum(table.c.heats_produced).label('heats')).where(
+        table.c.month >= since,
+        table.c.month < until,
+    ).group_by(table.c.group, table.c.grade)
+
+
+# columns of the rows stored from uploads, in the order of the long layout of their files
+upload_columns = {
+    day_steel_production: ('day', 'start_time', 'grade', 'mould_size'),
+    month_steel_production: ('month', 'group', 'grade', 'short_tons'),
+    month_group_order_forecast: ('month', 'group', 'heats_orders_forecasted'),
+}
+
+
+def select_uploaded_rows(table: sqla.Table, since: datetime.date | None = None, until: datetime.date | None = None,
+                         groups: Iterable[QualityGroup] | None = None,
+                         grades: Iterable[str] | None = None) -> sqla.Select:
+    """Rows stored from uploads to `table` (dated from `since`, before `until`, of `groups` and `grades`), with the
+    columns of their files, in the order of their natural keys.
+
+    Charges have no quality group, they are of the groups their grade was produced in.
+
+    """
+
+    date = table.c[upload_columns[table][0]]
+    stmt = sqla.select(*(table.c[name] for name in upload_columns[table])).order_by(
+        *(table.c[name] for name in natural_keys[table])
+    )
+    if since is not None:
+        stmt = stmt.where(date >= since)
+    if until is not None:
+        stmt = stmt.where(date < until)
+    if groups is not None and 'group' in table.c:
+        stmt = stmt.where(table.c.group.in_(sorted(set(groups))))
+    elif groups is not None:
+        production = month_steel_production
+        stmt = stmt.where(table.c.grade.in_(
+            sqla.select(production.c.grade).where(production.c.group.in_(sorted(set(groups))))
+        ))
+    if grades is not None:
+        stmt = stmt.where(table.c.grade.in_(sorted(set(grades))))
+    return stmt
+
+
+def _remove_duplicates(conn: Connection, table: sqla.Table, columns: list[Column]) -> int:
+    """Deletes the rows of `table` with the same `columns` as a row stored after them, returning how many"""
+
+    # the physical row id orders rows by when they were stored
+    row_id = 'ctid' if conn.dialect.name == 'postgresql' else 'rowid'
+    later = table.alias('later')
+    stored_after = sqla.exists().where(
+        *(later.c[column.name] == column for column in columns),
+        sqla.literal_column(f'later.{row_id}') > sqla.literal_column(f'{table.name}.{row_id}'),
+    )
+    return conn.execute(sqla.delete(table).where(stored_after)).rowcount
+
+
+def _migrate(engine: Engine):
+    """Brings databases created by older versions up to the current schema"""
+
+    from . import charges, smoothing
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    existing_indexes = {name: {index['name'] for index in inspector.get_indexes(name)} for name in existing_tables}
+    metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                # rows stored before a unique index was added may break it
+                if index.unique and table.name in existing_tables and index.name not in existing_indexes[table.name]:
+                    if _remove_duplicates(conn, table, list(index.columns)):
+                        bump_dataset_version(conn, table)
+                index.create(conn, checkfirst=True)
+
+        if grade_proportion_smoothing.name not in existing_tables:
+            smoothing.refresh_smoothing_state(conn)
+        if charge_heats_monthly.name not in existing_tables:
+            charges.refresh_charge_heats(conn)
+
+
+def _set_sqlite_pragmas(read_only: bool):
+    def set_pragmas(dbapi_connection, _):
+        # transactions are started by the engine's `begin` listener instead of the driver
+        dbapi_connection.isolation_level = None
+
+        # the synchronous level can't be changed inside a transaction, so it is set as connections are opened
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}')
+        if settings.SQLITE_MMAP_SIZE:
+            cursor.execute(f'PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return set_pragmas
+
+
+def _begin_sqlite_transaction(read_only: bool):
+    # NOTE: writers take the write lock as they begin, waiting up to the busy timeout for it, rather than failing
+    # when they try to upgrade a read transaction that another writer committed after.
+    # Readers don't take any lock, with WAL they read a snapshot while writers write
+    statement = 'BEGIN' if read_only else 'BEGIN IMMEDIATE'
+
+    def begin(conn: Connection):
+        conn.exec_driver_sql(statement)
+
+    return begin
+
+
+def _is_memory_database(url: sqla.URL) -> bool:
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+
+
+# statements of every engine are timed, by kind (SELECT, INSERT...)
+@sqla.event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.started_at = time.perf_counter()
+
+
+@sqla.event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and hasattr(context, 'started_at'):
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'EMPTY'
+        metrics.SQL_SECONDS.observe(time.perf_counter() - context.started_at, statement=kind)
+
+
+def _create_engine(url: str, pool_size: int, read_only: bool = False) -> Engine:
+    url = sqla.make_url(url)
+    if url.get_backend_name() == 'postgresql':
+        execution_options = {'postgresql_readonly': True} if read_only else {}
+        return create_engine(url, pool_size=pool_size, pool_pre_ping=True, execution_options=execution_options)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url, pool_size=pool_size, pool_pre_ping=True)
+
+    connect_args = {'check_same_thread': False, 'timeout': settings.SQLITE_BUSY_TIMEOUT}
+    if _is_memory_database(url):
+        # connections of an in-memory database can't be pooled, each would have a database of its own
+        return create_engine(url, connect_args=connect_args)
+
+    engine = create_engine(url, pool_size=pool_size, connect_args=connect_args)
+    sqla.event.listen(engine, 'connect', _set_sqlite_pragmas(read_only))
+    sqla.event.listen(engine, 'begin', _begin_sqlite_transaction(read_only))
+    return engine
+
 
 @functools.lru_cache
 def get_engine():
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    """Engine of the database, for connections that write to it"""
+
+    engine = _create_engine(settings.DATABASE_URL, settings.DATABASE_POOL_SIZE)
     if not inspect(engine).get_table_names():
         metadata.create_all(engine)
+    else:
+        _migrate(engine)
     return engine
 
 
+@functools.lru_cache
+def get_read_engine():
+    """Engine of the database, for connections that only read from it"""
+
+    engine = get_engine()  # the schema is brought up to date first
+    if _is_memory_database(engine.url):
+        return engine
+    return _create_engine(settings.DATABASE_URL, settings.DATABASE_READ_POOL_SIZE, read_only=True)
+
+
 EngineDep = Annotated[Engine, Depends(get_engine)]
+ReadEngineDep = Annotated[Engine, Depends(get_read_engine)]
+
+
+# callbacks to call once the transaction of a connection commits, by connection
+_after_commit: weakref.WeakKeyDictionary[Connection, dict] = weakref.WeakKeyDictionary()
+_after_commit_lock = threading.Lock()
+
+
+def after_commit(conn: Connection, callback: Callable[[Engine], None]):
+    """Calls `callback` with the engine of `conn` once its transaction commits, if it was begun by `transaction`
+    (once per callback, not at all if it rolls back)"""
+
+    with _after_commit_lock:
+        _after_commit.setdefault(conn, {})[callback] = None
+
+
+@contextlib.contextmanager
+def transaction(engine: Engine):
+    """`engine.begin()`, calling the callbacks registered with `after_commit` once it commits"""
+
+    with engine.connect() as conn:
+        try:
+            with conn.begin():
+                yield conn
+        finally:
+            with _after_commit_lock:
+                callbacks = _after_commit.pop(conn, {})
+
+    for callback in callbacks:
+        callback(engine)
 
 
 def get_conn(engine: EngineDep):
+    with transaction(engine) as conn:
+        yield conn
+
+
+def get_read_conn(engine: ReadEngineDep):
+    # a transaction, so that every query of a request reads the same snapshot
     with engine.begin() as conn:
         yield conn
 
 
 ConnectionDep = Annotated[Connection, Depends(get_conn)]
+ReadConnectionDep = Annotated[Connection, Depends(get_read_conn)]
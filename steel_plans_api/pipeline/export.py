@@ -0,0 +1,189 @@
+import csv
+import datetime
+import enum
+import io
+from typing import Callable, Iterable, Iterator
+
+import pydantic_core
+import sqlalchemy as sqla
+
+from . import db, models, snapshot
+from .. import metrics, settings
+from ..enums import ExportDataset, ExportFormat, ForecastMethod, QualityGroup
+
+__all__ = (
+    'FORECAST_COLUMNS',
+    'MEDIA_TYPES',
+    'TABLES',
+    'check_format',
+    'export_forecasts',
+    'export_rows',
+)
+
+TABLES = {
+    ExportDataset.MONTHLY_STEEL_GRADE_PRODUCTION: db.month_steel_production,
+    ExportDataset.DAILY_CHARGE_SCHEDULE: db.day_steel_production,
+    ExportDataset.MONTHLY_ORDER_FORECAST: db.month_group_order_forecast,
+}
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: 'text/csv',
+    ExportFormat.NDJSON: 'application/x-ndjson',
+    ExportFormat.PARQUET: 'application/vnd.apache.parquet',
+}
+
+# columns of exported forecasts, and the type of their values
+FORECAST_COLUMNS = {'month': datetime.date, 'group': str, 'grade': str, 'heats': int, 'proportion': float}
+
+# Every format is written a chunk of rows at a time, yielding what each chunk adds to the file, so exports take the
+# same memory whatever their size. Chunks are lists of rows of plain values (quality groups as their names).
+Chunks = Iterable[list[tuple]]
+
+
+def _write_csv(columns: dict[str, type], chunks: Chunks) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # only the header
+
+
+def _write_ndjson(columns: dict[str, type], chunks: Chunks) -> Iterator[bytes]:
+    names = list(columns)
+    for chunk in chunks:
+        yield b''.join(pydantic_core.to_json(dict(zip(names, row))) + b'\n' for row in chunk)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet exports need pyarrow, installed with [parquet]') from None
+    return pyarrow, pyarrow.parquet
+
+
+class _Sink(io.RawIOBase):
+    """File the Parquet writer writes to, keeping what was written until it is taken"""
+
+    def __init__(self):
+        super().__init__()
+        self._written = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._written.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        written = b''.join(self._written)
+        self._written.clear()
+        return written
+
+
+def _write_parquet(columns: dict[str, type], chunks: Chunks) -> Iterator[bytes]:
+    pa, pq = _pyarrow()
+    arrow_types = {datetime.date: pa.date32(), datetime.time: pa.time64('us'), int: pa.int64(), float: pa.float64(),
+                   str: pa.string()}
+    schema = pa.schema([(name, arrow_types[python_type]) for name, python_type in columns.items()])
+
+    # a row group per chunk, the footer describing them is written last
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+_WRITERS: dict[ExportFormat, Callable[[dict[str, type], Chunks], Iterator[bytes]]] = {
+    ExportFormat.CSV: _write_csv,
+    ExportFormat.NDJSON: _write_ndjson,
+    ExportFormat.PARQUET: _write_parquet,
+}
+
+
+def check_format(file_format: ExportFormat):
+    """Raises ImportError if `file_format` needs a package that isn't installed"""
+
+    if file_format is ExportFormat.PARQUET:
+        _pyarrow()
+
+
+def _python_type(column: sqla.ColumnElement) -> type:
+    python_type = column.type.python_type
+    return str if issubclass(python_type, str) else python_type
+
+
+def export_rows(conn: sqla.Connection, dataset: ExportDataset, file_format: ExportFormat,
+                since: datetime.date | None = None, until: datetime.date | None = None,
+                groups: list[QualityGroup] | None = None, grades: list[str] | None = None) -> Iterator[bytes]:
+    """File of the rows stored from uploads of `dataset` (see `db.select_uploaded_rows`), in the long layout uploads
+    accept.
+
+    Rows are fetched from a server-side cursor EXPORT_CHUNK_ROWS at a time, as the file is read, so `conn` must stay
+    open until then.
+
+    """
+
+    stmt = db.select_uploaded_rows(TABLES[dataset], since, until, groups, grades)
+    columns = {column.name: _python_type(column) for column in stmt.selected_columns}
+    enums = [i for i, column in enumerate(stmt.selected_columns) if issubclass(column.type.python_type, enum.Enum)]
+    result = conn.execute(stmt, execution_options={'yield_per': settings.EXPORT_CHUNK_ROWS})
+
+    def chunks():
+        with result:
+            for chunk in result.partitions():
+                if enums:
+                    values = list(zip(*chunk))
+                    for i in enums:
+                        values[i] = [member.value for member in values[i]]
+                    chunk = list(zip(*values))
+                metrics.ROWS_PROCESSED.inc(len(chunk), file_type=dataset.name, action='exported')
+                yield chunk
+
+    return _WRITERS[file_format](columns, chunks())
+
+
+def export_forecasts(snap: snapshot.Snapshot, months: list[datetime.date], methods: dict[QualityGroup, ForecastMethod],
+                     file_format: ExportFormat, groups: list[QualityGroup] | None = None,
+                     grades: list[str] | None = None) -> Iterator[bytes]:
+    """File of the forecasts of `months` (of `groups` and `grades`), a row per grade.
+
+    Every month is forecast before the file is written, so that months that can't be raise ValueError right away
+    rather than while it is read.
+
+    """
+
+    groups = set(groups) if groups is not None else None
+    grades = set(grades) if grades is not None else None
+    with metrics.span('forecast.breakdown'):
+        forecasts = [(month, models.forecast_snapshot(snap, month, methods)) for month in months]
+
+    def chunks():
+        for month, breakdowns in forecasts:
+            chunk = []
+            for breakdown in breakdowns:
+                if groups is not None and breakdown.group not in groups:
+                    continue
+                for grade, heats, proportion in zip(breakdown.grades.tolist(), breakdown.grade_heats.tolist(),
+                                                    breakdown.proportions.tolist()):
+                    if grades is None or grade in grades:
+                        chunk.append((month, breakdown.group.value, grade, heats, proportion))
+            if chunk:
+                yield chunk
+
+    return _WRITERS[file_format](FORECAST_COLUMNS, chunks())
@@ -0,0 +1,204 @@
+import dataclasses
+import datetime
+from typing import Callable, Mapping
+
+import numpy as np
+
+from . import analysis, snapshot
+from .. import metrics
+from ..enums import ForecastMethod, QualityGroup
+
+__all__ = (
+    'ForecastModel',
+    'MODELS',
+    'forecast_snapshot',
+)
+
+# months with data the moving average is taken over
+MOVING_AVERAGE_MONTHS = 3
+# smoothing factors of the level and trend of Holt's linear trend model
+HOLT_ALPHA = 0.3
+HOLT_BETA = 0.1
+# months in a season of the seasonal naive model
+SEASON_MONTHS = 12
+# smoothing factor of Croston's demand sizes and intervals
+CROSTON_ALPHA = 0.1
+
+
+@dataclasses.dataclass(frozen=True)
+class ForecastModel:
+    """A model forecasting the grade proportions of the month after a production history.
+
+    `predict` takes a (months x grades) matrix of proportions with one row per calendar month, in order, and the mask
+    of the cells a grade was produced in. Grades that weren't produced in a month their quality group produced in
+    (after their first production) are 0 without being present, months nothing is known about are NaN. The last row
+    is the month before the target month. `alphas` holds the smoothing factor stored for the quality group of each
+    column. It returns the proportion forecast for each grade, NaN if it has none, computed for every grade at once.
+
+    """
+
+    method: ForecastMethod
+    predict: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]
+
+
+MODELS: dict[ForecastMethod, ForecastModel] = {}
+
+
+def _register(method: ForecastMethod):
+    def register(predict):
+        MODELS[method] = ForecastModel(method, predict)
+        return predict
+
+    return register
+
+
+@_register(ForecastMethod.EWM)
+def exponential_smoothing(values: np.ndarray, present: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    # months without production are skipped, as the smoothing state does
+    return analysis._ewm_last(values, present, alphas)
+
+
+@_register(ForecastMethod.MOVING_AVERAGE)
+def moving_average(values: np.ndarray, present: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    known = ~np.isnan(values)
+    # the last months known of each grade
+    recent = known & (np.cumsum(known[::-1], axis=0)[::-1] <= MOVING_AVERAGE_MONTHS)
+    with np.errstate(invalid='ignore'):
+        return np.where(recent, values, 0.).sum(axis=0) / recent.sum(axis=0)
+
+
+@_register(ForecastMethod.HOLT)
+def holt(values: np.ndarray, present: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    level = np.full(values.shape[1], np.nan)
+    trend = np.zeros(values.shape[1])
+    for cur in values:
+        known = cur == cur
+        update = known & (level == level)
+
+        smoothed = HOLT_ALPHA * cur + (1. - HOLT_ALPHA) * (level + trend)
+        trend = np.where(update, HOLT_BETA * (smoothed - level) + (1. - HOLT_BETA) * trend, trend)
+        # series start at their first known month, without a trend
+        level = np.where(update, smoothed, np.where(known & (level != level), cur, level))
+
+    # a falling trend can't take a proportion below 0
+    return np.maximum(level + trend, 0.)
+
+
+@_register(ForecastMethod.SEASONAL_NAIVE)
+def seasonal_naive(values: np.ndarray, present: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    # grades unknown a season before the target month keep their latest proportion
+    rows = np.arange(len(values))[:, None]
+    latest = np.maximum.accumulate(np.where(values == values, rows, -1), axis=0)[-1]
+    last_known = np.where(latest >= 0, values[latest, np.arange(values.shape[1])], np.nan)
+    if len(values) < SEASON_MONTHS:
+        return last_known
+
+    season_ago = values[-SEASON_MONTHS]
+    return np.where(season_ago == season_ago, season_ago, last_known)
+
+
+@_register(ForecastMethod.CROSTON)
+def croston(values: np.ndarray, present: np.ndarray, alphas: np.ndarray) -> np.ndarray:
+    size = np.full(values.shape[1], np.nan)  # smoothed proportion of the months a grade was produced in
+    interval = np.full(values.shape[1], np.nan)  # smoothed months between them
+    since_last = np.ones(values.shape[1])
+    with np.errstate(invalid='ignore'):
+        for cur in values:
+            known = cur == cur
+            demand = known & (cur > 0)
+            first = demand & (size != size)
+            update = demand & (size == size)
+
+            size = np.where(first, cur, np.where(update, size + CROSTON_ALPHA * (cur - size), size))
+            interval = np.where(first, 1., np.where(update, interval + CROSTON_ALPHA * (since_last - interval),
+                                                    interval))
+            since_last = np.where(demand, 1., np.where(known, since_last + 1., since_last))
+
+        # grades only known to have produced nothing forecast 0
+        produced_nothing = np.isnan(size) & (~np.isnan(values)).any(axis=0)
+        return np.where(produced_nothing, 0., size / interval)
+
+
+def _layout(rows: np.ndarray, col_codes: np.ndarray, group_codes: np.ndarray, proportions: np.ndarray,
+            n_months: int):
+    """(months x columns) matrix of `proportions` at `rows` and `col_codes`, and its mask of present cells, given
+    the quality group (code) of each column"""
+
+    values = np.full((n_months, len(group_codes)), np.nan)
+    present = np.zeros(values.shape, dtype=bool)
+    values[rows, col_codes] = proportions
+    present[rows, col_codes] = True
+
+    # grades not produced in a month their group produced in, once they were, produced nothing
+    one_hot = np.zeros((len(group_codes), group_codes.max(initial=-1) + 1))
+    one_hot[np.arange(len(group_codes)), group_codes] = 1.
+    group_produced = ((present @ one_hot) > 0)[:, group_codes]
+    seen = np.logical_or.accumulate(present, axis=0)
+    values = np.where(~present & seen & group_produced, 0., values)
+
+    return values, present
+
+
+def _layout_snapshot(group: np.ndarray, month: np.ndarray, grade: np.ndarray, heats: np.ndarray, until: int):
+    """Lays out production of a snapshot (sorted by group, grade and month) as `ForecastModel.predict` takes it, with
+    the proportions of each (group, grade) in its own column and a row per month before `until`, and returns the
+    group and grade codes of each column"""
+
+    if not len(month):
+        return group, grade, np.empty((0, 0)), np.empty((0, 0), dtype=bool)
+
+    new_column = np.ones(len(month), dtype=bool)
+    new_column[1:] = (group[1:] != group[:-1]) | (grade[1:] != grade[:-1])
+    col_codes = np.cumsum(new_column) - 1
+
+    first = int(month.min())
+    rows = month - first
+    # share of each row's heats in its month and quality group
+    totals = np.zeros((until - first, len(snapshot.GROUPS)))
+    np.add.at(totals, (rows, group), heats)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportions = heats / totals[rows, group]
+
+    values, present = _layout(rows, col_codes, group[new_column], proportions, until - first)
+    return group[new_column], grade[new_column], values, present
+
+
+@metrics.timed('forecast.allocate')
+def _snapshot_breakdowns(snap: snapshot.Snapshot, orders: dict[int, int], group: np.ndarray, grade: np.ndarray,
+                         smoothed: np.ndarray) -> list[analysis.GroupBreakdown]:
+    """Forecasts per group of the smoothed proportions of grades (sorted by group and grade codes)"""
+
+    breakdowns = []
+    for code in np.unique(group).tolist():
+        in_group = group == code
+        breakdowns.append(analysis._breakdown_group(snapshot.GROUPS[code], snap.grades[grade[in_group]],
+                                                    smoothed[in_group], orders.get(code, 0)))
+    return breakdowns
+
+
+def forecast_snapshot(snap: snapshot.Snapshot, month: datetime.date,
+                      methods: Mapping[QualityGroup, ForecastMethod]) -> list[analysis.GroupBreakdown]:
+    """Forecasts `month` with each quality group's method from a snapshot: EWM groups from their smoothing state,
+    the other groups from their production history before the month.
+
+    Returns:
+        Forecasts per group, as GroupBreakdown
+
+    """
+
+    target = snapshot.month_ordinal(month)
+    _, order_groups, order_heats = snap.order_forecasts(target, target + 1)
+    orders = dict(zip(order_groups.tolist(), order_heats.tolist()))
+
+    # group codes forecast with each method
+    codes: dict[ForecastMethod, list[int]] = {}
+    for code, group in enumerate(snapshot.GROUPS):
+        codes.setdefault(methods.get(group, ForecastMethod.EWM), []).append(code)
+
+    breakdowns = _snapshot_breakdowns(snap, orders, *snap.smoothing_state(target, codes.pop(ForecastMethod.EWM, [])))
+    for method, groups in codes.items():
+        with metrics.span('forecast.model'):
+            group, grade, values, present = _layout_snapshot(*snap.production(target, groups), target)
+            predicted = MODELS[method].predict(values, present, snap.alphas[group]) if len(group) else np.empty(0)
+        breakdowns += _snapshot_breakdowns(snap, orders, group, grade, predicted)
+    return sorted(breakdowns, key=lambda breakdown: breakdown.group)
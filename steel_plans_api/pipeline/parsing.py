@@ -1,18 +1,28 @@
+import csv
 import datetime
 import itertools
-from typing import BinaryIO, Annotated
+from typing import BinaryIO, Annotated, Iterator
 
 import numpy as np
+import openpyxl
 import pandas as pd
 import pydantic
 
-from ..enums import QualityGroup
+from ..enums import FileFormat, QualityGroup
 
 _DEFAULT_MAX_ALLOWED_MISSING_VALUES_PER_COLUMN = 2  # heuristic
 COLS_PER_DAY = 3
 
 
-def _parse_timestamp_to_time(value: pd.Timestamp):
+def _parse_timestamp_to_time(value: pd.Timestamp | datetime.time | str):
+    # start times are timestamps in workbooks, times in Parquet files and text in CSV files
+    if isinstance(value, datetime.time):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.time.fromisoformat(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value).time()
     return value.time()
 
 
@@ -175,3 +185,393 @@ def parse_monthly_order_forecasts_file(file: BinaryIO) -> list[ParsingOrderForec
             ret.append(info)
 
     return ret
+
+
+# Columnar parsing
+#
+# Same files and rules as above, but the wide sheets are reshaped to long format with array operations and
+# validated a column at a time (with the same pydantic types, so they are exactly as strict), instead of
+# going through a pydantic model per cell.
+
+_DATE = pydantic.TypeAdapter(datetime.date)
+_INTS = pydantic.TypeAdapter(list[int])
+_STRS = pydantic.TypeAdapter(list[str])
+_OPTIONAL_STRS = pydantic.TypeAdapter(list[str | None])
+
+_QUALITY_GROUPS = dict(QualityGroup.__members__)
+
+
+def _validate_quality_groups(values: pd.Series) -> np.ndarray:
+    if pd.api.types.infer_dtype(values, skipna=False) not in ('string', 'empty'):
+        raise ValueError('Quality groups must be text')
+
+    names = values.str.upper()
+    if not names.isin(_QUALITY_GROUPS).all():
+        raise KeyError(f'Unknown quality groups: {set(names[~names.isin(_QUALITY_GROUPS)])}')
+
+    return names.map(_QUALITY_GROUPS).to_numpy(dtype=object)
+
+
+def _validate_ints(values: pd.Series) -> np.ndarray:
+    if values.dtype.kind in 'iu':
+        return values.to_numpy()
+    return np.array(_INTS.validate_python(values.tolist()))
+
+
+def _validate_optional_strs(values: pd.Series) -> np.ndarray:
+    return np.array(_OPTIONAL_STRS.validate_python(values.astype(object).where(values.notna(), None).tolist()),
+                    dtype=object)
+
+
+def _melt_months(months_df: pd.DataFrame, id_columns: dict, value_name: str) -> pd.DataFrame:
+    """Reshapes month columns to one row per (row, month), in row-major order like the model parsers"""
+
+    months = np.array([_DATE.validate_python(month) for month in months_df.columns], dtype=object)
+    values = np.column_stack([_validate_ints(months_df.iloc[:, i]) for i in range(months_df.shape[1])])
+    n_rows, n_months = values.shape
+
+    records = {'month': np.tile(months, n_rows)}
+    for name, column in id_columns.items():
+        records[name] = np.repeat(column, n_months)
+    records[value_name] = values.ravel()
+
+    return pd.DataFrame(records)
+
+
+# File formats
+#
+# The columnar parsers also read CSV and Parquet files, in the layout of the workbooks (wide) or with a column per
+# field of the entries and a row per entry (long). Long files are validated a column at a time like wide ones, but
+# can't leave cells empty.
+
+_XLSX_MAGIC = b'PK\x03\x04'  # workbooks are zip archives
+_PARQUET_MAGIC = b'PAR1'
+
+
+def detect_format(file: BinaryIO) -> FileFormat:
+    """Format of a file from its first bytes (anything else than a workbook or a Parquet file is read as CSV),
+    leaving its position unchanged"""
+
+    position = file.tell()
+    magic = file.read(4)
+    file.seek(position)
+
+    if magic == _XLSX_MAGIC:
+        return FileFormat.XLSX
+    if magic == _PARQUET_MAGIC:
+        return FileFormat.PARQUET
+    return FileFormat.CSV
+
+
+def _long_columns(names, fields: list[str]) -> dict | None:
+    """Columns named like the fields of the entries (ignoring case and spaces), if there is one for every field"""
+
+    columns = {}
+    for name in names:
+        field = str(name).strip().lower().replace(' ', '_')
+        if field in fields:
+            columns[name] = field
+    return columns if len(set(columns.values())) == len(fields) else None
+
+
+def _read_parquet(file: BinaryIO) -> pd.DataFrame:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet files need pyarrow, installed with [parquet]') from None
+
+    # numeric columns without missing values share the buffers they were read to instead of being copied (each
+    # column is a block of its own), and the other buffers are released as their columns are converted
+    return pq.read_table(file).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _read_frame(file: BinaryIO, fields: list[str]) -> tuple[pd.DataFrame, bool]:
+    """Sheet of a workbook, CSV or Parquet file, and whether it has the long layout (with `fields` as columns).
+
+    Wide sheets have their header below the title row, which Parquet files don't have.
+
+    """
+
+    file_format = detect_format(file)
+    if file_format is FileFormat.XLSX:
+        return pd.read_excel(file, skiprows=1), False  # assuming title is first row
+
+    if file_format is FileFormat.PARQUET:
+        df = _read_parquet(file)
+        columns = _long_columns(df.columns, fields)
+    else:
+        # long CSV files start with their header, wide ones with the title of the sheet
+        position = file.tell()
+        header = next(csv.reader([file.readline().decode('utf-8-sig')]), [])
+        file.seek(position)
+        columns = _long_columns(header, fields)
+        df = pd.read_csv(file, skiprows=0 if columns else 1)
+        # without the empty rows sheets saved as CSV can end with, which read_excel leaves out
+        filled = df.notna().any(axis=1).to_numpy()
+        df = df.iloc[:filled.nonzero()[0][-1] + 1 if filled.any() else 0]
+
+    if columns is None:
+        return df, False
+    return df.rename(columns=columns)[fields], True
+
+
+def _validate_distinct(values: pd.Series, validate) -> np.ndarray:
+    """Values of a long column validated by `validate` once per distinct value, as they repeat on many rows"""
+
+    codes, distinct = pd.factorize(values, use_na_sentinel=False)
+    return np.asarray(validate(pd.Series(distinct, dtype=object)), dtype=object)[codes]
+
+
+def _validate_dates(values: pd.Series) -> list[datetime.date]:
+    return [_DATE.validate_python(value) for value in values]
+
+
+def _validate_strs(values: pd.Series) -> np.ndarray:
+    return np.array(_STRS.validate_python(values.tolist()), dtype=object)
+
+
+def _parse_long_monthly_steel_grade(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        'month': _validate_distinct(df['month'], _validate_dates),
+        'group': _validate_distinct(df['group'], _validate_quality_groups),
+        'grade': _validate_distinct(df['grade'], _validate_strs),
+        'short_tons': _validate_ints(df['short_tons']),
+    })
+
+
+def _parse_long_monthly_order_forecasts(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        'month': _validate_distinct(df['month'], _validate_dates),
+        'group': _validate_distinct(df['group'], _validate_quality_groups),
+        'heats_orders_forecasted': _validate_ints(df['heats_orders_forecasted']),
+    })
+
+
+def _parse_long_daily_charge_schedule(df: pd.DataFrame) -> pd.DataFrame:
+    grades, mould_sizes = (df[name].where(df[name] != '-') for name in ('grade', 'mould_size'))
+    return pd.DataFrame({
+        'day': _validate_distinct(df['day'], _validate_dates),
+        'start_time': _validate_distinct(df['start_time'], lambda values: values.map(_parse_timestamp_to_time)),
+        'grade': _validate_distinct(grades, _validate_optional_strs),
+        'mould_size': _validate_distinct(mould_sizes, _validate_optional_strs),
+    })
+
+
+def parse_monthly_steel_grade_file_columnar(file: BinaryIO) -> pd.DataFrame:
+    """Columnar version of `parse_monthly_steel_grade_file`, one row per entry, of a workbook or a CSV or Parquet
+    file"""
+
+    columns = list(ParsingMonthSteelProductionEntry.model_fields)
+
+    df, long = _read_frame(file, columns)
+    if long:
+        return _parse_long_monthly_steel_grade(df)
+
+    df['Quality group'] = df['Quality group'].ffill()
+
+    df = _drop_empty_columns(df)  # drop columns first before imputation
+    df = _impute_column_numerics_if_missing(df)
+
+    # assuming that month columns are always after the first 2 columns
+    if df.shape[1] <= 2 or df.empty:
+        return pd.DataFrame(columns=columns)
+
+    id_columns = {
+        'group': _validate_quality_groups(df['Quality group']),
+        'grade': np.array(_STRS.validate_python(df['Grade'].tolist()), dtype=object),
+    }
+    return _melt_months(df.iloc[:, 2:], id_columns, 'short_tons')[columns]
+
+
+def parse_monthly_order_forecasts_file_columnar(file: BinaryIO) -> pd.DataFrame:
+    """Columnar version of `parse_monthly_order_forecasts_file`, one row per entry, of a workbook or a CSV or
+    Parquet file"""
+
+    columns = list(ParsingOrderForecastEntry.model_fields)
+
+    df, long = _read_frame(file, columns)
+    if long:
+        return _parse_long_monthly_order_forecasts(df)
+
+    df = _drop_empty_columns(df)
+    df = _impute_column_numerics_if_missing(df)
+
+    # assuming that month columns are always after the first one
+    if df.shape[1] <= 1 or df.empty:
+        return pd.DataFrame(columns=columns)
+
+    id_columns = {'group': _validate_quality_groups(df['Quality:'])}
+    return _melt_months(df.iloc[:, 1:], id_columns, 'heats_orders_forecasted')[columns]
+
+
+def _charge_schedule_entries(days, titles, cells: np.ndarray) -> pd.DataFrame:
+    """Charge schedule entries of a block of rows.
+
+    Args:
+        days: Day of each group of columns
+        titles: Titles of the subcolumns (start time, grade and mould size of each day)
+        cells: Rows of the schedule, as an object array
+
+    """
+
+    columns = list(ParsingDayChargeScheduleEntry.model_fields)
+
+    if cells.shape[1] % COLS_PER_DAY:
+        raise ValueError(f'Every day must have {COLS_PER_DAY} columns')
+    n_days = min(len(days), cells.shape[1] // COLS_PER_DAY)
+
+    # position of each subcolumn, from the titles of each day
+    positions = {name: [] for name in ('Start time', 'Grade', 'Mould size')}
+    for day in range(n_days):
+        day_titles = list(titles[day * COLS_PER_DAY:(day + 1) * COLS_PER_DAY])
+        for name, day_positions in positions.items():
+            day_positions.append(day * COLS_PER_DAY + day_titles.index(name))
+
+    # (day x charge) matrices of each subcolumn, without the rows left empty
+    start_times, grades, mould_sizes = (cells[:, day_positions].T for day_positions in positions.values())
+    for values in (start_times, grades, mould_sizes):
+        values[values == '-'] = np.nan
+    kept = ~(pd.isna(start_times) & pd.isna(grades) & pd.isna(mould_sizes))
+    if not kept.any():
+        return pd.DataFrame(columns=columns)
+
+    kept_days = kept.any(axis=1)
+    day_values = np.empty(n_days, dtype=object)
+    day_values[kept_days] = [_DATE.validate_python(day) for day in np.asarray(days[:n_days])[kept_days]]
+
+    start_times = pd.Series(start_times[kept])
+    if pd.api.types.infer_dtype(start_times, skipna=False) == 'datetime':
+        start_times = pd.DatetimeIndex(start_times).time
+    else:
+        start_times = [_parse_timestamp_to_time(value) for value in start_times]
+
+    return pd.DataFrame({
+        'day': np.repeat(day_values, kept.sum(axis=1)),
+        'start_time': np.asarray(start_times, dtype=object),
+        'grade': _validate_optional_strs(pd.Series(grades[kept])),
+        'mould_size': _validate_optional_strs(pd.Series(mould_sizes[kept])),
+    })
+
+
+def parse_daily_charge_schedule_file_columnar(file: BinaryIO) -> pd.DataFrame:
+    """Columnar version of `parse_daily_charge_schedule_file`, one row per entry, of a workbook or a CSV or Parquet
+    file"""
+
+    df, long = _read_frame(file, list(ParsingDayChargeScheduleEntry.model_fields))
+    if long:
+        return _parse_long_daily_charge_schedule(df)
+
+    days = df.columns[~df.columns.astype(str).str.startswith("Unnamed")].values
+
+    cells = df.to_numpy(dtype=object)
+    return _charge_schedule_entries(days, cells[0], cells[1:])
+
+
+# strings pandas reads as missing values
+_NA_STRINGS = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+    'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+
+
+def _read_cell(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)  # as pandas does
+    if value is None or (isinstance(value, str) and value in _NA_STRINGS):
+        return np.nan
+    return value
+
+
+def iter_daily_charge_schedule_file(file: BinaryIO, *, batch_size: int = 5_000) -> Iterator[pd.DataFrame]:
+    """Streaming version of `parse_daily_charge_schedule_file_columnar`.
+
+    Reads the sheet a row at a time and yields its entries in batches of up to `batch_size` (but at least a row of
+    the schedule), so memory stays bounded whatever the size of the file. Columns past the last titled one are
+    ignored. CSV and Parquet files, much faster to read, are read at once and their entries yielded in batches.
+
+    """
+
+    if detect_format(file) is not FileFormat.XLSX:
+        entries = parse_daily_charge_schedule_file_columnar(file)
+        for start in range(0, len(entries), batch_size):
+            yield entries.iloc[start:start + batch_size].reset_index(drop=True)
+        return
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        next(rows, None)  # assuming title is first row
+
+        day_row = [_read_cell(value) for value in next(rows, ())]
+        titles = [_read_cell(value) for value in next(rows, ())]
+        while titles and pd.isna(titles[-1]):
+            titles.pop()
+        width = len(titles)
+
+        days = [day for day in day_row[:width] if not pd.isna(day)]
+        rows_per_batch = max(1, batch_size // max(1, len(days)))
+
+        for batch in itertools.batched(rows, rows_per_batch):
+            cells = np.full((len(batch), width), np.nan, dtype=object)
+            for i, row in enumerate(batch):
+                row = [_read_cell(value) for value in row[:width]]
+                cells[i, :len(row)] = row
+
+            entries = _charge_schedule_entries(days, titles, cells)
+            if len(entries):
+                yield entries
+    finally:
+        workbook.close()
+
+
+# Packed entries
+#
+# Parsed entries as plain arrays, to pass them between processes: dates, times and quality groups are sent as
+# numbers instead of pickling a Python object per cell.
+
+_QUALITY_GROUP_VALUES = np.array(list(QualityGroup), dtype=object)
+_QUALITY_GROUP_CODES = {group: code for code, group in enumerate(QualityGroup)}
+_MICROSECONDS_PER_SECOND = 1_000_000
+
+
+def _pack_column(values: np.ndarray) -> tuple[str | None, np.ndarray]:
+    if values.dtype != object or not len(values):
+        return None, values
+
+    kind = pd.api.types.infer_dtype(values, skipna=False)
+    if kind == 'date':
+        return 'date', values.astype('datetime64[D]')
+    if kind == 'time':
+        return 'time', np.array([
+            (value.hour * 3600 + value.minute * 60 + value.second) * _MICROSECONDS_PER_SECOND + value.microsecond
+            for value in values
+        ], dtype=np.int64)
+    if all(isinstance(value, QualityGroup) for value in values):
+        return 'group', np.array([_QUALITY_GROUP_CODES[value] for value in values], dtype=np.int8)
+    return None, values
+
+
+def _unpack_column(encoding: str | None, values: np.ndarray) -> np.ndarray:
+    if encoding == 'date':
+        return values.astype(object)
+    if encoding == 'time':
+        return np.array([
+            datetime.time(value // 3600 // _MICROSECONDS_PER_SECOND, value // 60 // _MICROSECONDS_PER_SECOND % 60,
+                          value // _MICROSECONDS_PER_SECOND % 60, value % _MICROSECONDS_PER_SECOND)
+            for value in values.tolist()
+        ], dtype=object)
+    if encoding == 'group':
+        return _QUALITY_GROUP_VALUES[values]
+    return values
+
+
+def pack_entries(entries: pd.DataFrame) -> dict[str, tuple[str | None, np.ndarray]]:
+    """Columns of parsed entries as arrays of numbers where possible, with how each column was encoded"""
+
+    return {name: _pack_column(entries[name].to_numpy()) for name in entries.columns}
+
+
+def unpack_entries(packed: dict[str, tuple[str | None, np.ndarray]]) -> pd.DataFrame:
+    """Parsed entries from `pack_entries`"""
+
+    return pd.DataFrame({name: _unpack_column(*column) for name, column in packed.items()})
@@ -1,33 +1,360 @@
-from typing import BinaryIO, Sequence
+import dataclasses
+import functools
+import hashlib
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable
 
+import pandas as pd
 import sqlalchemy as sqla
-from pydantic import BaseModel
 
-from . import db, parsing
-from ..enums import UploadFileType
+from . import analysis, charges, db, parsing, smoothing, snapshot
+from .. import metrics, settings
+from ..enums import UploadFileType, UploadMode
 
 __all__ = (
+    'BatchLoadStats',
+    'DuplicateUpload',
+    'LoadStats',
+    'create_batch_pipeline',
     'create_db_pipeline',
 )
 
+# NOTE: the columnar parsers validate exactly like the model based ones, without a model per entry.
+# Parsers return their entries as a DataFrame, or as an iterator of DataFrames to insert one batch at a time
 pipelines = {
-    UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION: (parsing.parse_monthly_steel_grade_file,
+    UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION: (parsing.parse_monthly_steel_grade_file_columnar,
                                                     db.month_steel_production),
-    UploadFileType.DAILY_CHARGE_SCHEDULE: (parsing.parse_daily_charge_schedule_file,
+    UploadFileType.DAILY_CHARGE_SCHEDULE: (parsing.iter_daily_charge_schedule_file,
                                            db.day_steel_production),
-    UploadFileType.MONTHLY_ORDER_FORECAST: (parsing.parse_monthly_order_forecasts_file,
+    UploadFileType.MONTHLY_ORDER_FORECAST: (parsing.parse_monthly_order_forecasts_file_columnar,
                                             db.month_group_order_forecast)
 }
 
 
-def create_db_pipeline(api_param_type: UploadFileType):
-    parser, table = pipelines[api_param_type]
+def _records(df: pd.DataFrame) -> list[dict]:
+    """Rows of a parsed DataFrame as insert parameters, built straight from its columns"""
 
-    def pipeline(conn: sqla.Connection, file: BinaryIO) -> Sequence[sqla.RowMapping]:
-        models: list[BaseModel] = parser(file)
-        stmt = sqla.insert(table).returning(table)
-        res = conn.execute(stmt, [model.model_dump() for model in models]).mappings().all()
+    return [dict(zip(df.columns, row)) for row in zip(*(df[column].tolist() for column in df.columns))]
 
-        return res
+
+def _refresh_smoothing_state(conn: sqla.Connection, keys: set[tuple]):
+    # months and groups of the rows written, and of the rows they replaced or deleted, which also changed
+    if keys:
+        months, groups = zip(*keys)
+        smoothing.refresh_smoothing_state(conn, since=min(months), groups=set(groups))
+
+
+def _refresh_charge_heats(conn: sqla.Connection, keys: set[tuple]):
+    if keys:
+        charges.refresh_charge_heats(conn, months={day for day, in keys})
+
+
+# derived data kept up to date after each upload: the columns it depends on, and its refresh, called once per file
+# (before the table's version is bumped) with the distinct values of those columns in the rows the file changed
+post_insert_hooks = {
+    UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION: (('month', 'group'), _refresh_smoothing_state),
+    UploadFileType.DAILY_CHARGE_SCHEDULE: (('day',), _refresh_charge_heats),
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class LoadStats:
+    """Rows a pipeline parsed, what it did with them, and the time it took to parse and load them"""
+
+    rows: int
+    seconds: float
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    duplicate: bool = False  # answered from the uploads ledger, without parsing the file
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclasses.dataclass(frozen=True)
+class BatchLoadStats:
+    """Stats of each file of a batch, and the time it took to parse and load all of them"""
+
+    files: list[LoadStats]
+    seconds: float
+
+    @property
+    def rows(self) -> int:
+        return sum(stats.rows for stats in self.files)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+class DuplicateUpload(Exception):
+    """The same file was already appended, and its table hasn't changed since"""
+
+
+def _sha256(file: BinaryIO) -> str:
+    # uploads are spooled to memory or disk, hashing reads them in chunks and rewinds them for the parser
+    digest = hashlib.file_digest(file, 'sha256').hexdigest()
+    file.seek(0)
+    return digest
+
+
+def _key(record, keys: tuple[str, ...]) -> tuple:
+    return tuple(record[key] for key in keys)
+
+
+def _upsert(conn: sqla.Connection, table: sqla.Table, records: list[dict]) -> tuple[int, int, int, list[dict]]:
+    """Inserts new rows and updates changed ones, returning how many rows were inserted, updated and unchanged,
+    plus the rows written and the previous values of the updated ones"""
+
+    keys = db.natural_keys[table]
+    columns = [column.name for column in table.columns if column.computed is None]
+    dates = [record[keys[0]] for record in records]
+
+    stmt = sqla.select(*(table.c[name] for name in columns)).where(table.c[keys[0]].between(min(dates), max(dates)))
+    existing = {_key(row, keys): row for row in conn.execute(stmt).mappings()}
+
+    inserts, updates, previous = [], [], []
+    for record in records:
+        row = existing.get(_key(record, keys))
+        if row is None:
+            inserts.append(record)
+        elif any(row[name] != record[name] for name in columns):
+            updates.append(record)
+            previous.append(dict(row))
+
+    writes = inserts + updates
+    # NOTE: NULLs never conflict, rows with a NULL in their key are matched above and updated one by one
+    if keyed := [record for record in writes if None not in _key(record, keys)]:
+        conn.execute(db.upsert(table, conn.dialect), keyed)
+    if null_keyed := [record for record in inserts if None in _key(record, keys)]:
+        conn.execute(sqla.insert(table), null_keyed)
+    for record in updates:
+        if None in _key(record, keys):
+            stmt = sqla.update(table).where(*(
+                table.c[key].is_(None) if record[key] is None else table.c[key] == record[key] for key in keys
+            ))
+            conn.execute(stmt.values({name: record[name] for name in columns if name not in keys}))
+
+    return len(inserts), len(updates), len(records) - len(writes), writes + previous
+
+
+def _delete_periods(conn: sqla.Connection, table: sqla.Table, records: list[dict], cleared: set) -> list[dict]:
+    """Deletes the rows stored for the months (days) of `records` not in `cleared` yet, returning them"""
+
+    name = db.natural_keys[table][0]
+    column = table.c[name]
+
+    if name == 'month':
+        periods = {record[name].replace(day=1) for record in records} - cleared
+        conditions = [sqla.and_(column >= month, column < analysis.add_months(month, 1)) for month in sorted(periods)]
+    else:
+        periods = {record[name] for record in records} - cleared
+        conditions = [column.in_(sorted(periods))] if periods else []
+
+    cleared |= periods
+    if not conditions:
+        return []
+    stmt = sqla.delete(table).where(sqla.or_(*conditions)).returning(table)
+    return [dict(row) for row in conn.execute(stmt).mappings()]
+
+
+def _find_upload(conn: sqla.Connection, api_param_type: UploadFileType, mode: UploadMode, sha256: str,
+                 start: float) -> LoadStats | None:
+    """Stats of loading a file again, if it was loaded before and its table didn't change in between"""
+
+    version, = db.get_dataset_versions(conn, pipelines[api_param_type][1])
+    if (upload := conn.execute(db.select_upload(api_param_type, sha256, version)).first()) is not None:
+        if mode is UploadMode.APPEND:
+            raise DuplicateUpload(upload.id)
+        return LoadStats(rows=upload.rows, seconds=time.perf_counter() - start, unchanged=upload.rows,
+                         duplicate=True)
+    return None
+
+
+def _timed_batches(batches):
+    # parsers returning iterators parse each batch as it is taken
+    batches = iter(batches)
+    while True:
+        with metrics.span('upload.parse'):
+            batch = next(batches, None)
+        if batch is None:
+            return
+        yield batch
+
+
+def _write_append(conn: sqla.Connection, table: sqla.Table, chunk: list[dict], counts: dict,
+                  cleared: set) -> list[dict]:
+    db.bulk_insert(conn, table, chunk)
+    counts['inserted'] += len(chunk)
+    return chunk
+
+
+def _write_upsert(conn: sqla.Connection, table: sqla.Table, chunk: list[dict], counts: dict,
+                  cleared: set) -> list[dict]:
+    inserted, updated, unchanged, written = _upsert(conn, table, chunk)
+    counts['inserted'] += inserted
+    counts['updated'] += updated
+    counts['unchanged'] += unchanged
+    return written
+
+
+def _write_replace_range(conn: sqla.Connection, table: sqla.Table, chunk: list[dict], counts: dict,
+                         cleared: set) -> list[dict]:
+    deleted = _delete_periods(conn, table, chunk, cleared)
+    counts['deleted'] += len(deleted)
+    return deleted + _write_append(conn, table, chunk, counts, cleared)
+
+
+# writes a chunk of rows in each mode, adding what it did to the counts, and returns the rows it wrote and the ones
+# they replaced (`cleared` holds the periods replaced by earlier chunks of the file)
+_WRITES = {
+    UploadMode.APPEND: _write_append,
+    UploadMode.UPSERT: _write_upsert,
+    UploadMode.REPLACE_RANGE: _write_replace_range,
+}
+
+
+def _record_upload(conn: sqla.Connection, api_param_type: UploadFileType, sha256: str, counts: dict):
+    """Bumps the version of the table the file changed, if it did, and records the file in the uploads ledger"""
+
+    table = pipelines[api_param_type][1]
+    # tables nothing changed in keep their version, and the results cached from them
+    if counts['inserted'] or counts['updated'] or counts['deleted']:
+        db.bump_dataset_version(conn, table)
+        if table in snapshot.TABLES:
+            db.after_commit(conn, snapshot.publish)
+
+    conn.execute(sqla.insert(db.uploads).values(
+        sha256=sha256, file_type=api_param_type, rows=counts['rows'],
+        table_version=db.get_dataset_versions(conn, table)[0],
+    ))
+
+    metrics.ROWS_PROCESSED.inc(counts['rows'], file_type=api_param_type.name, action='parsed')
+    for action in ('inserted', 'updated', 'unchanged', 'deleted'):
+        if counts[action]:
+            metrics.ROWS_PROCESSED.inc(counts[action], file_type=api_param_type.name, action=action)
+
+
+def _load(conn: sqla.Connection, api_param_type: UploadFileType, mode: UploadMode, batch_size: int, batches,
+          sha256: str, start: float, progress: Callable[[int], None] | None = None) -> LoadStats:
+    """Loads parsed `batches` in `mode`, `batch_size` rows per statement, and records them in the uploads ledger"""
+
+    table = pipelines[api_param_type][1]
+    hook_keys, post_insert_hook = post_insert_hooks.get(api_param_type, ((), None))
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    elif not isinstance(batches, list):
+        batches = _timed_batches(batches)
+
+    # NOTE: only the number of rows is reported, there is no need to send the inserted rows back
+    counts = dict.fromkeys(('rows', 'inserted', 'updated', 'unchanged', 'deleted'), 0)
+    cleared = set()
+    # keys of the rows the hook has to account for: the ones written, and the ones they replaced
+    changed = set()
+    for batch in batches:
+        for offset in range(0, len(batch), batch_size):
+            chunk = _records(batch.iloc[offset:offset + batch_size])
+            counts['rows'] += len(chunk)
+
+            with metrics.span('upload.write'):
+                written = _WRITES[mode](conn, table, chunk, counts, cleared)
+
+            if post_insert_hook is not None:
+                changed.update(_key(record, hook_keys) for record in written)
+
+            if progress is not None:
+                progress(counts['rows'])
+
+    if post_insert_hook is not None:
+        with metrics.span('upload.refresh'):
+            post_insert_hook(conn, changed)
+
+    _record_upload(conn, api_param_type, sha256, counts)
+    return LoadStats(seconds=time.perf_counter() - start, **counts)
+
+
+def create_db_pipeline(api_param_type: UploadFileType, mode: UploadMode = UploadMode.APPEND,
+                       batch_size: int | None = None):
+    """Pipeline parsing a file of `api_param_type` and loading its rows in `mode`, `batch_size` rows per statement"""
+
+    parser = pipelines[api_param_type][0]
+    batch_size = batch_size or settings.INSERT_BATCH_SIZE
+
+    def pipeline(conn: sqla.Connection, file: BinaryIO, progress: Callable[[int], None] | None = None) -> LoadStats:
+        # `progress` is called with the number of rows processed so far, after each batch
+        start = time.perf_counter()
+
+        # loading a file again makes no difference as long as its table didn't change in between
+        with metrics.span('upload.hash'):
+            sha256 = _sha256(file)
+        if (stats := _find_upload(conn, api_param_type, mode, sha256, start)) is not None:
+            return stats
+
+        with metrics.span('upload.parse'):
+            batches = parser(file)
+        return _load(conn, api_param_type, mode, batch_size, batches, sha256, start, progress)
+
+    return pipeline
+
+
+def _parse_packed(api_param_type: UploadFileType, content: bytes) -> list[dict]:
+    # runs in a worker process, parsed entries are sent back as arrays rather than pickled objects
+    batches = pipelines[api_param_type][0](io.BytesIO(content))
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    return [parsing.pack_entries(batch) for batch in batches]
+
+
+@functools.lru_cache
+def _parse_pool() -> ProcessPoolExecutor:
+    # NOTE: workers are spawned rather than forked, since the server runs threads, and are kept for later batches
+    return ProcessPoolExecutor(settings.PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+
+
+def create_batch_pipeline(mode: UploadMode = UploadMode.APPEND, batch_size: int | None = None):
+    """Pipeline parsing files of any type at the same time, in worker processes, and loading them one after another
+    in `mode`, `batch_size` rows per statement"""
+
+    batch_size = batch_size or settings.INSERT_BATCH_SIZE
+
+    def pipeline(conn: sqla.Connection, files: list[tuple[UploadFileType, BinaryIO]]) -> BatchLoadStats:
+        start = time.perf_counter()
+        # files are read once, for their hash and their parser
+        contents = [file.read() for _, file in files]
+        with metrics.span('upload.hash'):
+            hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+
+        # files loaded before aren't parsed, the others are parsed in parallel (unless there is only one)
+        to_parse = [i for i, ((api_param_type, _), sha256) in enumerate(zip(files, hashes))
+                    if _find_upload(conn, api_param_type, mode, sha256, start) is None]
+        futures = {}
+        if len(to_parse) > 1:
+            futures = {i: _parse_pool().submit(_parse_packed, files[i][0], contents[i]) for i in to_parse}
+
+        try:
+            stats = []
+            for i, ((api_param_type, _), sha256) in enumerate(zip(files, hashes)):
+                file_start = time.perf_counter()
+                # files of the batch may change the tables of the ones after them
+                if (file_stats := _find_upload(conn, api_param_type, mode, sha256, file_start)) is None:
+                    with metrics.span('upload.parse'):
+                        if i in futures:
+                            batches = [parsing.unpack_entries(packed) for packed in futures.pop(i).result()]
+                        else:
+                            batches = pipelines[api_param_type][0](io.BytesIO(contents[i]))
+                    file_stats = _load(conn, api_param_type, mode, batch_size, batches, sha256, file_start)
+                stats.append(file_stats)
+
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+        return BatchLoadStats(files=stats, seconds=time.perf_counter() - start)
 
     return pipeline
@@ -0,0 +1,90 @@
+import datetime
+from typing import Iterable, Mapping
+
+import pandas as pd
+import sqlalchemy as sqla
+
+from . import analysis, db, snapshot
+from ..enums import QualityGroup
+
+__all__ = (
+    'refresh_smoothing_state',
+    'set_smoothing_alphas',
+)
+
+
+def refresh_smoothing_state(conn: sqla.Connection, since: datetime.date | None = None,
+                            groups: Iterable[QualityGroup] | None = None):
+    """Recomputes the smoothing state of grade proportions from the month of `since` onward.
+
+    Grade proportions are relative to their month and quality group, so production added or changed in a month
+    invalidates the state of every grade of its quality group from that month on. The state right before that
+    month is kept and smoothing continues from it. Each quality group is smoothed with its stored smoothing
+    factor, if it has one.
+
+    Args:
+        conn: database connection
+        since: earliest month with changed production, everything is recomputed if None
+        groups: quality groups with changed production, all of them if None
+
+    """
+
+    production = db.month_steel_production
+    state = db.grade_proportion_smoothing
+
+    if groups is not None:
+        groups = sorted(set(groups))
+
+    history_stmt = sqla.select(production.c.month, production.c.group, production.c.grade,
+                               production.c.heats_produced)
+    delete_stmt = sqla.delete(state)
+    if groups is not None:
+        history_stmt = history_stmt.where(production.c.group.in_(groups))
+        delete_stmt = delete_stmt.where(state.c.group.in_(groups))
+
+    seeds = []
+    if since is not None:
+        # proportions are per month, the whole month has to be recomputed
+        since = since.replace(day=1)
+        history_stmt = history_stmt.where(production.c.month >= since)
+        delete_stmt = delete_stmt.where(state.c.month >= since)
+        seeds = conn.execute(db.select_smoothing_state(since, groups)).mappings().all()
+
+    history = conn.execute(history_stmt).mappings().all()
+    conn.execute(delete_stmt)
+    if not history:
+        return
+
+    seeds_df = pd.DataFrame(seeds).set_index(['group', 'grade']) if seeds else None
+    alphas = dict(conn.execute(db.select_smoothing_alphas()).all())
+    states = analysis.smoothing_states(pd.DataFrame(history), seeds_df, alphas)
+
+    # unknown proportions are stored as NULL
+    states['proportion'] = states['proportion'].astype(object).where(states['proportion'].notna(), None)
+    conn.execute(sqla.insert(state), states.to_dict(orient='records'))
+
+
+def set_smoothing_alphas(conn: sqla.Connection, alphas: Mapping[QualityGroup, float],
+                         errors: Mapping[QualityGroup, float] | None = None):
+    """Stores the smoothing factor of quality groups, and recomputes the smoothing state of the ones that changed.
+
+    Args:
+        conn: database connection
+        alphas: smoothing factor of each quality group
+        errors: backtesting error each smoothing factor was chosen with
+
+    """
+
+    table = db.smoothing_alphas
+    current = dict(conn.execute(db.select_smoothing_alphas()).all())
+    changed = [group for group, alpha in alphas.items() if current.get(group, analysis.ALPHA_ES) != alpha]
+
+    if alphas:
+        conn.execute(sqla.delete(table).where(table.c.group.in_(list(alphas))))
+        conn.execute(sqla.insert(table), [
+            {'group': group, 'alpha': alpha, 'mae': (errors or {}).get(group)} for group, alpha in alphas.items()
+        ])
+    if changed:
+        db.bump_dataset_version(conn, table)
+        refresh_smoothing_state(conn, groups=changed)
+        db.after_commit(conn, snapshot.publish)
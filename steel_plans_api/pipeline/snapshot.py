@@ -0,0 +1,272 @@
+import dataclasses
+import datetime
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import sqlalchemy as sqla
+
+from . import analysis, db
+from .. import metrics, settings
+from ..cache import LRUCache
+from ..enums import QualityGroup
+
+__all__ = (
+    'GROUPS',
+    'Snapshot',
+    'TABLES',
+    'clear',
+    'get_snapshot',
+    'month_date',
+    'month_ordinal',
+    'publish',
+)
+
+# tables a snapshot is taken of (the smoothing state follows production and smoothing factors), in the order of
+# the dataset versions it is named after
+TABLES = (db.month_steel_production, db.month_group_order_forecast, db.smoothing_alphas)
+
+# quality groups, in the order of their codes, which sort like the groups do
+GROUPS = tuple(sorted(QualityGroup))
+_GROUP_CODES = {group: code for code, group in enumerate(GROUPS)}
+
+
+def month_ordinal(month: datetime.date) -> int:
+    """Months since 1970-01, as the ordinals of monthly pandas periods"""
+
+    return (month.year - 1970) * 12 + month.month - 1
+
+
+def month_date(ordinal: int) -> datetime.date:
+    """First day of the month of a month ordinal"""
+
+    return datetime.date(1970 + ordinal // 12, ordinal % 12 + 1, 1)
+
+
+@dataclasses.dataclass(frozen=True)
+class Snapshot:
+    """Production history, order forecasts, smoothing factors and smoothing state as columns, at the dataset versions
+    of `TABLES`.
+
+    Months are month ordinals, groups index into `GROUPS` and grades into `grades`, which is sorted, so rows sorted
+    by codes are sorted like their values. Columns are memory-mapped from the snapshot's files, once written.
+
+    """
+
+    versions: tuple[int, ...]
+    grades: np.ndarray
+    alphas: np.ndarray  # float64, smoothing factor of each quality group (by code)
+
+    # sorted by group, grade and month
+    production_month: np.ndarray  # int32
+    production_group: np.ndarray  # int8
+    production_grade: np.ndarray  # int32
+    production_heats: np.ndarray  # int32
+
+    # sorted by month and group
+    orders_month: np.ndarray  # int32
+    orders_group: np.ndarray  # int8
+    orders_heats: np.ndarray  # int32
+
+    # sorted by group, grade and month
+    state_month: np.ndarray  # int32
+    state_group: np.ndarray  # int8
+    state_grade: np.ndarray  # int32
+    state_proportion: np.ndarray  # float64, NaN until the grade has a known proportion
+
+    def order_forecasts(self, since: int, until: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Month, group and heats of the order forecasts from month ordinal `since` to before `until`"""
+
+        start, stop = np.searchsorted(self.orders_month, [since, until])
+        return self.orders_month[start:stop], self.orders_group[start:stop], self.orders_heats[start:stop]
+
+    def production(self, until: int, groups: list[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Group, month, grade and heats produced of the production of quality groups (by code) before month ordinal
+        `until`, sorted by group, grade and month"""
+
+        rows = _group_rows(self.production_group, groups)
+        rows = rows[self.production_month[rows] < until]
+        return (self.production_group[rows], self.production_month[rows], self.production_grade[rows],
+                self.production_heats[rows])
+
+    def smoothing_state(self, until: int, groups: list[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Group, grade and proportion of the latest smoothing state of every grade of quality groups (by code)
+        before month ordinal `until`, sorted by group and grade"""
+
+        rows = _group_rows(self.state_group, groups)
+        rows = rows[self.state_month[rows] < until]
+        group, grade = self.state_group[rows], self.state_grade[rows]
+        # months of a grade are in order, its latest state is the last row before the next grade's
+        latest = np.ones(len(rows), dtype=bool)
+        latest[:-1] = (group[1:] != group[:-1]) | (grade[1:] != grade[:-1])
+        return group[latest], grade[latest], self.state_proportion[rows[latest]]
+
+
+def _group_rows(column: np.ndarray, groups: list[int]) -> np.ndarray:
+    """Positions of the rows of quality groups (by code) in a column sorted by group, in order"""
+
+    bounds = np.searchsorted(column, [(group, group + 1) for group in sorted(groups)]).reshape(-1, 2)
+    return np.concatenate([np.arange(start, stop) for start, stop in bounds] + [np.empty(0, dtype=np.intp)])
+
+
+_ARRAYS = [field.name for field in dataclasses.fields(Snapshot) if field.name != 'versions']
+
+
+def _months(dates) -> np.ndarray:
+    return np.fromiter((month_ordinal(date) for date in dates), dtype=np.int32, count=len(dates))
+
+
+def _groups(groups) -> np.ndarray:
+    return np.fromiter((_GROUP_CODES[group] for group in groups), dtype=np.int8, count=len(groups))
+
+
+@metrics.timed('snapshot.build')
+def build(conn: sqla.Connection, versions: tuple[int, ...]) -> Snapshot:
+    """Snapshot of the rows `conn` reads, which must be at `versions`"""
+
+    state = db.grade_proportion_smoothing
+    orders = db.month_group_order_forecast
+    production = list(zip(*conn.execute(db.select_production_history()).all())) or [()] * 4
+    forecasts = list(zip(*conn.execute(
+        sqla.select(orders.c.month, orders.c.group, orders.c.heats_orders_forecasted)
+    ).all())) or [()] * 3
+    states = list(zip(*conn.execute(
+        sqla.select(state.c.month, state.c.group, state.c.grade, state.c.proportion)
+    ).all())) or [()] * 4
+    alphas = dict(conn.execute(db.select_smoothing_alphas()).all())
+
+    # one dictionary of grades for both tables
+    names = np.array(production[2] + states[2], dtype=str)
+    grades, grade_codes = np.unique(names, return_inverse=True)
+    grade_codes = grade_codes.astype(np.int32)
+
+    production_month, production_group = _months(production[0]), _groups(production[1])
+    production_grade = grade_codes[:len(production[2])]
+    order = np.lexsort((production_month, production_grade, production_group))
+
+    orders_month, orders_group = _months(forecasts[0]), _groups(forecasts[1])
+    orders_order = np.lexsort((orders_group, orders_month))
+
+    state_month, state_group = _months(states[0]), _groups(states[1])
+    state_grade = grade_codes[len(production[2]):]
+    state_order = np.lexsort((state_month, state_grade, state_group))
+    # unknown proportions are stored as NULL
+    state_proportion = np.array([np.nan if value is None else value for value in states[3]], dtype=np.float64)
+
+    return Snapshot(
+        versions=versions,
+        grades=grades,
+        alphas=np.array([alphas.get(group, analysis.ALPHA_ES) for group in GROUPS], dtype=np.float64),
+        production_month=production_month[order],
+        production_group=production_group[order],
+        production_grade=production_grade[order],
+        production_heats=np.array(production[3], dtype=np.int32)[order],
+        orders_month=orders_month[orders_order],
+        orders_group=orders_group[orders_order],
+        orders_heats=np.array(forecasts[2], dtype=np.int32)[orders_order],
+        state_month=state_month[state_order],
+        state_group=state_group[state_order],
+        state_grade=state_grade[state_order],
+        state_proportion=state_proportion[state_order],
+    )
+
+
+def _name(versions: tuple[int, ...]) -> str:
+    return '-'.join(map(str, versions))
+
+
+def _open(path: pathlib.Path, versions: tuple[int, ...]) -> Snapshot:
+    return Snapshot(versions, **{name: np.load(path / f'{name}.npy', mmap_mode='r') for name in _ARRAYS})
+
+
+def _write(directory: pathlib.Path, snapshot: Snapshot) -> pathlib.Path:
+    """Writes the files of `snapshot` to a directory of its own in `directory` (that of its database), under its
+    final name only once they all are"""
+
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / _name(snapshot.versions)
+    tmp = pathlib.Path(tempfile.mkdtemp(dir=directory, prefix='.tmp-'))
+    try:
+        for name in _ARRAYS:
+            np.save(tmp / f'{name}.npy', getattr(snapshot, name))
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # another process wrote it first
+        if not path.is_dir():
+            raise
+
+    # snapshots older in every table are removed, processes that have them open can still read them
+    for other in directory.iterdir():
+        try:
+            versions = tuple(map(int, other.name.split('-')))
+        except ValueError:
+            continue
+        if versions != snapshot.versions and all(old <= new for old, new in zip(versions, snapshot.versions)):
+            shutil.rmtree(other, ignore_errors=True)
+    return path
+
+
+# snapshots open in this process by database id and versions, a newer one and the one requests that started before
+# it may still read
+_snapshots = LRUCache(2)
+_lock = threading.Lock()
+
+
+def get_snapshot(conn: sqla.Connection, versions: tuple[int, ...] | None = None) -> Snapshot:
+    """Snapshot of the data `conn` reads, at `versions` of `TABLES` (read with `conn` if None).
+
+    Snapshots are opened from a directory of SNAPSHOT_DIR named after the database's id, where the first process to
+    need a version writes it, so databases with the same versions never share them. Processes that can't write it
+    keep the one they built in memory.
+
+    """
+
+    if versions is None:
+        versions = db.get_dataset_versions(conn, *TABLES)
+    key = (db.get_database_id(conn), versions)
+    if (snapshot := _snapshots.get(key)) is not None:
+        return snapshot
+
+    # NOTE: requests of the process wait for the one building a snapshot rather than each building it
+    with _lock:
+        if (snapshot := _snapshots.get(key)) is not None:
+            return snapshot
+
+        directory = pathlib.Path(settings.SNAPSHOT_DIR) / key[0]
+        path = directory / _name(versions)
+        snapshot = None
+        if path.is_dir():
+            try:
+                snapshot = _open(path, versions)
+            except (OSError, ValueError):
+                # files that didn't reach the disk before a crash
+                shutil.rmtree(path, ignore_errors=True)
+        if snapshot is None:
+            snapshot = build(conn, versions)
+            try:
+                snapshot = _open(_write(directory, snapshot), versions)
+            except OSError:
+                pass
+
+        _snapshots.set(key, snapshot)
+        return snapshot
+
+
+def publish(engine: sqla.Engine):
+    """Writes the snapshot of the data committed to `engine`'s database, if it isn't written yet"""
+
+    try:
+        with engine.connect() as conn, conn.begin():
+            get_snapshot(conn)
+    except sqla.exc.SQLAlchemyError:
+        pass  # the data is committed all the same, the first forecast to need the snapshot builds it
+
+
+def clear():
+    """Forgets the snapshots open in this process"""
+
+    _snapshots.clear()
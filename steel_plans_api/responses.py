@@ -1,10 +1,14 @@
 import datetime
 from typing import Annotated
 
+import pydantic_core
 from pydantic import BaseModel, Field
 
-from .enums import UploadFileType
-from .pipeline.analysis import ForecastProductionGroup
+from .enums import JobStatus, QualityGroup, ReportPeriod, UploadFileType, UploadMode
+from .lazy import lazy_import
+
+# only for annotations, the responses are imported before pandas is
+analysis = lazy_import('.pipeline.analysis', __package__)
 
 
 class Meta(BaseModel):
@@ -14,10 +18,137 @@ class Meta(BaseModel):
 
 class ResponseUploadFile(BaseModel):
     file_type: UploadFileType
+    mode: UploadMode
     rows: int
+    inserted: int
+    updated: int
+    unchanged: int
+    deleted: int
+    duplicate: bool
+    rows_per_second: float
+
+
+class ResponseUploadBatchFile(ResponseUploadFile):
+    name: str
+
+
+class ResponseUploadBatch(BaseModel):
+    mode: UploadMode
+    rows: int
+    rows_per_second: float
+    files: list[ResponseUploadBatchFile]
+
+
+class ResponseJob(BaseModel):
+    id: int
+    file_type: UploadFileType
+    mode: UploadMode
+    status: JobStatus
+    rows: int  # processed so far
+    inserted: int | None  # results are only set once the job succeeded
+    updated: int | None
+    unchanged: int | None
+    deleted: int | None
+    duplicate: bool | None
+    rows_per_second: float | None
+    error: str | None
+    created_at: datetime.datetime
+    started_at: datetime.datetime | None
+    finished_at: datetime.datetime | None
+
+
+class ForecastProductionGrade(BaseModel):
+    grade: Annotated[str, Field(description="Steel grade code, e.g. A36")]
+    heats: Annotated[int, Field(description="Total heats forcasted")]
+    proportion: Annotated[float, Field(ge=0.0, le=1.0)]
+
+
+class ForecastProductionGroup(BaseModel):
+    group: QualityGroup
+    heats: int
+    grades: Annotated[list[ForecastProductionGrade], Field(description="Grade-level proportions")]
 
 
 class ResponseForecast(BaseModel):
     meta: Meta
     month: Annotated[str, Field(pattern=r"^\d{4}-(0[1-9]|1[0-2])$", description="YYYY-MM")]
     groups: list[ForecastProductionGroup]
+
+
+def dump_forecast(meta: Meta, month: str, groups: 'list[analysis.GroupBreakdown]') -> bytes:
+    """JSON of a ResponseForecast, serialized straight from forecast arrays instead of validating a model per grade.
+
+    `month` must already be in YYYY-MM format, the forecasts are valid by construction.
+
+    """
+
+    return pydantic_core.to_json({
+        'meta': meta,
+        'month': month,
+        'groups': [
+            {
+                'group': group.group.value,
+                'heats': group.heats,
+                'grades': [
+                    {'grade': grade, 'heats': heats, 'proportion': proportion}
+                    for grade, heats, proportion in zip(group.grades.tolist(), group.grade_heats.tolist(),
+                                                        group.proportions.tolist())
+                ],
+            }
+            for group in groups
+        ],
+    })
+
+
+class ChargedHeats(BaseModel):
+    start: datetime.date  # first day of the period
+    grade: str
+    mould_size: str | None = None  # also None when heats aren't counted per mould size
+    heats: int
+
+
+class ResponseChargedHeats(BaseModel):
+    period: ReportPeriod
+    heats: list[ChargedHeats]
+
+
+class GradeHeatsComparison(BaseModel):
+    group: QualityGroup | None  # None for grades only found in charge schedules
+    grade: str
+    charged: int
+    produced: int | None
+    forecasted: int | None
+
+
+class ResponseHeatsComparison(BaseModel):
+    month: Annotated[str, Field(pattern=r"^\d{4}-(0[1-9]|1[0-2])$", description="YYYY-MM")]
+    grades: list[GradeHeatsComparison]
+
+
+class BacktestError(BaseModel):
+    alpha: float
+    mae: float  # heats per grade and month
+    mape: float | None  # percent, over grade-months with produced heats
+    forecasts: int  # grade-months (months for a grade) forecast
+
+
+class BacktestGrade(BaseModel):
+    grade: str
+    mae: float
+    mape: float | None
+    forecasts: int
+
+
+class BacktestGroup(BaseModel):
+    group: QualityGroup
+    alpha: float  # lowest MAE
+    mae: float  # with the chosen alpha
+    mape: float | None
+    current_alpha: float  # used by forecasts before the backtest was applied
+    errors: list[BacktestError]
+    grades: Annotated[list[BacktestGrade], Field(description="Errors per grade with the chosen alpha")]
+
+
+class ResponseBacktest(BaseModel):
+    applied: bool  # whether forecasts now use the chosen alphas
+    groups: list[BacktestGroup]
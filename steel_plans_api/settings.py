@@ -0,0 +1,74 @@
+"""Runtime settings, overridable with ``STEEL_PLANS_*`` environment variables"""
+import os
+
+from .enums import ForecastMethod, QualityGroup, UploadFileType
+
+# address `steel-plans-api serve` listens on, and worker processes it forks to serve requests
+HOST = os.environ.get('STEEL_PLANS_HOST', '127.0.0.1')
+PORT = int(os.environ.get('STEEL_PLANS_PORT', 8000))
+WORKERS = int(os.environ.get('STEEL_PLANS_WORKERS', 1))
+
+# threads running the blocking work of requests (parsing, database and analysis)
+WORKER_THREADS = int(os.environ.get('STEEL_PLANS_WORKER_THREADS', 40))
+
+# uploads parsed at the same time, and uploads allowed to wait for them before new ones are turned away,
+# so that uploads can't take every worker thread from forecasts
+UPLOAD_CONCURRENCY = int(os.environ.get('STEEL_PLANS_UPLOAD_CONCURRENCY', 2))
+UPLOAD_QUEUE_LIMIT = int(os.environ.get('STEEL_PLANS_UPLOAD_QUEUE_LIMIT', 8))
+
+# uploads run as background jobs are kept in JOBS_DIR until loaded; each file type is loaded by its own number of
+# workers (STEEL_PLANS_JOB_CONCURRENCY_<FILE TYPE>, e.g. STEEL_PLANS_JOB_CONCURRENCY_DAILY_CHARGE_SCHEDULE), and new
+# jobs of a file type are turned away once JOB_QUEUE_LIMIT of them are waiting
+JOBS_DIR = os.environ.get('STEEL_PLANS_JOBS_DIR', './jobs')
+JOB_CONCURRENCY = {
+    file_type: int(os.environ.get(f'STEEL_PLANS_JOB_CONCURRENCY_{file_type.name}', 1)) for file_type in UploadFileType
+}
+JOB_QUEUE_LIMIT = int(os.environ.get('STEEL_PLANS_JOB_QUEUE_LIMIT', 32))
+
+# whether this process loads background jobs; with several worker processes, only the first one does
+RUN_JOBS = os.environ.get('STEEL_PLANS_RUN_JOBS', '1') != '0'
+
+# how often idle job workers look for jobs queued by other processes
+JOB_POLL_SECONDS = float(os.environ.get('STEEL_PLANS_JOB_POLL_SECONDS', 1))
+
+# processes parsing the files of batch uploads at the same time
+PARSE_PROCESSES = int(os.environ.get('STEEL_PLANS_PARSE_PROCESSES', os.cpu_count() or 1))
+
+# forecasting model of each quality group (STEEL_PLANS_FORECAST_METHOD_<GROUP>, e.g. STEEL_PLANS_FORECAST_METHOD_SBQ),
+# unless a request picks one
+FORECAST_METHODS = {
+    group: ForecastMethod(os.environ.get(f'STEEL_PLANS_FORECAST_METHOD_{group.name}', ForecastMethod.EWM))
+    for group in QualityGroup
+}
+
+# forecasts kept in memory, per worker process
+FORECAST_CACHE_SIZE = int(os.environ.get('STEEL_PLANS_FORECAST_CACHE_SIZE', 256))
+
+# columnar snapshots of production history, order forecasts and smoothing state, which forecasts read instead of the
+# database; written once per version of the data, memory-mapped by every worker process
+SNAPSHOT_DIR = os.environ.get('STEEL_PLANS_SNAPSHOT_DIR', './snapshots')
+
+# rows sent to the database per insert statement when loading uploads
+INSERT_BATCH_SIZE = int(os.environ.get('STEEL_PLANS_INSERT_BATCH_SIZE', 5_000))
+
+# rows fetched from the database and written to the response at a time by exports
+EXPORT_CHUNK_ROWS = int(os.environ.get('STEEL_PLANS_EXPORT_CHUNK_ROWS', 10_000))
+
+# bearer token of admins, who can profile requests with `profile=1`; profiling is off without one
+ADMIN_TOKEN = os.environ.get('STEEL_PLANS_ADMIN_TOKEN') or None
+
+# database, and connections kept open to write to it (uploads) and read from it (forecasts)
+DATABASE_URL = os.environ.get('STEEL_PLANS_DATABASE_URL', 'sqlite:///./app.db')
+DATABASE_POOL_SIZE = int(os.environ.get('STEEL_PLANS_DATABASE_POOL_SIZE', 5))
+DATABASE_READ_POOL_SIZE = int(os.environ.get('STEEL_PLANS_DATABASE_READ_POOL_SIZE', WORKER_THREADS))
+
+# seconds SQLite connections wait for another connection to release the write lock before giving up
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('STEEL_PLANS_SQLITE_BUSY_TIMEOUT', 30))
+
+# bytes of SQLite databases read through memory-mapped I/O instead of reads, off when 0
+SQLITE_MMAP_SIZE = int(os.environ.get('STEEL_PLANS_SQLITE_MMAP_SIZE', 0))
+
+# SQLite journal mode and synchronous level of every connection; with WAL, NORMAL only risks losing the last
+# transactions on power loss (never corrupts the database), and loads don't wait on an fsync per commit
+SQLITE_JOURNAL_MODE = os.environ.get('STEEL_PLANS_SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('STEEL_PLANS_SQLITE_SYNCHRONOUS', 'NORMAL')
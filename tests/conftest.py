@@ -7,9 +7,13 @@ from sqlalchemy import create_engine
 from sqlalchemy.pool import StaticPool
 
 from steel_plans_api import app
+from steel_plans_api.cache import forecast_cache
+from steel_plans_api import settings
 from steel_plans_api.enums import UploadFileType
-from steel_plans_api.pipeline import create_db_pipeline
-from steel_plans_api.pipeline.db import get_conn, metadata
+from steel_plans_api.jobs import JobQueue, get_job_queue
+from steel_plans_api.pipeline import create_db_pipeline, snapshot
+from steel_plans_api.pipeline import db
+from steel_plans_api.pipeline.db import get_conn, get_read_conn, metadata
 
 
 @pytest.fixture
@@ -23,6 +27,15 @@ def global_setup_and_teardown():
     yield
 
 
+@pytest.fixture(autouse=True)
+def clear_caches(tmp_path, monkeypatch):
+    # every test rolls its data back, cached results and snapshots must not outlive it
+    forecast_cache.clear()
+    snapshot.clear()
+    monkeypatch.setattr(settings, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    yield
+
+
 @pytest.fixture(scope='session')
 def engine():
     eng = create_engine(
@@ -58,8 +71,24 @@ def seeded_db(data_dir, db_conn):
     return db_conn
 
 
+@pytest.fixture
+def job_queue(tmp_path):
+    # workers load jobs from threads of their own, which need a database they can commit to
+    # and readers that don't wait for them, as the app's
+    url = f"sqlite:///{tmp_path / 'jobs.db'}"
+    eng = db._create_engine(url, settings.DATABASE_POOL_SIZE)
+    read_eng = db._create_engine(url, settings.DATABASE_READ_POOL_SIZE, read_only=True)
+    metadata.create_all(eng)
+    queue = JobQueue(eng, tmp_path / 'jobs', settings.JOB_CONCURRENCY, queue_limit=2, poll_seconds=0.1,
+                     read_engine=read_eng)
+    yield queue
+    queue.stop()
+    read_eng.dispose()
+    eng.dispose()
+
+
 @pytest.fixture(scope='function')
-def client(db_conn):
+def client(db_conn, job_queue):
     # Override FastAPI’s DB dependency to use our test session
     def _get_db_override():
         try:
@@ -68,6 +97,8 @@ def client(db_conn):
             pass
 
     app.dependency_overrides[get_conn] = _get_db_override
+    app.dependency_overrides[get_read_conn] = _get_db_override
+    app.dependency_overrides[get_job_queue] = lambda: job_queue
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
@@ -0,0 +1,151 @@
+"""Reference implementations the optimized code is tested against"""
+import numpy as np
+import pandas as pd
+
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline.analysis import ALPHA_ES
+from steel_plans_api.pipeline.models import MODELS
+from steel_plans_api.responses import ForecastProductionGrade, ForecastProductionGroup
+
+
+def history_frame(production_history) -> pd.DataFrame:
+    """Production history rows as the DataFrame the references take, with months as periods"""
+
+    history_df = pd.DataFrame(production_history, columns=['month', 'group', 'grade', 'heats_produced'])
+    history_df['month'] = pd.to_datetime(history_df['month']).dt.to_period('M')
+    return history_df
+
+
+def predict_proportions_reference(pm_df: pd.DataFrame, until: pd.Period, method: ForecastMethod) -> pd.Series:
+    """Proportions `method` forecasts for the month `until`, from the production before it laid out a row at a
+    time, indexed by (group, grade) and sorted"""
+
+    pm_df = pm_df[pm_df['month'] < until]
+    columns = sorted(set(zip(pm_df['group'], pm_df['grade'])))
+    index = pd.MultiIndex.from_tuples(columns, names=['group', 'grade'])
+    if not columns:
+        return pd.Series([], index=index, name='proportion', dtype=float)
+
+    months = pd.period_range(pm_df['month'].min(), until - 1, freq='M')
+    totals = pm_df.groupby(['month', 'group'])['heats_produced'].sum()
+    values = np.full((len(months), len(columns)), np.nan)
+    present = np.zeros(values.shape, dtype=bool)
+    for row in pm_df.itertuples():
+        i, j = months.get_loc(row.month), columns.index((row.group, row.grade))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values[i, j] = np.float64(row.heats_produced) / totals[row.month, row.group]
+        present[i, j] = True
+
+    # grades not produced in a month their group produced in, once they were, produced nothing
+    group_months = pm_df.groupby('group')['month'].agg(set)
+    for j, (group, _) in enumerate(columns):
+        first = present[:, j].argmax()
+        for i, month in enumerate(months):
+            if i > first and not present[i, j] and month in group_months[group]:
+                values[i, j] = 0.
+
+    # groups smoothed with the default factor
+    alphas = np.full(len(columns), ALPHA_ES)
+    return pd.Series(MODELS[method].predict(values, present, alphas), index=index, name='proportion', dtype=float)
+
+
+def normalize(base):
+    """Make proportions add up to 1 (or 0 if no data)"""
+
+    base = base.copy()
+    s = base['proportion'].sum()
+    if s > 0:
+        # proportions sum up to 1
+        base['proportion'] = base['proportion'] / s
+    else:
+        # if no predicted proportions, proportions are uniform
+        n = len(base)
+        base['proportion'] = (1.0 / n) if n else 0.0
+    return base
+
+
+def forecast_breakdown_reference(omf_df: pd.DataFrame, pm_df: pd.DataFrame,
+                                 m_period: pd.Period) -> list[ForecastProductionGroup]:
+    """Per-grade loop implementation of the forecast breakdown.
+
+    The implementation `analysis._do_forecast_breakdown` replaced, kept as the reference it is tested and
+    benchmarked against.
+
+    Args:
+        omf_df: The order forecast for the target month
+        pm_df: Historical mothly steel production data
+
+    Returns:
+        Forecasts per group, broken down by grades for the target month
+
+    """
+
+    pm_df['proportion'] = (
+            pm_df['heats_produced'] /
+            pm_df.groupby(["month", "group"])['heats_produced'].transform("sum")
+    )
+
+    group_forecasts: list[ForecastProductionGroup] = []
+    for quality_group, grade_production in pm_df.groupby("group"):
+        parts = []
+        for grade, m_df in grade_production.groupby('grade'):
+            # sort by month to prepare for exponentional smoothening
+            sorted_df = m_df.sort_values('month')  # type: ignore
+
+            # use exponential smoothing
+            # no adjust to do simple forcast
+            smoothed = sorted_df["proportion"].ewm(alpha=ALPHA_ES, adjust=False).mean().iloc[
+                -1]  # last one is predicted value
+            parts.append((grade, smoothed))
+
+        group_prod_forecast = pd.DataFrame(parts, columns=['grade', 'proportion'])
+        group_prod_forecast = normalize(group_prod_forecast)
+        group_prod_forecast['group'] = quality_group
+        group_prod_forecast['target_month'] = m_period
+
+        # attach group total heats for the target month (0 if not present)
+        try:
+            group_orders_forecasted = int(
+                omf_df.loc[omf_df['group'] == quality_group, "heats_orders_forecasted"].iat[0])
+        except IndexError:
+            group_orders_forecasted = 0
+
+        # calculate forecasted grade production by multiplifying forecasted grade proportions by forecasted group orders
+        group_prod_forecast['raw_heats'] = group_prod_forecast['proportion'] * group_orders_forecasted
+        group_prod_forecast['heats'] = np.floor(group_prod_forecast['raw_heats']).astype(
+            int)  # heats floored to integers
+        group_prod_forecast['__remainder'] = group_prod_forecast['raw_heats'] - group_prod_forecast['heats']
+
+        # hamilton rounding
+        remainder = group_orders_forecasted - group_prod_forecast['heats'].sum()
+        if remainder > 0:
+
+            group_prod_forecast = group_prod_forecast.sort_values(  # largest remainders go first
+                by=["__remainder", "grade"],  # tie-breaker: remainder first, then grade
+                ascending=[False, True]
+            )  # type: ignore
+
+            col_idx = group_prod_forecast.columns.get_loc('heats')
+            for i in range(int(remainder)):
+                group_prod_forecast.iat[i, col_idx] += 1
+
+        group_prod_forecast = group_prod_forecast.drop(columns=['__remainder'])
+
+        # make sure total heats produced match order forecast
+        assert group_prod_forecast['heats'].sum() == group_orders_forecasted
+
+        # normalize proportions to match forecasted heats
+        group_prod_forecast['proportion'] = group_prod_forecast['heats'] / group_prod_forecast['heats'].sum()
+
+        # save to pyantic model for decoupling pandas from endpoints
+        # and make it easier to know what output structure to expect)
+        grades = [ForecastProductionGrade(**grade) for _, grade in group_prod_forecast.iterrows()]
+
+        fpg = ForecastProductionGroup(
+            group=QualityGroup(quality_group),
+            heats=group_orders_forecasted,
+            grades=grades
+        )
+        group_forecasts.append(fpg)
+
+    return group_forecasts
@@ -0,0 +1,108 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import QualityGroup
+from steel_plans_api.pipeline import analysis, db
+from steel_plans_api.responses import Meta, ResponseForecast, dump_forecast
+
+from .reference import forecast_breakdown_reference
+
+
+def _random_history(seed, n_grades, n_months, missing_rate=0.2, zero_rate=0.2):
+    rng = np.random.default_rng(seed)
+    groups = list(QualityGroup)
+    months = pd.period_range('2020-01', periods=n_months, freq='M')
+
+    rows = []
+    for i in range(n_grades):
+        group = groups[i % len(groups)]
+        for month in months:
+            if rng.random() < missing_rate:
+                continue
+            heats = 0 if rng.random() < zero_rate else int(rng.integers(1, 200))
+            rows.append({'month': month, 'grade': f'G{i:04d}', 'group': group, 'heats_produced': heats})
+
+    pm_df = pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+    omf_df = pd.DataFrame({
+        'month': months[-1],
+        'group': groups,
+        'heats_orders_forecasted': rng.integers(0, 500, len(groups)),
+    })
+    return omf_df, pm_df
+
+
+def _breakdown(func, omf_df, pm_df):
+    try:
+        return [group.model_dump() for group in func(omf_df.copy(), pm_df.copy(), pd.Period('2024-10', 'M'))]
+    except Exception:
+        # the endpoint turns any failure into a 400, only the fact that it failed matters
+        return 'failed'
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('n_grades, n_months', [(1, 1), (7, 5), (40, 30)])
+def test_vectorized_breakdown_matches_reference(seed, n_grades, n_months):
+    omf_df, pm_df = _random_history(seed, n_grades, n_months, zero_rate=0.0 if seed % 2 else 0.5)
+
+    expected = _breakdown(forecast_breakdown_reference, omf_df, pm_df)
+    actual = _breakdown(analysis._do_forecast_breakdown, omf_df, pm_df)
+
+    assert actual == expected
+
+
+def test_vectorized_breakdown_matches_reference_on_seeded_data(seeded_db):
+    omf_df = pd.DataFrame(seeded_db.execute(sqla.select(db.month_group_order_forecast)).mappings().all())
+    pm_df = pd.DataFrame(seeded_db.execute(sqla.select(db.month_steel_production)).mappings().all())
+    pm_df['month'] = pd.to_datetime(pm_df['month']).dt.to_period('M')
+
+    for month in omf_df['month'].unique():
+        month_omf_df = omf_df[omf_df['month'] == month]
+        expected = _breakdown(forecast_breakdown_reference, month_omf_df, pm_df)
+        actual = _breakdown(analysis._do_forecast_breakdown, month_omf_df, pm_df)
+
+        assert actual == expected
+
+
+@pytest.mark.parametrize('series', [
+    [0.5],
+    [0.1, 0.4, 0.2],
+    [np.nan, 0.3, np.nan, np.nan, 0.6, 0.6],
+    [np.nan, np.nan],
+])
+def test_ewm_last_matches_pandas(series):
+    values = np.array(series)[:, None]
+    present = np.ones(values.shape, dtype=bool)
+
+    expected = pd.Series(series).ewm(alpha=analysis.ALPHA_ES, adjust=False).mean().iloc[-1]
+    actual = analysis._ewm_last(values, present)[0]
+
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_dump_forecast_matches_model(seed):
+    omf_df, pm_df = _random_history(seed, 40, 12, zero_rate=0.0)
+    pm_df['proportion'] = analysis._proportions(pm_df)
+    smoothed = analysis._smooth_grade_proportions(pm_df)
+    meta = Meta(timestamp=datetime.datetime(2024, 10, 1, 12, 30, 15, 123456), version='1.0')
+
+    groups = analysis._breakdown_smoothed_arrays(omf_df, smoothed)
+    expected = ResponseForecast(meta=meta, month='2024-10', groups=[
+        analysis.ForecastProductionGroup.model_validate(group.to_model().model_dump()) for group in groups
+    ])
+
+    assert json.loads(dump_forecast(meta, '2024-10', groups)) == json.loads(expected.model_dump_json())
+
+
+def test_breakdown_arrays_reject_group_without_heats():
+    omf_df, pm_df = _random_history(0, 8, 3, zero_rate=0.0)
+    omf_df['heats_orders_forecasted'] = 0
+    pm_df['proportion'] = analysis._proportions(pm_df)
+
+    with pytest.raises(ValueError):
+        analysis._breakdown_smoothed_arrays(omf_df, analysis._smooth_grade_proportions(pm_df))
@@ -1,7 +1,23 @@
+import csv
+import datetime
+import functools
+import io
+import json
+import time
+import zipfile
+
+import openpyxl
 import pytest
+import sqlalchemy as sqla
 from fastapi import status
 
 import steel_plans_api
+from steel_plans_api import endpoints, settings
+from steel_plans_api.cache import forecast_cache
+from steel_plans_api.concurrency import ConcurrencyLimiter
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline import create_db_pipeline, db, models, smoothing
+from steel_plans_api.pipeline.pipelines import pipelines, post_insert_hooks
 
 
 @pytest.mark.parametrize(
@@ -22,6 +38,30 @@ def test_upload_file(file_to_upload, data_dir, client):
     assert response.status_code == status.HTTP_201_CREATED
 
 
+@pytest.mark.parametrize('batch_size', [1, 7, None])
+@pytest.mark.parametrize('file_type', list(steel_plans_api.UploadFileType))
+def test_pipeline_batch_size(file_type, batch_size, data_dir, db_conn):
+    table = pipelines[file_type][1]
+    with open(data_dir / file_type.value, 'rb') as f:
+        stats = create_db_pipeline(file_type, batch_size=batch_size)(db_conn, f)
+
+    assert stats.rows == db_conn.execute(sqla.select(sqla.func.count()).select_from(table)).scalar_one() > 0
+    assert db.get_dataset_versions(db_conn, table) == (1,)
+
+
+def test_post_insert_hook_runs_once_per_file(data_dir, db_conn, monkeypatch):
+    file_type = steel_plans_api.UploadFileType.DAILY_CHARGE_SCHEDULE
+    parser, table = pipelines[file_type]
+    calls = []
+    monkeypatch.setitem(pipelines, file_type, (functools.partial(parser, batch_size=10), table))
+    monkeypatch.setitem(post_insert_hooks, file_type, (('day',), lambda conn, keys: calls.append(keys)))
+
+    with open(data_dir / file_type.value, 'rb') as f:
+        create_db_pipeline(file_type)(db_conn, f)
+
+    assert calls == [{(day,) for day in db_conn.execute(sqla.select(table.c.day.distinct())).scalars()}]
+
+
 @pytest.mark.usefixtures('seeded_db')
 @pytest.mark.parametrize('month', ['2024-09', '2024-08', '2024-07', '2024-06'])
 def test_forecast(client, month):
@@ -43,3 +83,364 @@ def test_forecast(client, month):
     # for group 
 
     assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_forecast_without_prior_history(client):
+    # production history starts in 2024-06, later months must not leak into its forecast
+    response = client.get('/forecast/production/', params={'month': '2024-06'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['groups'] == []
+
+
+def _upload(client, file_to_upload, data_dir, mode='append'):
+    with open(data_dir / file_to_upload, 'rb') as f:
+        return client.post(f'/files/{file_to_upload}', params={'mode': mode}, files={'file': (file_to_upload, f)})
+
+
+def _upload_workbook(client, file_to_upload, data_dir, mode, **cells):
+    workbook = openpyxl.load_workbook(data_dir / file_to_upload)
+    for cell, value in cells.items():
+        workbook.active[cell] = value
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    return client.post(f'/files/{file_to_upload}', params={'mode': mode},
+                       files={'file': (file_to_upload, buffer.getvalue())})
+
+
+def test_forecast_etag(client, seeded_db, data_dir):
+    params = {'month': '2024-09'}
+    response = client.get('/forecast/production/', params=params)
+    tag = response.headers['ETag']
+    # responses carry the time they were made at, only their contents are the same
+    assert tag.startswith('W/"')
+
+    assert client.get('/forecast/production/', params=params).json() == response.json()
+    assert client.get('/forecast/production/', params=params, headers={'If-None-Match': tag}).status_code \
+        == status.HTTP_304_NOT_MODIFIED
+
+    # charge schedules don't affect forecasts
+    response = _upload_workbook(client, 'daily_charge_schedule.xlsx', data_dir, 'upsert', C4='6"')
+    assert response.json()['updated'] == 1
+    assert client.get('/forecast/production/', params=params).headers['ETag'] == tag
+
+    # changed order forecasts do
+    response = _upload_workbook(client, 'product_groups_monthly.xlsx', data_dir, 'upsert', B3=1)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.get('/forecast/production/', params=params, headers={'If-None-Match': tag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != tag
+
+
+def test_forecast_etag_is_per_database(client, seeded_db):
+    params = {'month': '2024-09'}
+    tag = client.get('/forecast/production/', params=params).headers['ETag']
+
+    # another database at the same versions
+    seeded_db.execute(sqla.update(db.database_info).values(database_id='0' * 32))
+    response = client.get('/forecast/production/', params=params, headers={'If-None-Match': tag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != tag
+
+
+def _without_meta(forecast):
+    return {key: value for key, value in forecast.items() if key != 'meta'}
+
+
+@pytest.mark.usefixtures('seeded_db')
+@pytest.mark.parametrize('headers', [{}, {'Accept': 'application/x-ndjson'}])
+def test_forecast_range(client, headers):
+    # 2024-05 has no order forecast
+    response = client.get('/forecast/production/range', params={'from': '2024-05', 'to': '2024-09'}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    if headers:
+        forecasts = [json.loads(line) for line in response.text.splitlines()]
+    else:
+        forecasts = response.json()
+
+    months = ['2024-06', '2024-07', '2024-08', '2024-09']
+    assert [forecast['month'] for forecast in forecasts] == months
+
+    forecast_cache.clear()
+    for month, forecast in zip(months, forecasts):
+        single = client.get('/forecast/production/', params={'month': month}).json()
+        assert _without_meta(forecast) == _without_meta(single)
+
+
+def _failing_month(monkeypatch, failing: datetime.date):
+    forecast_snapshot = models.forecast_snapshot
+
+    def forecast(snap, month, methods):
+        if month == failing:
+            raise ValueError('Cannot allocate heats to grades without a forecasted proportion')
+        return forecast_snapshot(snap, month, methods)
+
+    monkeypatch.setattr(models, 'forecast_snapshot', forecast)
+
+
+@pytest.mark.usefixtures('seeded_db')
+@pytest.mark.parametrize('headers', [{}, {'Accept': 'application/x-ndjson'}])
+def test_forecast_range_fails_before_streaming(client, headers, monkeypatch):
+    _failing_month(monkeypatch, datetime.date(2024, 8, 1))
+
+    response = client.get('/forecast/production/range', params={'from': '2024-05', 'to': '2024-09'}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_upload_file_when_busy(client, data_dir, monkeypatch):
+    monkeypatch.setattr(endpoints, 'upload_limiter', ConcurrencyLimiter(0, 0))
+
+    response = _upload(client, steel_plans_api.UploadFileType.MONTHLY_ORDER_FORECAST.value, data_dir)
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert 'Retry-After' in response.headers
+
+
+def _smoothing_state_is_rebuilt(conn):
+    stmt = sqla.select(db.grade_proportion_smoothing).order_by(*db.grade_proportion_smoothing.primary_key)
+    state = conn.execute(stmt).all()
+    smoothing.refresh_smoothing_state(conn)
+    return state == conn.execute(stmt).all()
+
+
+@pytest.mark.parametrize('file_type', list(steel_plans_api.UploadFileType))
+def test_reupload(file_type, client, seeded_db, data_dir):
+    table = pipelines[file_type][1]
+    versions = db.get_dataset_versions(seeded_db, table)
+
+    assert _upload(client, file_type.value, data_dir).status_code == status.HTTP_409_CONFLICT
+
+    # the same file is answered from the uploads ledger
+    response = _upload(client, file_type.value, data_dir, 'upsert')
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+    assert (data['inserted'], data['updated'], data['unchanged'], data['duplicate']) == (0, 0, data['rows'], True)
+
+    # nothing changed, forecasts cached from the table are still valid
+    assert db.get_dataset_versions(seeded_db, table) == versions
+
+    # once the table changed, it is loaded again
+    db.bump_dataset_version(seeded_db, table)
+    data = _upload(client, file_type.value, data_dir, 'upsert').json()
+    assert (data['unchanged'], data['duplicate']) == (data['rows'], False)
+
+
+def test_upsert_updates_changed_rows(client, seeded_db, data_dir):
+    response = _upload_workbook(client, 'steel_grade_production.xlsx', data_dir, 'upsert', C3=9999)
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+    assert (data['inserted'], data['updated'], data['unchanged']) == (0, 1, data['rows'] - 1)
+
+    stmt = sqla.select(db.month_steel_production.c.short_tons).where(
+        db.month_steel_production.c.month == datetime.date(2024, 6, 24),
+        db.month_steel_production.c.grade == 'B500A',
+    )
+    assert seeded_db.execute(stmt).scalar_one() == 9999
+    assert _smoothing_state_is_rebuilt(seeded_db)
+
+
+def test_replace_range(client, seeded_db, data_dir):
+    table = db.month_steel_production
+    stored = seeded_db.execute(sqla.select(sqla.func.count()).select_from(table)).scalar_one()
+
+    # B500A was renamed, its rows are replaced rather than kept next to the new ones
+    response = _upload_workbook(client, 'steel_grade_production.xlsx', data_dir, 'replace-range', B3='B500X')
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+    assert data['deleted'] == data['inserted'] == data['rows'] == stored
+
+    grades = seeded_db.execute(sqla.select(table.c.grade)).scalars().all()
+    assert 'B500X' in grades and 'B500A' not in grades
+    assert _smoothing_state_is_rebuilt(seeded_db)
+
+
+def _wait_for_job(client, location):
+    for _ in range(100):
+        job = client.get(location).json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(location)
+
+
+@pytest.mark.parametrize('file_type', list(steel_plans_api.UploadFileType))
+def test_upload_file_as_job(file_type, client, job_queue, data_dir):
+    with open(data_dir / file_type.value, 'rb') as f:
+        response = client.post(f'/files/{file_type.value}', files={'file': (file_type.value, f)},
+                               headers={'Prefer': 'respond-async'})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()['status'] in ('queued', 'running')
+
+    job = _wait_for_job(client, response.headers['Location'])
+    assert job['status'] == 'succeeded'
+    assert job['rows'] == job['inserted'] > 0
+
+    table = pipelines[file_type][1]
+    with job_queue.engine.connect() as conn:
+        assert conn.execute(sqla.select(sqla.func.count()).select_from(table)).scalar_one() == job['rows']
+
+    # the same file again conflicts, as it would uploaded right away
+    with open(data_dir / file_type.value, 'rb') as f:
+        response = client.post(f'/files/{file_type.value}', files={'file': (file_type.value, f)},
+                               headers={'Prefer': 'respond-async'})
+    job = _wait_for_job(client, response.headers['Location'])
+    assert (job['status'], job['error'], job['inserted']) == ('failed', 'File already exists', None)
+
+
+def test_upload_file_as_job_when_busy(client, job_queue, data_dir):
+    # without workers, jobs stay queued
+    job_queue.stop()
+    file_type = steel_plans_api.UploadFileType.MONTHLY_ORDER_FORECAST
+    for expected in [status.HTTP_202_ACCEPTED] * job_queue.queue_limit + [status.HTTP_503_SERVICE_UNAVAILABLE]:
+        response = client.post(f'/files/{file_type.value}', files={'file': (file_type.value, b'not a workbook')},
+                               headers={'Prefer': 'respond-async'})
+        assert response.status_code == expected
+
+    assert client.get('/jobs/0').status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_upload_files(client, db_conn, data_dir):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.write(data_dir / 'product_groups_monthly.xlsx', 'month_end/product_groups_monthly.xlsx')
+
+    names = ['plant_1_steel_grade_production.xlsx', 'daily_charge_schedule.xlsx']
+    files = [('files', (name, (data_dir / name.removeprefix('plant_1_')).read_bytes())) for name in names]
+    files.append(('files', ('month_end.zip', archive.getvalue())))
+
+    response = client.post('/files', files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+
+    assert [file['name'] for file in data['files']] == names + ['month_end/product_groups_monthly.xlsx']
+    assert data['rows'] == sum(file['inserted'] for file in data['files'])
+    for file in data['files']:
+        table = pipelines[steel_plans_api.UploadFileType(file['file_type'])][1]
+        assert db_conn.execute(sqla.select(sqla.func.count()).select_from(table)).scalar_one() == file['rows'] > 0
+    assert _smoothing_state_is_rebuilt(db_conn)
+
+    # files already stored conflict, as they do uploaded one at a time
+    assert client.post('/files', files=files).status_code == status.HTTP_409_CONFLICT
+
+
+def test_upload_csv_files(client, db_conn, data_dir):
+    def as_csv(file_type):
+        buffer = io.StringIO()
+        rows = openpyxl.load_workbook(data_dir / file_type.value).active.iter_rows(values_only=True)
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    production = steel_plans_api.UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    response = client.post('/files/steel_grade_production.csv', files={'file': ('export.csv', as_csv(production))})
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['file_type'] == production.value
+
+    others = [steel_plans_api.UploadFileType.DAILY_CHARGE_SCHEDULE, steel_plans_api.UploadFileType.MONTHLY_ORDER_FORECAST]
+    files = [('files', (f'plant_1_{file_type.stem}.csv', as_csv(file_type))) for file_type in others]
+    response = client.post('/files', files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [file['file_type'] for file in response.json()['files']] == [file_type.value for file_type in others]
+    assert all(file['rows'] > 0 for file in response.json()['files'])
+
+
+@pytest.mark.parametrize('name, content', [('notes.txt', b''), ('product_groups_monthly.xlsx', b''),
+                                           ('month_end.zip', b'not a zip')])
+def test_upload_files_rejects_invalid_files(client, name, content):
+    response = client.post('/files', files=[('files', (name, content))])
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.usefixtures('seeded_db')
+@pytest.mark.parametrize('period', ['day', 'week', 'month'])
+def test_charged_heats(client, period):
+    params = {'from': '2024-08-30', 'to': '2024-09-02', 'period': period}
+    heats = client.get('/production/charges', params=params).json()['heats']
+    by_grade = client.get('/production/charges', params=params | {'by_mould_size': False}).json()['heats']
+
+    # the schedule has 37 charges, from 2024-08-30 to 2024-09-01
+    assert sum(row['heats'] for row in heats) == sum(row['heats'] for row in by_grade) == 37
+    assert len({row['start'] for row in heats}) == {'day': 3, 'week': 1, 'month': 2}[period]
+    assert all(row['mould_size'] is None for row in by_grade)
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_compare_heats(client):
+    response = client.get('/production/comparison', params={'month': '2024-08'})
+    assert response.status_code == status.HTTP_200_OK
+    grades = {row['grade']: row for row in response.json()['grades']}
+
+    assert grades['B500B'] == {'group': 'REBAR', 'grade': 'B500B', 'charged': 11, 'produced': 108, 'forecasted': 116}
+    # charged, but neither produced nor forecasted
+    assert grades['A53/C600'] == {'group': None, 'grade': 'A53/C600', 'charged': 1, 'produced': None,
+                                  'forecasted': None}
+
+    forecast = client.get('/forecast/production/', params={'month': '2024-08'}).json()
+    assert sum(row['forecasted'] or 0 for row in grades.values()) == sum(group['heats'] for group in forecast['groups'])
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_backtest(client):
+    params = {'month': '2024-08'}
+    tag = client.get('/forecast/production/', params=params).headers['ETag']
+
+    response = client.get('/forecast/backtest', params={'alpha': [0.1, 0.3, 0.9]})
+    assert response.status_code == status.HTTP_200_OK
+    backtest = response.json()
+    assert not backtest['applied']
+    for group in backtest['groups']:
+        assert [errors['alpha'] for errors in group['errors']] == [0.1, 0.3, 0.9]
+        assert group['mae'] == min(errors['mae'] for errors in group['errors'])
+        assert group['current_alpha'] == 0.3
+    assert client.get('/forecast/production/', params=params).headers['ETag'] == tag
+
+    response = client.post('/forecast/backtest', params={'alpha': [0.1, 0.3, 0.9]})
+    assert response.json()['applied']
+    alphas = {group['group']: group['alpha'] for group in response.json()['groups']}
+
+    # forecasts now use the alphas chosen
+    backtest = client.get('/forecast/backtest', params={'alpha': [0.1, 0.3, 0.9]}).json()
+    assert {group['group']: group['current_alpha'] for group in backtest['groups']} == alphas
+    if set(alphas.values()) != {0.3}:
+        assert client.get('/forecast/production/', params=params).headers['ETag'] != tag
+
+
+@pytest.mark.parametrize('alpha', [0, 1.5])
+def test_backtest_rejects_invalid_alphas(client, alpha):
+    response = client.get('/forecast/backtest', params={'alpha': alpha})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.usefixtures('seeded_db')
+@pytest.mark.parametrize('method', ['moving-average', 'holt', 'seasonal-naive', 'croston'])
+def test_forecast_method(client, method):
+    params = {'month': '2024-08'}
+    ewm = client.get('/forecast/production/', params=params)
+
+    response = client.get('/forecast/production/', params=params | {'method': method})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['ETag'] != ewm.headers['ETag']
+    groups = response.json()['groups']
+    assert [(group['group'], group['heats']) for group in groups] == \
+        [(group['group'], group['heats']) for group in ewm.json()['groups']]
+    assert all(sum(grade['heats'] for grade in group['grades']) == group['heats'] for group in groups)
+
+    forecasts = client.get('/forecast/production/range', params={'from': '2024-08', 'to': '2024-08', 'method': method})
+    assert forecasts.json()[0]['groups'] == groups
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_forecast_method_per_group(client, monkeypatch):
+    params = {'month': '2024-08'}
+    croston = client.get('/forecast/production/', params=params | {'method': 'croston'}).json()['groups']
+    ewm = client.get('/forecast/production/', params=params).json()['groups']
+
+    monkeypatch.setitem(settings.FORECAST_METHODS, QualityGroup.SBQ, ForecastMethod.CROSTON)
+    groups = client.get('/forecast/production/', params=params).json()['groups']
+
+    expected = [c if c['group'] == 'SBQ' else e for c, e in zip(croston, ewm)]
+    assert groups == expected
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import QualityGroup
+from steel_plans_api.pipeline import analysis, backtesting, db, smoothing
+
+
+def _random_history(seed, n_grades, n_months, missing_rate=0.3, zero_rate=0.2):
+    rng = np.random.default_rng(seed)
+    groups = list(QualityGroup)
+    months = pd.date_range('2020-01-01', periods=n_months, freq='MS').date
+
+    return [
+        {'month': month, 'group': groups[i % len(groups)], 'grade': f'G{i:03d}',
+         'heats_produced': 0 if rng.random() < zero_rate else int(rng.integers(1, 200))}
+        for i in range(n_grades)
+        for month in months
+        if rng.random() > missing_rate
+    ]
+
+
+def _reference_mae(history, alpha):
+    """MAE per group, forecasting each month with pandas from the months before it"""
+
+    pm_df = pd.DataFrame(history)
+    pm_df['proportion'] = pm_df['heats_produced'] / pm_df.groupby(['month', 'group'])['heats_produced'].transform('sum')
+
+    errors = {}
+    for month in sorted(pm_df['month'].unique())[1:]:
+        before, actual = pm_df[pm_df['month'] < month], pm_df[pm_df['month'] == month]
+        for group, group_actual in actual.groupby('group'):
+            total = group_actual['heats_produced'].sum()
+            group_before = before[before['group'] == group].sort_values('month')
+            if not total or group_before.empty:
+                continue
+
+            smoothed = group_before.groupby('grade')['proportion'].apply(
+                lambda proportions: proportions.ewm(alpha=alpha, adjust=False).mean().iloc[-1]
+            ).fillna(0.)
+            shares = smoothed / smoothed.sum() if smoothed.sum() > 0 else smoothed * 0. + 1. / len(smoothed)
+
+            produced = group_actual.set_index('grade')['heats_produced']
+            grades = shares.index.union(produced.index)
+            forecasts = shares.reindex(grades, fill_value=0.) * total
+            errors.setdefault(group, []).extend(np.abs(forecasts - produced.reindex(grades, fill_value=0)))
+
+    return {group: np.mean(group_errors) for group, group_errors in errors.items()}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_backtest_matches_reference(seed):
+    history = _random_history(seed, n_grades=12, n_months=10)
+    alphas = [0.1, 0.3, 0.75]
+
+    result = backtesting.backtest(history, alphas)
+
+    for alpha in alphas:
+        errors = result.groups[result.groups['alpha'] == alpha]
+        assert dict(zip(errors['group'], errors['mae'])) == pytest.approx(_reference_mae(history, alpha))
+
+
+def test_best_alphas():
+    history = _random_history(0, n_grades=12, n_months=10)
+
+    result = backtesting.backtest(history)
+    best = result.best_alphas()
+
+    assert set(best) == set(result.groups['group'])
+    for group, alpha in best.items():
+        errors = result.groups[result.groups['group'] == group]
+        assert errors.loc[errors['alpha'] == alpha, 'mae'].iloc[0] == errors['mae'].min()
+
+
+def test_backtest_without_history():
+    result = backtesting.backtest([])
+
+    assert result.best_alphas() == {}
+    assert result.report({}) == []
+
+
+def test_set_smoothing_alphas(seeded_db):
+    history = pd.DataFrame(seeded_db.execute(db.select_production_history()).mappings().all())
+    versions = db.get_dataset_versions(seeded_db, db.smoothing_alphas)
+
+    smoothing.set_smoothing_alphas(seeded_db, {QualityGroup.REBAR: 0.9}, {QualityGroup.REBAR: 1.5})
+
+    assert dict(seeded_db.execute(db.select_smoothing_alphas()).all()) == {QualityGroup.REBAR: 0.9}
+    assert db.get_dataset_versions(seeded_db, db.smoothing_alphas) == (versions[0] + 1,)
+
+    state = pd.DataFrame(seeded_db.execute(sqla.select(db.grade_proportion_smoothing)).mappings().all())
+    expected = analysis.smoothing_states(history, alpha={QualityGroup.REBAR: 0.9})
+    key = ['month', 'group', 'grade']
+    merged = expected.merge(state, on=key, suffixes=('_expected', ''))
+    assert len(merged) == len(expected) == len(state)
+    assert merged['proportion'].astype(float).to_numpy() == pytest.approx(
+        merged['proportion_expected'].to_numpy(), nan_ok=True)
+
+    # storing the same alphas again changes nothing
+    smoothing.set_smoothing_alphas(seeded_db, {QualityGroup.REBAR: 0.9})
+    assert db.get_dataset_versions(seeded_db, db.smoothing_alphas) == (versions[0] + 1,)
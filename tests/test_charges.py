@@ -0,0 +1,56 @@
+import datetime
+
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import ReportPeriod, UploadFileType, UploadMode
+from steel_plans_api.pipeline import charges, create_db_pipeline, db
+
+
+def _charge_heats(conn):
+    table = db.charge_heats_monthly
+    return sorted(conn.execute(sqla.select(table)).all(), key=repr)
+
+
+def _is_rebuilt(conn):
+    heats = _charge_heats(conn)
+    charges.refresh_charge_heats(conn)
+    return heats == _charge_heats(conn)
+
+
+def test_charge_heats_are_maintained_on_upload(seeded_db, data_dir):
+    table = db.charge_heats_monthly
+    total = seeded_db.execute(sqla.select(sqla.func.sum(table.c.heats))).scalar_one()
+    charged = seeded_db.execute(sqla.select(sqla.func.count()).select_from(db.select_charges().subquery()))
+    assert total == charged.scalar_one() > 0
+    assert _is_rebuilt(seeded_db)
+
+    # a day of charges is taken out of the schedule
+    day = datetime.date(2024, 8, 30)
+    seeded_db.execute(sqla.delete(db.day_steel_production).where(db.day_steel_production.c.day == day))
+    db.bump_dataset_version(seeded_db, db.day_steel_production)
+    charges.refresh_charge_heats(seeded_db, [day])
+    assert seeded_db.execute(sqla.select(sqla.func.sum(table.c.heats))).scalar_one() < total
+
+    # and put back
+    with open(data_dir / UploadFileType.DAILY_CHARGE_SCHEDULE.value, 'rb') as f:
+        create_db_pipeline(UploadFileType.DAILY_CHARGE_SCHEDULE, UploadMode.REPLACE_RANGE)(seeded_db, f)
+    assert seeded_db.execute(sqla.select(sqla.func.sum(table.c.heats))).scalar_one() == total
+    assert _is_rebuilt(seeded_db)
+
+
+def test_count_heats():
+    rows = [
+        {'day': datetime.date(2024, 9, 1), 'grade': 'B500B', 'mould_size': '5"'},  # a Sunday
+        {'day': datetime.date(2024, 9, 2), 'grade': 'B500B', 'mould_size': '5"'},
+        {'day': datetime.date(2024, 9, 2), 'grade': 'B500B', 'mould_size': None},
+    ]
+
+    heats = charges.count_heats(rows, ReportPeriod.WEEK)
+    assert heats.to_dict(orient='records') == [
+        {'start': datetime.date(2024, 8, 26), 'grade': 'B500B', 'mould_size': '5"', 'heats': 1},
+        {'start': datetime.date(2024, 9, 2), 'grade': 'B500B', 'mould_size': '5"', 'heats': 1},
+        {'start': datetime.date(2024, 9, 2), 'grade': 'B500B', 'mould_size': None, 'heats': 1},
+    ]
+
+    heats = charges.count_heats(rows, ReportPeriod.MONTH, by_mould_size=False)
+    assert heats.to_dict(orient='records') == [{'start': datetime.date(2024, 9, 1), 'grade': 'B500B', 'heats': 3}]
@@ -0,0 +1,128 @@
+import datetime
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.exc import OperationalError
+
+from steel_plans_api import settings
+from steel_plans_api.enums import QualityGroup
+from steel_plans_api.pipeline import db
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'SQLITE_BUSY_TIMEOUT', 0.1)
+    monkeypatch.setattr(settings, 'SQLITE_MMAP_SIZE', 2 ** 20)
+
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = db._create_engine(url, pool_size=2)
+    read_engine = db._create_engine(url, pool_size=2, read_only=True)
+    db.metadata.create_all(engine)
+    yield engine, read_engine
+    engine.dispose()
+    read_engine.dispose()
+
+
+def test_reads_while_writing(engines):
+    engine, read_engine = engines
+
+    with engine.begin() as writer:
+        assert writer.exec_driver_sql('PRAGMA journal_mode').scalar() == settings.SQLITE_JOURNAL_MODE.lower()
+        assert writer.exec_driver_sql('PRAGMA mmap_size').scalar() == settings.SQLITE_MMAP_SIZE
+        db.bump_dataset_version(writer, db.month_steel_production)
+
+        # readers see the last committed snapshot, without waiting for the writer
+        with read_engine.begin() as reader:
+            assert db.get_dataset_versions(reader, db.month_steel_production) == (0,)
+
+        # writers take the write lock as they begin
+        with pytest.raises(OperationalError, match='locked'):
+            with engine.begin():
+                pass
+
+    with read_engine.begin() as reader:
+        assert db.get_dataset_versions(reader, db.month_steel_production) == (1,)
+
+
+def test_read_connections_are_read_only(engines):
+    _, read_engine = engines
+
+    with pytest.raises(OperationalError, match='readonly'):
+        with read_engine.begin() as reader:
+            db.bump_dataset_version(reader, db.month_steel_production)
+
+
+def test_after_commit(engines):
+    engine, _ = engines
+    called = []
+
+    with db.transaction(engine) as conn:
+        db.after_commit(conn, called.append)
+        db.after_commit(conn, called.append)
+        assert called == []
+    assert called == [engine]
+
+    with pytest.raises(ZeroDivisionError):
+        with db.transaction(engine) as conn:
+            db.after_commit(conn, called.append)
+            1 / 0
+    assert called == [engine]
+
+
+def test_memory_database_is_shared_by_readers(monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_URL', 'sqlite://')
+    db.get_engine.cache_clear()
+    db.get_read_engine.cache_clear()
+    try:
+        assert db.get_read_engine() is db.get_engine()
+    finally:
+        db.get_engine.cache_clear()
+        db.get_read_engine.cache_clear()
+
+
+def test_heats_produced_truncates(db_conn):
+    table = db.month_steel_production
+    db_conn.execute(sqla.insert(table), [
+        {'month': datetime.date(2024, 1, 1), 'grade': grade, 'group': QualityGroup.SBQ, 'short_tons': short_tons}
+        for grade, short_tons in (('A', 99), ('B', 100), ('C', 199))
+    ])
+
+    stmt = sqla.select(table.c.heats_produced).order_by(table.c.grade)
+    assert db_conn.execute(stmt).scalars().all() == [0, 1, 1]
+
+
+def test_postgresql_schema():
+    engine = sqla.create_mock_engine('postgresql+psycopg://', lambda *_: None)
+    ddl = '\n'.join(str(sqla.schema.CreateTable(table).compile(dialect=engine.dialect))
+                    for table in db.metadata.sorted_tables)
+
+    assert f'GENERATED ALWAYS AS (short_tons / {db.TONS_PER_HEAT}) STORED' in ddl
+    # NULL grades of charge schedules are allowed, and still identify their rows
+    assert 'PRIMARY KEY (day, start_time, grade)' not in ddl
+    index = sqla.schema.CreateIndex(*(index for index in db.day_steel_production.indexes if index.unique))
+    assert str(index.compile(dialect=engine.dialect)).endswith('NULLS NOT DISTINCT')
+
+
+def test_migration_removes_rows_breaking_unique_indexes(engines):
+    engine, _ = engines
+    table = db.month_group_order_forecast
+    month = datetime.date(2024, 1, 1)
+
+    # a database from before orders had one forecast per month and group
+    with engine.begin() as conn:
+        conn.exec_driver_sql('DROP INDEX ux_steel_grade_production_month_group')
+        conn.execute(sqla.insert(table), [
+            {'month': month, 'group': QualityGroup.REBAR, 'heats_orders_forecasted': 10},
+            {'month': month, 'group': QualityGroup.SBQ, 'heats_orders_forecasted': 20},
+            {'month': month, 'group': QualityGroup.REBAR, 'heats_orders_forecasted': 5},
+            {'month': month, 'group': QualityGroup.REBAR, 'heats_orders_forecasted': 30},
+        ])
+
+    db._migrate(engine)
+
+    with engine.begin() as conn:
+        rows = conn.execute(sqla.select(table.c.group, table.c.heats_orders_forecasted).order_by(table.c.group)).all()
+        assert rows == [(QualityGroup.REBAR, 30), (QualityGroup.SBQ, 20)]
+        assert db.get_dataset_versions(conn, table) == (1,)
+    indexes = {index['name']: index['unique'] for index in sqla.inspect(engine).get_indexes(table.name)}
+    assert indexes['ux_steel_grade_production_month_group']
@@ -0,0 +1,119 @@
+import csv
+import datetime
+import io
+import json
+
+import pandas as pd
+import pytest
+import sqlalchemy as sqla
+from fastapi import status
+
+from steel_plans_api import settings
+from steel_plans_api.enums import ExportDataset, ExportFormat, QualityGroup, UploadFileType
+from steel_plans_api.pipeline import db, export, models, pipelines
+
+
+def _stored(conn, dataset: ExportDataset) -> list[dict]:
+    table = export.TABLES[dataset]
+    rows = conn.execute(sqla.select(*(table.c[name] for name in db.upload_columns[table]))).mappings()
+    return sorted(({**row, 'group': row['group'].value} if 'group' in row else dict(row) for row in rows), key=str)
+
+
+@pytest.mark.parametrize('dataset', list(ExportDataset))
+def test_export_csv_can_be_uploaded(client, seeded_db, dataset):
+    response = client.get(f'/export/{dataset.value}')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/csv')
+    assert response.headers['content-disposition'] == f'attachment; filename="{dataset.value}.csv"'
+
+    # in the long layout uploads of the same type accept
+    parser = pipelines.pipelines[UploadFileType[dataset.name]][0]
+    entries = parser(io.BytesIO(response.content))
+    if not hasattr(entries, 'to_dict'):
+        entries = next(iter(entries))
+    actual = [{**entry, 'group': entry['group'].value} if 'group' in entry else entry
+              for entry in entries.to_dict(orient='records')]
+    assert sorted(actual, key=str) == _stored(seeded_db, dataset)
+
+
+@pytest.mark.parametrize('dataset', list(ExportDataset))
+def test_export_formats(client, seeded_db, dataset):
+    expected = _stored(seeded_db, dataset)
+
+    lines = client.get(f'/export/{dataset.value}', params={'format': 'ndjson'}).text.splitlines()
+    actual = [json.loads(line) for line in lines]
+    assert sorted(actual, key=str) == sorted(json.loads(json.dumps(expected, default=str)), key=str)
+
+    pytest.importorskip('pyarrow')
+    content = client.get(f'/export/{dataset.value}', params={'format': 'parquet'}).content
+    df = pd.read_parquet(io.BytesIO(content))
+    actual = [{name: None if pd.isna(value) else value for name, value in row.items()}
+              for row in df.to_dict(orient='records')]
+    assert sorted(actual, key=str) == expected
+
+
+def test_export_filters(client, seeded_db):
+    params = {'from': '2024-07', 'to': '2024-08', 'group': ['SBQ', 'CHQ']}
+    rows = list(csv.DictReader(io.StringIO(client.get('/export/production', params=params).text)))
+    assert rows and {row['month'] for row in rows} == {'2024-07-24', '2024-08-24'}
+    assert {row['group'] for row in rows} == {'SBQ', 'CHQ'}
+
+    grades = {row['grade'] for row in rows[:2]}
+    rows = list(csv.DictReader(io.StringIO(
+        client.get('/export/production', params=params | {'grade': sorted(grades)}).text
+    )))
+    assert {row['grade'] for row in rows} == grades
+
+    # charges are of the groups their grades were produced in
+    sbq = {row.grade for row in seeded_db.execute(sqla.select(db.month_steel_production.c.grade).where(
+        db.month_steel_production.c.group == QualityGroup.SBQ))}
+    rows = list(csv.DictReader(io.StringIO(client.get('/export/charges', params={'group': 'SBQ'}).text)))
+    assert rows and {row['grade'] for row in rows} <= sbq
+
+
+@pytest.mark.parametrize('params', [{'from': '2024-08', 'to': '2024-07'}, {'from': '2024-13'}, {'format': 'xlsx'},
+                                    {'grade': 'A36'}])
+def test_export_rejects_invalid_parameters(client, params):
+    response = client.get('/export/order_forecasts', params=params)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_export_is_written_a_chunk_at_a_time(seeded_db, monkeypatch):
+    monkeypatch.setattr(settings, 'EXPORT_CHUNK_ROWS', 7)
+    n_rows = len(_stored(seeded_db, ExportDataset.DAILY_CHARGE_SCHEDULE))
+
+    chunks = list(export.export_rows(seeded_db, ExportDataset.DAILY_CHARGE_SCHEDULE, ExportFormat.CSV))
+
+    assert len(chunks) == -(-n_rows // 7)
+    assert b''.join(chunks).decode().splitlines()[0] == 'day,start_time,grade,mould_size'
+    assert len(b''.join(chunks).decode().splitlines()) == n_rows + 1
+
+
+def test_export_forecasts(client, seeded_db):
+    response = client.get('/export/forecasts', params={'from': '2024-08', 'to': '2024-09', 'format': 'ndjson'})
+    assert response.status_code == status.HTTP_200_OK
+    rows = [json.loads(line) for line in response.text.splitlines()]
+
+    for month in ('2024-08', '2024-09'):
+        forecast = client.get('/forecast/production/', params={'month': month}).json()
+        expected = [{'month': f'{month}-01', 'group': group['group'], 'grade': grade['grade'], 'heats': grade['heats'],
+                     'proportion': grade['proportion']}
+                    for group in forecast['groups'] for grade in group['grades']]
+        assert [row for row in rows if row['month'] == f'{month}-01'] == expected
+
+    response = client.get('/export/forecasts', params={'from': '2024-08', 'to': '2024-08', 'group': 'SBQ'})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows and {(row['month'], row['group']) for row in rows} == {(str(datetime.date(2024, 8, 1)), 'SBQ')}
+
+
+def test_export_forecasts_fails_before_streaming(client, seeded_db, monkeypatch):
+    forecast_snapshot = models.forecast_snapshot
+
+    def forecast(snap, month, methods):
+        if month == datetime.date(2024, 9, 1):
+            raise ValueError('Cannot allocate heats to grades without a forecasted proportion')
+        return forecast_snapshot(snap, month, methods)
+
+    monkeypatch.setattr(models, 'forecast_snapshot', forecast)
+    response = client.get('/export/forecasts', params={'from': '2024-08', 'to': '2024-09'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,128 @@
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from steel_plans_api import jobs
+from steel_plans_api.concurrency import Busy
+from steel_plans_api.enums import JobStatus, UploadFileType, UploadMode
+from steel_plans_api.jobs import JobQueue, _Progress
+from steel_plans_api.pipeline import db, pipelines
+
+
+def _wait(job_queue, job_id):
+    for _ in range(100):
+        job = job_queue.get(job_id)
+        if job['status'] not in (JobStatus.QUEUED, JobStatus.RUNNING):
+            return job
+        job_queue._stopping.wait(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_interrupted_jobs_run_again(job_queue, data_dir):
+    file_type = UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    with open(data_dir / file_type.value, 'rb') as f:
+        job_id = job_queue.submit(file_type, UploadMode.APPEND, f)
+
+    # the process running it stopped before it finished
+    table = db.ingestion_jobs
+    with job_queue.engine.begin() as conn:
+        conn.execute(sqla.update(table).where(table.c.id == job_id).values(status=JobStatus.RUNNING))
+
+    job_queue.start()
+    job = _wait(job_queue, job_id)
+
+    assert job['status'] is JobStatus.SUCCEEDED
+    assert not job_queue._path(job_id).exists()
+
+
+def test_failed_job_loads_nothing(job_queue, data_dir):
+    job_queue.start()
+    # a production file uploaded as a charge schedule
+    with open(data_dir / UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION.value, 'rb') as f:
+        job_id = job_queue.submit(UploadFileType.DAILY_CHARGE_SCHEDULE, UploadMode.APPEND, f)
+    job = _wait(job_queue, job_id)
+
+    assert (job['status'], job['error']) == (JobStatus.FAILED, 'Invalid file format or structure')
+    assert not job_queue._path(job_id).exists()
+    with job_queue.engine.connect() as conn:
+        assert conn.execute(sqla.select(sqla.func.count()).select_from(db.day_steel_production)).scalar_one() == 0
+
+
+def test_progress_is_read_by_other_processes(job_queue, data_dir):
+    file_type = UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    with open(data_dir / file_type.value, 'rb') as f:
+        job_id = job_queue.submit(file_type, UploadMode.APPEND, f)
+    table = db.ingestion_jobs
+    with job_queue.engine.begin() as conn:
+        conn.execute(sqla.update(table).where(table.c.id == job_id).values(status=JobStatus.RUNNING))
+
+    # a worker of this process is loading it, another process's queue is asked
+    progress = _Progress(job_queue._progress_path(job_id))
+    progress(42)
+    other = JobQueue(job_queue.engine, job_queue.directory, job_queue.concurrency, queue_limit=2, poll_seconds=0.1)
+    assert other.get(job_id)['rows'] == 42
+
+    progress.close()
+    assert other.get(job_id)['rows'] == 0
+
+
+def test_rejected_uploads_leave_no_files(job_queue, data_dir):
+    file_type = UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    for _ in range(2):
+        with open(data_dir / file_type.value, 'rb') as f:
+            job_queue.submit(file_type, UploadMode.APPEND, f)
+
+    with open(data_dir / file_type.value, 'rb') as f, pytest.raises(Busy):
+        job_queue.submit(file_type, UploadMode.APPEND, f)
+    assert sorted(path.suffix for path in job_queue.directory.iterdir()) == ['.upload', '.upload']
+
+
+def _failing_once(monkeypatch, exc):
+    create_db_pipeline = pipelines.create_db_pipeline
+    calls = []
+
+    def fail_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise exc
+        return create_db_pipeline(*args)
+
+    monkeypatch.setattr(pipelines, 'create_db_pipeline', fail_once)
+    return calls
+
+
+def test_locked_database_queues_job_again(job_queue, data_dir, monkeypatch):
+    calls = _failing_once(monkeypatch, OperationalError('BEGIN IMMEDIATE', {}, Exception('database is locked')))
+    job_queue.start()
+    file_type = UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    with open(data_dir / file_type.value, 'rb') as f:
+        job_id = job_queue.submit(file_type, UploadMode.APPEND, f)
+    job = _wait(job_queue, job_id)
+
+    assert job['status'] is JobStatus.SUCCEEDED
+    assert len(calls) == 2
+
+
+def test_failed_job_keeps_file_the_database_failed(job_queue, data_dir, monkeypatch):
+    _failing_once(monkeypatch, InterfaceError('INSERT', {}, Exception('connection closed')))
+    job_queue.start()
+    file_type = UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION
+    with open(data_dir / file_type.value, 'rb') as f:
+        job_id = job_queue.submit(file_type, UploadMode.APPEND, f)
+    job = _wait(job_queue, job_id)
+
+    assert (job['status'], job['error']) == (JobStatus.FAILED, 'Failed to load the file')
+    assert job_queue._path(job_id).exists()
+
+
+def test_worker_survives_failing_to_record_failure(job_queue, data_dir, monkeypatch):
+    # an error the database can't store
+    monkeypatch.setattr(jobs, '_job_error', lambda exc: object())
+    job_queue.start()
+    file_type = UploadFileType.DAILY_CHARGE_SCHEDULE
+    with open(data_dir / UploadFileType.MONTHLY_STEEL_GRADE_PRODUCTION.value, 'rb') as f:
+        job_id = job_queue.submit(file_type, UploadMode.APPEND, f)
+
+    job_queue._stopping.wait(0.5)
+    assert all(worker.is_alive() for worker in job_queue._workers)
+    assert job_queue.get(job_id)['status'] is JobStatus.RUNNING
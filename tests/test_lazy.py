@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+from steel_plans_api.lazy import lazy_import
+
+
+def test_lazy_import(monkeypatch):
+    module = lazy_import('.pipeline.charges', 'steel_plans_api')
+    assert module.__name__ == 'steel_plans_api.pipeline.charges'
+
+    from steel_plans_api.pipeline import charges
+    assert module.count_heats is charges.count_heats
+    # attributes are looked up in the module on every use
+    monkeypatch.setattr(charges, 'count_heats', None)
+    assert module.count_heats is None
+
+
+def test_package_imports_pipelines_on_first_use():
+    code = """
+import sys
+import steel_plans_api
+from steel_plans_api import pipeline
+heavy = [f'steel_plans_api.pipeline.{name}' for name in pipeline.HEAVY_MODULES] + ['numpy', 'openpyxl', 'pandas']
+print(sorted(name for name in heavy if name in sys.modules))
+pipeline.create_db_pipeline
+print('pandas' in sys.modules)
+"""
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+
+    assert output.splitlines() == ['[]', 'True']
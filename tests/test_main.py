@@ -0,0 +1,49 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='workers are forked')
+def test_serve_forked_workers(tmp_path):
+    port = _free_port()
+    env = os.environ | {
+        'STEEL_PLANS_DATABASE_URL': f'sqlite:///{tmp_path}/app.db',
+        'STEEL_PLANS_JOBS_DIR': f'{tmp_path}/jobs',
+        'STEEL_PLANS_SNAPSHOT_DIR': f'{tmp_path}/snapshots',
+    }
+    command = [sys.executable, '-m', 'steel_plans_api', 'serve', '--port', str(port), '--workers', '2',
+               '--limit-max-requests', '2']
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=10) as client:
+            for _ in range(300):
+                try:
+                    client.get('/health')
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+
+            # workers that served their requests are replaced
+            statuses = set()
+            for _ in range(12):
+                try:
+                    statuses.add(client.get('/health').status_code)
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            assert statuses == {200}
+            assert client.get('/forecast/production/', params={'month': '2024-08'}).status_code == 404
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
@@ -0,0 +1,100 @@
+import pytest
+from fastapi import status
+
+from steel_plans_api import metrics, settings
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', ('stage',), buckets=(0.1, 1.))
+    histogram.observe(0.05, stage='a')
+    histogram.observe(0.5, stage='a')
+    histogram.observe(5, stage='a "quoted"')
+
+    assert histogram.render() == [
+        '# HELP test_seconds Test histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="a",le="0.1"} 1',
+        'test_seconds_bucket{stage="a",le="1"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 2',
+        'test_seconds_sum{stage="a"} 0.55',
+        'test_seconds_count{stage="a"} 2',
+        'test_seconds_bucket{stage="a \\"quoted\\"",le="0.1"} 0',
+        'test_seconds_bucket{stage="a \\"quoted\\"",le="1"} 0',
+        'test_seconds_bucket{stage="a \\"quoted\\"",le="+Inf"} 1',
+        'test_seconds_sum{stage="a \\"quoted\\""} 5',
+        'test_seconds_count{stage="a \\"quoted\\""} 1',
+    ]
+    assert histogram.count(stage='a') == 2
+    assert histogram.sum(stage='a') == pytest.approx(0.55)
+    assert histogram.sum(stage='b') == 0.
+
+
+def test_counter_render():
+    counter = metrics.Counter('test_total', 'Test counter', ('action',))
+    counter.inc(2, action='inserted')
+    counter.inc(action='inserted')
+
+    assert counter.render() == ['# HELP test_total Test counter', '# TYPE test_total counter',
+                                'test_total{action="inserted"} 3']
+
+
+def test_metrics_endpoint(client, data_dir):
+    parsed = metrics.ROWS_PROCESSED.get(file_type='MONTHLY_STEEL_GRADE_PRODUCTION', action='parsed')
+    with open(data_dir / 'steel_grade_production.xlsx', 'rb') as f:
+        client.post('/files/steel_grade_production.xlsx', files={'file': f})
+    with open(data_dir / 'product_groups_monthly.xlsx', 'rb') as f:
+        client.post('/files/product_groups_monthly.xlsx', files={'file': f})
+    client.get('/forecast/production/', params={'month': '2024-08'})
+
+    response = client.get('/metrics')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/plain')
+    text = response.text
+    for stage in ('upload.hash', 'upload.parse', 'upload.write', 'upload.refresh', 'forecast.breakdown',
+                  'forecast.allocate', 'forecast.serialize'):
+        assert f'steel_plans_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'steel_plans_request_seconds_count{method="GET",route="/forecast/production/",status="200"}' in text
+    assert 'steel_plans_sql_seconds_count{statement="SELECT"}' in text
+    assert metrics.ROWS_PROCESSED.get(file_type='MONTHLY_STEEL_GRADE_PRODUCTION', action='parsed') > parsed
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_profile(client, monkeypatch):
+    params = {'month': '2024-08', 'profile': 1}
+    monkeypatch.setattr(settings, 'ADMIN_TOKEN', 'secret')
+
+    response = client.get('/forecast/production/', params=params)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    response = client.get('/forecast/production/', params=params, headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.get('/forecast/production/', params=params, headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text.startswith('GET /forecast/production/ -> 200')
+    assert 'forecast_snapshot' in response.text
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_one_request_is_profiled_at_a_time(client, monkeypatch):
+    monkeypatch.setattr(settings, 'ADMIN_TOKEN', 'secret')
+    params = {'month': '2024-08', 'profile': 1}
+    headers = {'Authorization': 'Bearer secret'}
+
+    with metrics._profiling:
+        response = client.get('/forecast/production/', params=params, headers=headers)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        # requests that don't ask for a report aren't held up
+        assert client.get('/forecast/production/', params={'month': '2024-08'}).status_code == status.HTTP_200_OK
+
+    response = client.get('/forecast/production/', params=params, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text.startswith('GET /forecast/production/ -> 200')
+
+
+@pytest.mark.usefixtures('seeded_db')
+def test_profile_disabled_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(settings, 'ADMIN_TOKEN', None)
+
+    response = client.get('/forecast/production/', params={'month': '2024-08', 'profile': 1},
+                          headers={'Authorization': 'Bearer None'})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
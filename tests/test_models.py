@@ -0,0 +1,113 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline import analysis, models, smoothing, snapshot
+
+
+def _random_matrix(seed, n_months=15, n_grades=20):
+    rng = np.random.default_rng(seed)
+    values = rng.random((n_months, n_grades))
+    values[rng.random(values.shape) < 0.3] = 0.
+    values[rng.random(values.shape) < 0.2] = np.nan
+    # grades starting late, and one never known
+    for grade in range(n_grades):
+        values[:rng.integers(0, n_months // 2), grade] = np.nan
+    values[:, -1] = np.nan
+    return values, values > 0
+
+
+def _holt(series):
+    level, trend = None, 0.
+    for value in series[~np.isnan(series)]:
+        if level is None:
+            level = value
+            continue
+        previous = level
+        level = models.HOLT_ALPHA * value + (1 - models.HOLT_ALPHA) * (level + trend)
+        trend = models.HOLT_BETA * (level - previous) + (1 - models.HOLT_BETA) * trend
+    return np.nan if level is None else max(level + trend, 0.)
+
+
+def _croston(series):
+    size = interval = None
+    since_last = 1
+    for value in series[~np.isnan(series)]:
+        if value > 0:
+            if size is None:
+                size, interval = value, 1.
+            else:
+                size += models.CROSTON_ALPHA * (value - size)
+                interval += models.CROSTON_ALPHA * (since_last - interval)
+            since_last = 1
+        else:
+            since_last += 1
+    if size is None:
+        return 0. if (~np.isnan(series)).any() else np.nan
+    return size / interval
+
+
+def _moving_average(series):
+    known = series[~np.isnan(series)]
+    return known[-models.MOVING_AVERAGE_MONTHS:].mean() if len(known) else np.nan
+
+
+def _seasonal_naive(series):
+    known = series[~np.isnan(series)]
+    if len(series) >= models.SEASON_MONTHS and not np.isnan(series[-models.SEASON_MONTHS]):
+        return series[-models.SEASON_MONTHS]
+    return known[-1] if len(known) else np.nan
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('method, reference', [
+    (ForecastMethod.HOLT, _holt),
+    (ForecastMethod.CROSTON, _croston),
+    (ForecastMethod.MOVING_AVERAGE, _moving_average),
+    (ForecastMethod.SEASONAL_NAIVE, _seasonal_naive),
+])
+def test_models_match_reference(seed, method, reference):
+    values, present = _random_matrix(seed)
+
+    expected = [reference(values[:, grade]) for grade in range(values.shape[1])]
+
+    alphas = np.full(values.shape[1], analysis.ALPHA_ES)
+    assert models.MODELS[method].predict(values, present, alphas) == pytest.approx(expected, nan_ok=True)
+
+
+def test_every_method_is_registered():
+    assert set(models.MODELS) == set(ForecastMethod)
+
+
+def test_layout_snapshot():
+    sbq = snapshot.GROUPS.index(QualityGroup.SBQ)
+    jan, feb, apr = (snapshot.month_ordinal(datetime.date(2024, month, 1)) for month in (1, 2, 4))
+    # production of grades A (0) and B (1), sorted by group, grade and month
+    group = np.full(5, sbq, dtype=np.int8)
+    month = np.array([jan, feb, apr, jan, apr], dtype=np.int32)
+    grade = np.array([0, 0, 0, 1, 1], dtype=np.int32)
+    heats = np.array([1, 2, 1, 3, 1], dtype=np.int32)
+
+    groups, grades, values, present = models._layout_snapshot(group, month, grade, heats, apr + 1)
+
+    assert (groups.tolist(), grades.tolist()) == ([sbq, sbq], [0, 1])
+    # B isn't produced in February, nothing is known of March
+    np.testing.assert_array_equal(values, [[0.25, 0.75], [1., 0.], [np.nan, np.nan], [0.5, 0.5]])
+    np.testing.assert_array_equal(present, [[True, True], [True, False], [False, False], [True, True]])
+
+
+def test_ewm_model_matches_smoothing_state(seeded_db):
+    # groups smoothed with factors of their own
+    smoothing.set_smoothing_alphas(seeded_db, {QualityGroup.SBQ: 0.6, QualityGroup.CHQ: 0.1})
+    snap = snapshot.get_snapshot(seeded_db)
+    until = int(snap.production_month.max()) + 1
+    codes = list(range(len(snapshot.GROUPS)))
+
+    group, grade, values, present = models._layout_snapshot(*snap.production(until, codes), until)
+    state_group, state_grade, proportions = snap.smoothing_state(until, codes)
+
+    assert (group.tolist(), grade.tolist()) == (state_group.tolist(), state_grade.tolist())
+    predicted = models.MODELS[ForecastMethod.EWM].predict(values, present, snap.alphas[group])
+    np.testing.assert_array_equal(predicted, proportions)
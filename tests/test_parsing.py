@@ -1,5 +1,12 @@
+import csv
+import datetime
+import io
+
+import openpyxl
+import pandas as pd
 import pytest
 
+from steel_plans_api.enums import FileFormat
 from steel_plans_api.pipeline import parsing
 
 cases = [
@@ -10,6 +17,15 @@ cases = [
                  id='Wrong parser'),
 ]
 
+columnar_cases = [
+    pytest.param('steel_grade_production.xlsx', parsing.parse_monthly_steel_grade_file,
+                 parsing.parse_monthly_steel_grade_file_columnar),
+    pytest.param('daily_charge_schedule.xlsx', parsing.parse_daily_charge_schedule_file,
+                 parsing.parse_daily_charge_schedule_file_columnar),
+    pytest.param('product_groups_monthly.xlsx', parsing.parse_monthly_order_forecasts_file,
+                 parsing.parse_monthly_order_forecasts_file_columnar),
+]
+
 
 @pytest.mark.parametrize('upload_file, parser', cases)
 def test_parse(upload_file, data_dir, parser):
@@ -17,3 +33,171 @@ def test_parse(upload_file, data_dir, parser):
         infos = parser(f)
 
     assert len(infos) > 0
+
+
+@pytest.mark.parametrize('upload_file, parser, columnar_parser', columnar_cases)
+def test_parse_columnar(upload_file, data_dir, parser, columnar_parser):
+    with open(data_dir / upload_file, 'rb') as f:
+        expected = [info.model_dump() for info in parser(f)]
+    with open(data_dir / upload_file, 'rb') as f:
+        actual = columnar_parser(f).to_dict(orient='records')
+
+    assert actual == expected
+
+
+@pytest.mark.parametrize('upload_file, parser, columnar_parser', columnar_cases)
+def test_pack_entries(upload_file, data_dir, parser, columnar_parser):
+    with open(data_dir / upload_file, 'rb') as f:
+        entries = columnar_parser(f)
+
+    packed = parsing.pack_entries(entries)
+    assert all(values.dtype != object for name, (_, values) in packed.items() if name not in ('grade', 'mould_size'))
+    assert parsing.unpack_entries(packed).to_dict(orient='records') == entries.to_dict(orient='records')
+
+
+malformed_cases = [
+    ('steel_grade_production.xlsx', 'B3', 1020),  # numeric grade
+    ('steel_grade_production.xlsx', 'C4', 'abc'),  # text tons
+    ('steel_grade_production.xlsx', 'C3', 8724.5),  # fractional tons
+    ('steel_grade_production.xlsx', 'A3', 'Rebarr'),  # unknown quality group
+    ('steel_grade_production.xlsx', 'B4', 'B500X'),  # still valid
+    ('daily_charge_schedule.xlsx', 'B4', 1020),  # numeric grade
+    ('daily_charge_schedule.xlsx', 'A4', 'noon'),  # text start time
+    ('daily_charge_schedule.xlsx', 'C4', 6.5),  # numeric mould size
+    ('daily_charge_schedule.xlsx', 'B5', '-'),  # still valid
+    ('product_groups_monthly.xlsx', 'B3', 'abc'),  # text heats
+    ('product_groups_monthly.xlsx', 'B3', 12.5),  # fractional heats
+    ('product_groups_monthly.xlsx', 'A3', 'XYZ'),  # unknown quality group
+]
+
+
+@pytest.mark.parametrize('upload_file, cell, value', malformed_cases)
+def test_parse_columnar_is_as_strict(upload_file, data_dir, cell, value):
+    _, parser, columnar_parser = next(case.values for case in columnar_cases if case.values[0] == upload_file)
+
+    workbook = openpyxl.load_workbook(data_dir / upload_file)
+    workbook.active[cell] = value
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    expected = actual = None
+    try:
+        expected = [info.model_dump() for info in parser(io.BytesIO(buffer.getvalue()))]
+    except Exception:
+        with pytest.raises(Exception):
+            columnar_parser(io.BytesIO(buffer.getvalue()))
+    else:
+        actual = columnar_parser(io.BytesIO(buffer.getvalue())).to_dict(orient='records')
+
+    assert actual == expected
+
+
+def test_parse_columnar_rejects_month_with_time(data_dir):
+    workbook = openpyxl.load_workbook(data_dir / 'steel_grade_production.xlsx')
+    workbook.active['C2'] = datetime.datetime(2024, 6, 24, 10)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    for parser in (parsing.parse_monthly_steel_grade_file, parsing.parse_monthly_steel_grade_file_columnar):
+        with pytest.raises(Exception):
+            parser(io.BytesIO(buffer.getvalue()))
+
+
+def test_parse_rejects_fractional_imputed_counts(data_dir):
+    workbook = openpyxl.load_workbook(data_dir / 'steel_grade_production.xlsx')
+    # the 14 values left in the month have a fractional median
+    workbook.active['C3'] = workbook.active['C6'] = None
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+
+    for parser in (parsing.parse_monthly_steel_grade_file, parsing.parse_monthly_steel_grade_file_columnar):
+        with pytest.raises(ValueError):
+            parser(io.BytesIO(buffer.getvalue()))
+
+
+@pytest.mark.parametrize('batch_size', [1, 10, 5_000])
+def test_iter_daily_charge_schedule_file(data_dir, batch_size):
+    with open(data_dir / 'daily_charge_schedule.xlsx', 'rb') as f:
+        expected = parsing.parse_daily_charge_schedule_file_columnar(f).to_dict(orient='records')
+    with open(data_dir / 'daily_charge_schedule.xlsx', 'rb') as f:
+        batches = list(parsing.iter_daily_charge_schedule_file(f, batch_size=batch_size))
+
+    assert all(len(batch) <= max(batch_size, 3) for batch in batches)
+
+    def key(entry):
+        return entry['day'], entry['start_time']
+
+    actual = [entry for batch in batches for entry in batch.to_dict(orient='records')]
+    assert sorted(actual, key=key) == sorted(expected, key=key)
+
+
+def _wide_csv(path) -> bytes:
+    # as the workbook is saved as CSV
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(openpyxl.load_workbook(path).active.iter_rows(values_only=True))
+    return buffer.getvalue().encode()
+
+
+def _long_csv(entries: pd.DataFrame) -> bytes:
+    entries = entries.copy()
+    if 'group' in entries:
+        entries['group'] = [group.value.title() for group in entries['group']]
+    return entries.fillna('-').to_csv(index=False).encode()
+
+
+@pytest.mark.parametrize('upload_file, parser, columnar_parser', columnar_cases)
+def test_parse_csv(upload_file, data_dir, parser, columnar_parser):
+    with open(data_dir / upload_file, 'rb') as f:
+        expected = columnar_parser(f)
+
+    wide = _wide_csv(data_dir / upload_file)
+    long = _long_csv(expected).replace(b'month,', b'Month,')  # column names ignore case
+
+    for content in (wide, long):
+        assert parsing.detect_format(io.BytesIO(content)) is FileFormat.CSV
+        actual = columnar_parser(io.BytesIO(content))
+        assert actual.to_dict(orient='records') == expected.to_dict(orient='records')
+
+
+@pytest.mark.parametrize('upload_file, parser, columnar_parser', columnar_cases)
+def test_parse_parquet(upload_file, data_dir, parser, columnar_parser):
+    pytest.importorskip('pyarrow')
+    with open(data_dir / upload_file, 'rb') as f:
+        expected = columnar_parser(f)
+
+    long = expected.copy()
+    if 'group' in long:
+        long['group'] = [group.value for group in long['group']]
+    # the header of the workbook as column names, without the title row
+    wide = pd.read_csv(io.BytesIO(_wide_csv(data_dir / upload_file)), skiprows=1).dropna(how='all')
+
+    for df in (wide, long):
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        assert parsing.detect_format(io.BytesIO(buffer.getvalue())) is FileFormat.PARQUET
+        actual = columnar_parser(io.BytesIO(buffer.getvalue()))
+        assert actual.to_dict(orient='records') == expected.to_dict(orient='records')
+
+
+@pytest.mark.parametrize('content', [
+    b'month,group,grade,short_tons\n2024-06-24,Rebar,B500A,\n',  # missing tons
+    b'month,group,grade,short_tons\n2024-06-24,Rebar,B500A,12.5\n',  # fractional tons
+    b'month,group,grade,short_tons\n2024-06-24,Rebarr,B500A,12\n',  # unknown quality group
+    b'month,group,grade,short_tons\n2024-06-24,,B500A,12\n',  # missing quality group
+    b'month,group,grade,short_tons\n2024-06-24 10:00,Rebar,B500A,12\n',  # month with time
+    b'month,group,grade,short_tons\njune,Rebar,B500A,12\n',  # text month
+])
+def test_parse_long_csv_is_strict(content):
+    with pytest.raises(Exception):
+        parsing.parse_monthly_steel_grade_file_columnar(io.BytesIO(content))
+
+
+def test_iter_daily_charge_schedule_csv(data_dir):
+    with open(data_dir / 'daily_charge_schedule.xlsx', 'rb') as f:
+        expected = parsing.parse_daily_charge_schedule_file_columnar(f).to_dict(orient='records')
+
+    content = _long_csv(pd.DataFrame(expected))
+    batches = list(parsing.iter_daily_charge_schedule_file(io.BytesIO(content), batch_size=10))
+
+    assert all(len(batch) <= 10 for batch in batches)
+    assert [entry for batch in batches for entry in batch.to_dict(orient='records')] == expected
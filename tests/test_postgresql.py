@@ -0,0 +1,70 @@
+"""Runs the pipelines on PostgreSQL as well, when STEEL_PLANS_TEST_POSTGRES_URL points to a database to test on
+(e.g. postgresql+psycopg://postgres@localhost/test), and checks that they store the same as on SQLite"""
+import io
+import os
+
+import openpyxl
+import pytest
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import UploadFileType, UploadMode
+from steel_plans_api.pipeline import create_db_pipeline, db
+
+POSTGRES_URL = os.environ.get('STEEL_PLANS_TEST_POSTGRES_URL')
+
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason='STEEL_PLANS_TEST_POSTGRES_URL is not set')
+
+
+@pytest.fixture(scope='module')
+def pg_engine():
+    engine = db._create_engine(POSTGRES_URL, pool_size=1)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    yield engine
+    db.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def pg_conn(pg_engine):
+    with pg_engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            yield conn
+        finally:
+            trans.rollback()
+
+
+def _contents(conn, table):
+    columns = [column for column in table.columns if column.name not in ('id', 'created_at')]
+    return sorted(conn.execute(sqla.select(*columns)).all(), key=repr)
+
+
+def _workbook(data_dir, file_type, **cells):
+    workbook = openpyxl.load_workbook(data_dir / file_type.value)
+    for cell, value in cells.items():
+        workbook.active[cell] = value
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+uploads = [
+    (UploadMode.APPEND, {}),
+    (UploadMode.UPSERT, {'steel_grade_production.xlsx': {'C3': 9999},
+                         'daily_charge_schedule.xlsx': {'C4': '6"', 'B5': '-'},
+                         'product_groups_monthly.xlsx': {'B3': 1}}),
+    (UploadMode.REPLACE_RANGE, {'steel_grade_production.xlsx': {'B3': 'B500X'}}),
+]
+
+
+def test_pipelines_store_the_same(pg_conn, db_conn, data_dir):
+    for mode, changes in uploads:
+        for file_type in UploadFileType:
+            content = _workbook(data_dir, file_type, **changes.get(file_type.value, {}))
+            for conn in (db_conn, pg_conn):
+                create_db_pipeline(file_type, mode)(conn, io.BytesIO(content))
+
+        for table in db.metadata.sorted_tables:
+            if table is not db.ingestion_jobs:
+                assert _contents(pg_conn, table) == _contents(db_conn, table), (mode, table.name)
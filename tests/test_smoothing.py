@@ -0,0 +1,58 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sqla
+
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline import analysis, db, models, smoothing, snapshot
+
+from .reference import history_frame
+
+
+def _state(conn):
+    stmt = sqla.select(db.grade_proportion_smoothing).order_by(*db.grade_proportion_smoothing.primary_key)
+    return conn.execute(stmt).all()
+
+
+def test_forecast_from_state_matches_full_history(seeded_db):
+    omf_df = pd.DataFrame(seeded_db.execute(sqla.select(db.month_group_order_forecast)).mappings().all())
+    snap = snapshot.get_snapshot(seeded_db)
+    ewm = dict.fromkeys(QualityGroup, ForecastMethod.EWM)
+
+    for month in sorted(omf_df['month'].unique()):
+        until = month.replace(day=1)
+        history_df = history_frame(seeded_db.execute(db.select_production_history(until)).mappings().all())
+        expected = analysis._do_forecast_breakdown(omf_df[omf_df['month'] == month], history_df,
+                                                   pd.Period(until, freq='M'))
+
+        # forecasts read the smoothing state the snapshot is taken of
+        actual = [breakdown.to_model() for breakdown in models.forecast_snapshot(snap, until, ewm)]
+
+        assert [group.model_dump() for group in actual] == [group.model_dump() for group in expected]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_late_months_match_rebuild(db_conn, seed):
+    rng = np.random.default_rng(seed)
+    groups = list(QualityGroup)
+    months = [datetime.date(2023, m, 24) for m in range(1, 13)]
+    rows = [
+        {'month': month, 'group': groups[i % len(groups)], 'grade': f'G{i}', 'short_tons': int(tons)}
+        for i in range(10)
+        for month, tons in zip(months, rng.integers(0, 3000, len(months)))
+        if rng.random() > 0.2
+    ]
+
+    # months arrive out of order, each upload recomputing from its earliest month
+    for month in rng.permutation(len(months)):
+        uploaded = [row for row in rows if row['month'] == months[month]]
+        if uploaded:
+            db_conn.execute(sqla.insert(db.month_steel_production), uploaded)
+            smoothing.refresh_smoothing_state(db_conn, months[month], {row['group'] for row in uploaded})
+
+    incremental = _state(db_conn)
+    smoothing.refresh_smoothing_state(db_conn)
+
+    assert incremental == _state(db_conn)
@@ -0,0 +1,124 @@
+import datetime
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy as sqla
+
+from steel_plans_api import metrics, settings
+from steel_plans_api.enums import ForecastMethod, QualityGroup
+from steel_plans_api.pipeline import analysis, db, models, snapshot
+
+from .reference import forecast_breakdown_reference, history_frame, predict_proportions_reference
+
+
+def _order_months(conn) -> list[datetime.date]:
+    return sorted({row.month.replace(day=1) for row in conn.execute(sqla.select(db.month_group_order_forecast))})
+
+
+def test_month_ordinals():
+    assert snapshot.month_ordinal(datetime.date(1970, 1, 31)) == 0
+    assert snapshot.month_ordinal(datetime.date(2024, 8, 24)) == 655
+    assert snapshot.month_date(655) == datetime.date(2024, 8, 1)
+    assert snapshot.month_date(-1) == datetime.date(1969, 12, 1)
+
+
+def test_snapshot_columns(seeded_db):
+    snap = snapshot.get_snapshot(seeded_db)
+
+    assert snap.versions == db.get_dataset_versions(seeded_db, *snapshot.TABLES)
+    assert (snap.production_month.dtype, snap.production_group.dtype, snap.production_grade.dtype,
+            snap.production_heats.dtype) == (np.int32, np.int8, np.int32, np.int32)
+    assert list(snap.grades) == sorted(snap.grades)
+
+    rows = sorted(
+        (row.group, row.grade, snapshot.month_ordinal(row.month), row.heats_produced)
+        for row in seeded_db.execute(db.select_production_history())
+    )
+    assert rows == [
+        (snapshot.GROUPS[group], snap.grades[grade], month, heats)
+        for group, grade, month, heats in zip(snap.production_group.tolist(), snap.production_grade.tolist(),
+                                              snap.production_month.tolist(), snap.production_heats.tolist())
+    ]
+
+
+def test_snapshot_is_written_once_and_mapped(seeded_db):
+    snap = snapshot.get_snapshot(seeded_db)
+    path = pathlib.Path(settings.SNAPSHOT_DIR) / db.get_database_id(seeded_db) / '-'.join(map(str, snap.versions))
+    assert isinstance(snap.production_heats, np.memmap)
+    assert sorted(file.name for file in path.iterdir()) == sorted(f'{name}.npy' for name in snapshot._ARRAYS)
+
+    # other processes open the written snapshot instead of building it
+    builds = metrics.STAGE_SECONDS.count(stage='snapshot.build')
+    snapshot.clear()
+    assert snapshot.get_snapshot(seeded_db).versions == snap.versions
+    assert metrics.STAGE_SECONDS.count(stage='snapshot.build') == builds
+
+
+def test_newer_snapshot_replaces_older(seeded_db):
+    old = snapshot.get_snapshot(seeded_db)
+    db.bump_dataset_version(seeded_db, db.month_group_order_forecast)
+
+    new = snapshot.get_snapshot(seeded_db)
+
+    assert new.versions != old.versions
+    directory = pathlib.Path(settings.SNAPSHOT_DIR) / db.get_database_id(seeded_db)
+    assert [path.name for path in directory.iterdir()] == ['-'.join(map(str, new.versions))]
+    # open snapshots can still be read
+    assert old.production_heats.sum() == new.production_heats.sum()
+
+
+def test_databases_do_not_share_snapshots(seeded_db, tmp_path):
+    snap = snapshot.get_snapshot(seeded_db)
+
+    # another database at the same versions, with none of the data
+    engine = sqla.create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table, version in zip(snapshot.TABLES, snap.versions):
+            conn.execute(sqla.insert(db.dataset_versions).values(table_name=table.name, version=version))
+        assert db.get_database_id(conn) != db.get_database_id(seeded_db)
+
+        other = snapshot.get_snapshot(conn)
+    engine.dispose()
+
+    assert other.versions == snap.versions
+    assert len(other.production_heats) == 0 < len(snap.production_heats)
+    assert len(list(pathlib.Path(settings.SNAPSHOT_DIR).iterdir())) == 2
+
+
+def _expected_forecast(conn, month: datetime.date, methods) -> list[dict]:
+    """Forecast of `month` from the rows of `conn`, through the references"""
+
+    omf_df = pd.DataFrame(conn.execute(db.select_order_forecasts(month, analysis.add_months(month, 1))).mappings().all(),
+                          columns=['month', 'group', 'heats_orders_forecasted'])
+    history_df = history_frame(conn.execute(db.select_production_history(month)).mappings().all())
+    period = pd.Period(month, freq='M')
+
+    groups = [group for group in forecast_breakdown_reference(omf_df, history_df.copy(), period)
+              if methods[group.group] is ForecastMethod.EWM]
+    for method in {method for method in methods.values() if method is not ForecastMethod.EWM}:
+        in_method = history_df['group'].map(methods) == method
+        proportions = predict_proportions_reference(history_df[in_method], period, method)
+        groups += [breakdown.to_model() for breakdown in analysis._breakdown_smoothed_arrays(omf_df, proportions)]
+    return [group.model_dump() for group in sorted(groups, key=lambda group: group.group)]
+
+
+@pytest.mark.parametrize('method', list(ForecastMethod))
+def test_forecast_snapshot_matches_references(seeded_db, method):
+    snap = snapshot.get_snapshot(seeded_db)
+    methods = dict.fromkeys(QualityGroup, method) | {QualityGroup.REBAR: ForecastMethod.EWM}
+
+    for month in _order_months(seeded_db):
+        try:
+            expected = _expected_forecast(seeded_db, month, methods)
+        except ValueError:
+            with pytest.raises(ValueError):
+                models.forecast_snapshot(snap, month, methods)
+            continue
+
+        actual = models.forecast_snapshot(snap, month, methods)
+        assert [breakdown.to_model().model_dump() for breakdown in actual] == expected
+        for breakdown in actual:
+            assert breakdown.grade_heats.sum() == breakdown.heats